@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+u"""asyncio counterparts of ``find_delta`` and ``simulate_crl`` of ``bnlcrl simulate``.
+
+The synchronous functions run in an executor (the default one of the event loop unless specified), so neither the
+HTTP requests of the remote ``find_delta`` queries nor the table lookups and the matrix calculations block the event
+loop. The ``*_many_async`` functions run a list of queries concurrently with at most ``limit`` of them at a time::
+
+    results = await find_delta_many_async([{'energy': e, 'formula': f} for e in energies for f in formulas])
+
+:copyright: Copyright (c) 2016 mrakitin.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+
+import asyncio
+import functools
+
+DEFAULT_LIMIT = 8  # number of queries running at the same time
+
+
+async def find_delta_async(energy, semaphore=None, executor=None, **kwargs):
+    """Run ``find_delta`` (see ``bnlcrl simulate find-delta``) without blocking the event loop.
+
+    :param energy: photon energy [eV].
+    :param semaphore: optional :class:`asyncio.Semaphore` limiting the number of concurrent queries.
+    :param executor: optional :class:`concurrent.futures.Executor`, the default one of the event loop otherwise.
+    :param kwargs: the other parameters of ``find_delta``.
+    :return: dictionary with the result.
+    """
+    from bnlcrl.pkcli.simulate import find_delta
+
+    return await _run(find_delta, dict(kwargs, energy=energy), semaphore, executor)
+
+
+async def find_delta_many_async(queries, limit=DEFAULT_LIMIT, executor=None, return_exceptions=False):
+    """Run many ``find_delta`` queries concurrently.
+
+    :param queries: list of dictionaries with the parameters of ``find_delta``.
+    :param limit: maximum number of queries running at the same time.
+    :param executor: optional :class:`concurrent.futures.Executor`.
+    :param return_exceptions: a flag to return the exceptions of the failed queries instead of raising the first one.
+    :return: list of the results in the order of ``queries``.
+    """
+    semaphore = asyncio.Semaphore(limit)
+    return await asyncio.gather(
+        *[find_delta_async(semaphore=semaphore, executor=executor, **q) for q in queries],
+        return_exceptions=return_exceptions
+    )
+
+
+async def simulate_crl_async(cart_ids, energy, semaphore=None, executor=None, **kwargs):
+    """Run ``simulate_crl`` (see ``bnlcrl simulate simulate-crl``) without blocking the event loop.
+
+    :param cart_ids: ids of the inserted cartridges.
+    :param energy: photon energy [eV].
+    :param semaphore: optional :class:`asyncio.Semaphore` limiting the number of concurrent simulations.
+    :param executor: optional :class:`concurrent.futures.Executor`, the default one of the event loop otherwise.
+    :param kwargs: the other parameters of ``simulate_crl``.
+    :return: dictionary with the result.
+    """
+    from bnlcrl.pkcli.simulate import simulate_crl
+
+    return await _run(simulate_crl, dict(kwargs, cart_ids=cart_ids, energy=energy), semaphore, executor)
+
+
+async def simulate_crl_many_async(queries, limit=DEFAULT_LIMIT, executor=None, return_exceptions=False):
+    """Run many ``simulate_crl`` queries concurrently (see :func:`find_delta_many_async`)."""
+    semaphore = asyncio.Semaphore(limit)
+    return await asyncio.gather(
+        *[simulate_crl_async(semaphore=semaphore, executor=executor, **q) for q in queries],
+        return_exceptions=return_exceptions
+    )
+
+
+async def _run(function, kwargs, semaphore, executor):
+    loop = asyncio.get_running_loop()
+    if semaphore is None:
+        return await loop.run_in_executor(executor, functools.partial(function, **kwargs))
+    async with semaphore:
+        return await loop.run_in_executor(executor, functools.partial(function, **kwargs))
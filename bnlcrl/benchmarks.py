@@ -0,0 +1,427 @@
+# -*- coding: utf-8 -*-
+u"""Benchmarks of the simulator, the delta lookup and the command line startup.
+
+Each benchmark prepares its inputs once and returns the function to time. The function is called in a loop long
+enough to be measured (``min_time`` per round) and the rounds are repeated; the statistics are per call, in seconds,
+and are written as JSON close to the ``pytest-benchmark`` format::
+
+    {"benchmarks": [{"group": ..., "name": ..., "stats": {"iterations": ..., "max": ..., "mean": ..., "median": ...,
+                     "min": ..., "ops": ..., "rounds": ..., "stddev": ...}}, ...],
+     "datetime": ..., "machine_info": {...}}
+
+All benchmarks use the local data files, no network access is needed.
+
+The regression gate (:func:`check`) runs the fixed set :data:`GATE`, divides the fastest round of each benchmark by
+the duration of a pure-Python calibration loop measured in the same process, so the numbers are comparable across
+machines of different speed, and compares them with the committed :data:`BASELINE_FILE`. A benchmark fails the gate
+if it is slower than ``ratio`` times its baseline; it is measured again before failing to rule out a busy machine.
+:func:`update_baseline` refreshes the baseline file.
+
+:copyright: Copyright (c) 2016 mrakitin.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+
+import contextlib
+import fnmatch
+import glob
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+
+from bnlcrl.crl_simulator import CONFIG_DIR, CRLSimulator
+from bnlcrl.delta_finder import DAT_DIR, DeltaFinder, _read_data_file
+from bnlcrl.utils import read_json
+
+CART_IDS = ['2', '4', '6', '7', '8']
+ENERGY = 21500.
+P0 = 6.52
+
+BASELINE_FILE = os.path.join(CONFIG_DIR, 'benchmark_baseline.json')
+CALIBRATION_LOOPS = 100000
+DEFAULT_RATIO = 1.5
+# Benchmarks of the regression gate:
+GATE = (
+    'energy_sweep/simulator',
+    'find_delta/Be_atten.dat/python',
+    'find_delta/Be_delta.dat/numpy',
+    'find_delta/Be_delta.dat/python',
+    'get_cli_functions/crl',
+    'get_cli_functions/delta',
+    'simulate_crl/numpy',
+    'simulate_crl/python',
+)
+
+# Registered benchmarks: name -> (group, function returning the function to time):
+BENCHMARKS = {}
+
+
+def benchmark(name, group):
+    """Register a benchmark (see :data:`BENCHMARKS`)."""
+    def decorator(function):
+        if name in BENCHMARKS:
+            raise Exception('Benchmark <{}> is already registered.'.format(name))
+        BENCHMARKS[name] = (group, function)
+        return function
+
+    return decorator
+
+
+def calibrate(repeat=5):
+    """Get the duration of the calibration loop [s], the fastest of ``repeat`` runs."""
+    return min(timeit.repeat(_calibration_loop, number=1, repeat=repeat))
+
+
+def check(baseline_file=None, ratio=DEFAULT_RATIO, retries=2, repeat=5, min_time=0.05):
+    """Run the regression gate.
+
+    :param baseline_file: baseline JSON file, :data:`BASELINE_FILE` by default.
+    :param ratio: maximum allowed ratio of the normalized timings to the baseline.
+    :param retries: number of times a benchmark slower than allowed is measured again.
+    :param repeat: number of rounds of each benchmark.
+    :param min_time: minimum duration of a round [s].
+    :return: list of dictionaries per benchmark (see :func:`compare`).
+    """
+    baseline = read_json(baseline_file or BASELINE_FILE)
+    current = measure(select=[x for x in GATE if x in baseline['benchmarks']], repeat=repeat, min_time=min_time)
+    comparison = compare(current, baseline, ratio=ratio)
+    for _ in range(retries):
+        regressed = [x['name'] for x in comparison if x['regressed']]
+        if not regressed:
+            break
+        again = measure(select=regressed, repeat=repeat, min_time=min_time)
+        for name, v in again['benchmarks'].items():
+            if v['normalized'] < current['benchmarks'][name]['normalized']:
+                current['benchmarks'][name] = v
+        comparison = compare(current, baseline, ratio=ratio)
+    return comparison
+
+
+def compare(current, baseline, ratio=DEFAULT_RATIO):
+    """Compare the normalized timings (see :func:`measure`) of the benchmarks found in both.
+
+    :return: list of dictionaries with ``name``, ``baseline``, ``current``, ``ratio`` and ``regressed`` sorted by name.
+    """
+    result = []
+    for name in sorted(set(current['benchmarks']) & set(baseline['benchmarks'])):
+        b = baseline['benchmarks'][name]['normalized']
+        c = current['benchmarks'][name]['normalized']
+        result.append({
+            'baseline': b,
+            'current': c,
+            'name': name,
+            'ratio': c / b,
+            'regressed': c > b * ratio,
+        })
+    return result
+
+
+def machine_info():
+    import numpy
+
+    return {
+        'cpu_count': os.cpu_count(),
+        'machine': platform.machine(),
+        'numpy_version': numpy.__version__,
+        'processor': platform.processor(),
+        'python_implementation': platform.python_implementation(),
+        'python_version': platform.python_version(),
+        'system': platform.system(),
+    }
+
+
+def measure(select=GATE, repeat=5, min_time=0.05):
+    """Measure the benchmarks normalized by the calibration loop.
+
+    :return: dictionary with the calibration [s], the machine info and ``min`` [s] and ``normalized`` per benchmark.
+    """
+    calibration = calibrate()
+    r = run(select=select, repeat=repeat, min_time=min_time)
+    # The calibration is measured before and after to average out slow drifts of the machine speed:
+    calibration = (calibration + calibrate()) / 2.
+    benchmarks = {}
+    for x in r['benchmarks']:
+        benchmarks[x['name']] = {
+            'min': x['stats']['min'],
+            'normalized': x['stats']['min'] / calibration,
+        }
+    return {
+        'benchmarks': benchmarks,
+        'calibration': calibration,
+        'datetime': r['datetime'],
+        'machine_info': r['machine_info'],
+    }
+
+
+def run(select=None, repeat=5, min_time=0.05):
+    """Run the benchmarks.
+
+    :param select: optional shell-style pattern (or a list of them) of the benchmark names to run, all by default.
+    :param repeat: number of rounds of each benchmark.
+    :param min_time: minimum duration of a round [s], the number of calls per round is chosen to reach it.
+    :return: dictionary with the machine info and the statistics of each benchmark.
+    """
+    names = select_names(select)
+    results = []
+    for name in names:
+        group, function = BENCHMARKS[name]
+        results.append({
+            'group': group,
+            'name': name,
+            'stats': time_function(function(), repeat=repeat, min_time=min_time),
+        })
+    return {
+        'benchmarks': results,
+        'datetime': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'machine_info': machine_info(),
+    }
+
+
+def select_names(select=None):
+    names = sorted(BENCHMARKS)
+    if select is None:
+        return names
+    patterns = [select] if isinstance(select, str) else list(select)
+    selected = [x for x in names if any(fnmatch.fnmatchcase(x, p) for p in patterns)]
+    if not selected:
+        raise Exception('No benchmarks match <{}>, available: {}.'.format(', '.join(patterns), ', '.join(names)))
+    return selected
+
+
+def time_function(function, repeat=5, min_time=0.05):
+    """Time the function and get the statistics per call.
+
+    :param function: function without arguments.
+    :param repeat: number of rounds.
+    :param min_time: minimum duration of a round [s].
+    :return: dictionary with the statistics.
+    """
+    timer = timeit.Timer(function)
+    number = 1
+    while True:
+        t = timer.timeit(number)
+        if t >= min_time or number >= 1e6:
+            break
+        number = min(int(number * max(2., 1.2 * min_time / max(t, 1e-9))), int(1e6))
+    times = [t / number] + [timer.timeit(number) / number for _ in range(repeat - 1)]
+    mean = statistics.mean(times)
+    return {
+        'iterations': number,
+        'max': max(times),
+        'mean': mean,
+        'median': statistics.median(times),
+        'min': min(times),
+        'ops': 1. / mean if mean > 0 else None,
+        'rounds': len(times),
+        'stddev': statistics.stdev(times) if len(times) > 1 else 0.,
+    }
+
+
+def update_baseline(baseline_file=None, repeat=5, min_time=0.05):
+    """Measure :data:`GATE` and write the result to the baseline file (:data:`BASELINE_FILE` by default)."""
+    r = measure(repeat=repeat, min_time=min_time)
+    write(r, outfile=baseline_file or BASELINE_FILE)
+    return r
+
+
+def write(result, outfile='-'):
+    """Write the result of :func:`run` as JSON to a file or stdout (``-``)."""
+    content = json.dumps(result, indent=4, sort_keys=True)
+    if outfile == '-':
+        print(content)
+    else:
+        with open(outfile, 'w') as f:
+            f.write(content + '\n')
+
+
+@benchmark('all_subsets/batch', 'all_subsets')
+def _all_subsets_batch():
+    from bnlcrl.crl_batch import CRLBatch
+
+    b = CRLBatch(p0=P0)
+    return lambda: b.simulate([ENERGY])
+
+
+@benchmark('all_subsets/simulator', 'all_subsets')
+def _all_subsets_simulator():
+    from bnlcrl.crl_batch import CRLBatch
+
+    b = CRLBatch()
+    cart_ids_list = [b.get_cart_ids(x) for x in b.get_masks()]
+
+    def f():
+        # Most of the sets mix radii and report it, the messages are not of interest here:
+        with contextlib.redirect_stdout(io.StringIO()):
+            for cart_ids in cart_ids_list:
+                CRLSimulator(cart_ids=cart_ids, energy=ENERGY, p0=P0)
+
+    return f
+
+
+@benchmark('calc_ideal_focus/grid', 'calc_ideal_focus')
+def _calc_ideal_focus_grid():
+    from bnlcrl.pkcli.simulate import calc_ideal_focus
+
+    grid = [(r * 1e-6, n) for r in (50, 100, 200, 500, 1000, 1500) for n in (1, 2, 4, 8, 16, 32)]
+
+    def f():
+        for radius, n in grid:
+            calc_ideal_focus(radius, n, 2.3e-06, P0)
+
+    return f
+
+
+@benchmark('cli_startup/simulate_crl', 'cli_startup')
+def _cli_startup():
+    env = dict(os.environ)
+    root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join([root] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+    command = [sys.executable, '-m', 'bnlcrl.bnlcrl_console', 'simulate', 'simulate-crl', '-p', str(P0)] + \
+              CART_IDS + [str(ENERGY)]
+    return lambda: subprocess.check_call(command, env=env, stdout=subprocess.DEVNULL)
+
+
+@benchmark('concurrency/threads_1', 'concurrency')
+def _concurrency_threads_1():
+    return _concurrency(1)
+
+
+@benchmark('concurrency/threads_4', 'concurrency')
+def _concurrency_threads_4():
+    return _concurrency(4)
+
+
+@benchmark('energy_sweep/batch', 'energy_sweep')
+def _energy_sweep_batch():
+    import numpy as np
+    from bnlcrl.crl_batch import CRLBatch
+
+    b = CRLBatch()
+    masks = b.get_masks([CART_IDS])
+    energies = np.linspace(8000., 29000., 100)
+    return lambda: b.simulate(energies, masks, p0=P0)
+
+
+@benchmark('energy_sweep/simulator', 'energy_sweep')
+def _energy_sweep_simulator():
+    energies = [8000. + 21000. * i / 99 for i in range(100)]
+
+    def f():
+        for energy in energies:
+            CRLSimulator(cart_ids=CART_IDS, energy=energy, p0=P0)
+
+    return f
+
+
+@benchmark('get_cli_functions/crl', 'get_cli_functions')
+def _get_cli_functions_crl():
+    return _get_cli_functions(os.path.join(CONFIG_DIR, 'defaults_crl.json'))
+
+
+@benchmark('get_cli_functions/delta', 'get_cli_functions')
+def _get_cli_functions_delta():
+    return _get_cli_functions(os.path.join(CONFIG_DIR, 'defaults_delta.json'))
+
+
+@benchmark('optics/nested', 'optics')
+def _optics_nested():
+    # The nested lists multiplied in loops, as the simulator did before bnlcrl.optics:
+    T_dl = [[1, 0.001], [0, 1]]
+    T_fs = [[1, 0], [-1 / (50e-6 / (2 * 7e-7)), 1]]
+    return lambda: _nested_dot(_nested_power(_nested_dot(T_fs, T_dl), 31), T_fs)
+
+
+@benchmark('optics/numpy', 'optics')
+def _optics_numpy():
+    import numpy as np
+
+    T_dl = [[1, 0.001], [0, 1]]
+    T_fs = [[1, 0], [-1 / (50e-6 / (2 * 7e-7)), 1]]
+    return lambda: np.dot(np.linalg.matrix_power(np.dot(T_fs, T_dl), 31), T_fs)
+
+
+@benchmark('optics/optics', 'optics')
+def _optics_optics():
+    from bnlcrl import optics
+
+    return lambda: optics.lens_array(50e-6, 32, 7e-7, 0.001)
+
+
+@benchmark('simulate_crl/numpy', 'simulate_crl')
+def _simulate_crl_numpy():
+    return lambda: CRLSimulator(cart_ids=CART_IDS, energy=ENERGY, p0=P0, use_numpy=True)
+
+
+@benchmark('simulate_crl/python', 'simulate_crl')
+def _simulate_crl_python():
+    return lambda: CRLSimulator(cart_ids=CART_IDS, energy=ENERGY, p0=P0)
+
+
+def _calibration_loop():
+    x = 0.
+    for i in range(CALIBRATION_LOOPS):
+        x += (i % 7) * 0.5
+    return x
+
+
+def _concurrency(workers):
+    from concurrent.futures import ThreadPoolExecutor
+    from bnlcrl.crl_simulator import simulate
+
+    energies = [8000. + 21000. * i / 99 for i in range(100)]
+
+    def f():
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(lambda e: simulate(cart_ids=CART_IDS, energy=e, p0=P0, use_numpy=True), energies))
+
+    return f
+
+
+def _find_delta(data_file, use_numpy):
+    def setup():
+        energies = _read_data_file(os.path.join(DAT_DIR, data_file))[0]
+        energy = (energies[0] + energies[-1]) / 2.
+        characteristic = 'atten' if data_file.endswith('_atten.dat') else 'delta'
+        return lambda: DeltaFinder(
+            energy=energy,
+            characteristic=characteristic,
+            data_file=data_file,
+            use_numpy=use_numpy,
+        )
+
+    return setup
+
+
+def _get_cli_functions(file_name):
+    from bnlcrl.utils import get_cli_functions
+
+    # The configuration is read every time as the types are converted in place:
+    return lambda: get_cli_functions(read_json(file_name))
+
+
+def _nested_dot(A, B):
+    C = [[0 for _ in range(len(B[0]))] for _ in range(len(A))]
+    for i in range(len(A)):
+        for j in range(len(B[0])):
+            for k in range(len(B)):
+                C[i][j] += A[i][k] * B[k][j]
+    return C
+
+
+def _nested_power(A, n):
+    B = [list(x) for x in A]
+    for _ in range(n - 1):
+        B = _nested_dot(A, B)
+    return B
+
+
+for _f in sorted(glob.glob(os.path.join(DAT_DIR, '*.dat'))):
+    for _n, _use_numpy in (('numpy', True), ('python', False)):
+        benchmark('find_delta/{}/{}'.format(os.path.basename(_f), _n), 'find_delta')(
+            _find_delta(os.path.basename(_f), _use_numpy))
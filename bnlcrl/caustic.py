@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+u"""Beam caustic (envelope) downstream of the CRL.
+
+The transfer matrix of the transfocator is propagated through free-space drift
+matrices evaluated for a whole array of distances at once.
+
+:copyright: Copyright (c) 2016 mrakitin.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+CHUNK_SIZE = 4096
+
+
+def calc_caustic(T, z, y0, teta0, outfile=None, chunk_size=CHUNK_SIZE):
+    """Calculate the beam envelope along z downstream of the last lens.
+
+    A single ray is specified by scalar ``y0``/``teta0``, a ray bundle by arrays of the same length. The envelope is
+    the largest absolute ray coordinate at each z, so for a single ray it is ``|y(z)|`` and the waist coincides with
+    the focal position ``p1``.
+
+    :param T: 2x2 transfer matrix of the CRL.
+    :param z: distances from the last lens [m].
+    :param y0: ray coordinate(s) at the first lens [m].
+    :param teta0: ray angle(s) at the first lens [rad].
+    :param outfile: optional CSV file to stream ``z`` and the envelope to instead of keeping them in memory.
+    :param chunk_size: number of z positions propagated at once.
+    :return: dictionary with the envelope and the waist position/size.
+    """
+    z = np.asarray(z, dtype=float).ravel()
+    if not len(z):
+        raise Exception('No z positions specified!')
+    y0, teta0 = np.broadcast_arrays(np.atleast_1d(np.asarray(y0, dtype=float)),
+                                    np.atleast_1d(np.asarray(teta0, dtype=float)))
+    rays = np.dot(np.asarray(T, dtype=float), np.vstack([y0, teta0]))
+
+    envelope = None if outfile else np.empty(len(z))
+    waist_position = None
+    waist_size = None
+    f = open(outfile, 'w') if outfile else None
+    try:
+        if f:
+            f.write('"z","envelope"\n')
+        for start in range(0, len(z), chunk_size):
+            z_chunk = z[start:start + chunk_size]
+            y = np.matmul(drift_matrices(z_chunk), rays)[:, 0, :]
+            chunk_envelope = np.abs(y).max(axis=1)
+            idx = int(chunk_envelope.argmin())
+            if waist_size is None or chunk_envelope[idx] < waist_size:
+                waist_position = float(z_chunk[idx])
+                waist_size = float(chunk_envelope[idx])
+            if f:
+                np.savetxt(f, np.column_stack([z_chunk, chunk_envelope]), delimiter=',')
+            else:
+                envelope[start:start + len(z_chunk)] = chunk_envelope
+    finally:
+        if f:
+            f.close()
+
+    return {
+        'z': None if outfile else z,
+        'envelope': envelope,
+        'waist_position': waist_position,
+        'waist_size': waist_size,
+    }
+
+
+def drift_matrices(z):
+    """Build free-space drift matrices for an array of distances.
+
+    :param z: array of distances [m].
+    :return: array of shape (len(z), 2, 2).
+    """
+    z = np.asarray(z, dtype=float)
+    D = np.zeros(z.shape + (2, 2))
+    D[..., 0, 0] = 1
+    D[..., 0, 1] = z
+    D[..., 1, 1] = 1
+    return D
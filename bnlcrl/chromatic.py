@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+u"""Chromatic (bandwidth-integrated) focusing of the CRL over an input spectrum.
+
+delta scales as 1/E^2, so every energy of a pink beam or of an undulator harmonic focuses at a different distance.
+The whole spectrum is processed with one table lookup and one batch of transfer matrices
+(see :class:`bnlcrl.crl_batch.CRLBatch`).
+
+:copyright: Copyright (c) 2016 mrakitin.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+from bnlcrl.crl_batch import CRLBatch
+from bnlcrl.crl_simulator import DEFAULTS_FILE
+from bnlcrl.utils import read_parameters, resolve_parameters
+
+
+def calc_chromatic_focus(cart_ids, energies, weights, bins=50, **kwargs):
+    """Calculate the flux-weighted focal distribution of the cartridge set.
+
+    The effective focus is the waist of the polychromatic beam, i.e. the distance minimizing the flux-weighted rms
+    coordinate of the rays of all energies.
+
+    :param cart_ids: cartridges ids.
+    :param energies: photon energies of the spectrum [eV].
+    :param weights: flux at the energies (normalized internally).
+    :param bins: number of bins of the focal distribution histogram.
+    :param kwargs: other parameters of the CRL model (see :class:`bnlcrl.crl_batch.CRLBatch`).
+    :return: dictionary with the weighted mean/spread of ``p1``, the effective focus and the distribution.
+    """
+    energies = np.asarray(energies, dtype=float).ravel()
+    weights = np.asarray(weights, dtype=float).ravel()
+    if energies.shape != weights.shape or not energies.size:
+        raise Exception('Energies and weights must be non-empty arrays of the same length.')
+    if (weights < 0).any() or not weights.sum() > 0:
+        raise Exception('Weights must be non-negative with a positive sum.')
+    weights = weights / weights.sum()
+
+    b = CRLBatch(**kwargs)
+    masks = b.get_masks([cart_ids])
+    if not masks.any():
+        raise Exception('No lenses in the beam!')
+    T, last = b.calc_T(b.calc_lens_arrays(b.find_delta(energies)), masks)
+    T = T[:, 0]
+    r = b.calc_focus(T[:, None], last, b.p0, b.teta0, masks)
+    p1 = r['p1'][:, 0]
+
+    p1_mean = float(np.dot(weights, p1))
+    p1_std = float(np.sqrt(np.dot(weights, (p1 - p1_mean) ** 2)))
+    y0 = b.p0 * np.tan(b.teta0)
+    y = T[:, 0, 0] * y0 + T[:, 0, 1] * b.teta0
+    teta = T[:, 1, 0] * y0 + T[:, 1, 1] * b.teta0
+    p1_effective = float(-np.dot(weights, y * teta) / np.dot(weights, teta ** 2))
+    histogram, bin_edges = np.histogram(p1, bins=bins, weights=weights)
+    offset = float(b.offsets[last[0]] * b.dl_cart)
+    return {
+        'bin_edges': bin_edges,
+        'd': b.d_ssa_focus - (b.p0 + p1_mean + offset),
+        'd_effective': b.d_ssa_focus - (b.p0 + p1_effective + offset),
+        'energies': energies,
+        'histogram': histogram,
+        'p0': b.p0,
+        'p1': p1_mean,
+        'p1_distribution': p1,
+        'p1_effective': p1_effective,
+        'p1_std': p1_std,
+    }
+
+
+def simulate_spectrum(**kwargs):
+    """Run :func:`calc_chromatic_focus` for a spectrum read from a file (see ``defaults_crl.json``).
+
+    The spectrum file has two columns, energy [eV] and flux; lines starting with ``#`` are ignored.
+    """
+    parameters = read_parameters(DEFAULTS_FILE, 'simulate_spectrum')
+    v = resolve_parameters(parameters, kwargs)
+    kwargs = dict((k, x) for k, x in kwargs.items() if k not in parameters)
+    spectrum = np.loadtxt(v['spectrum_file'], ndmin=2)
+    r = calc_chromatic_focus(
+        v['cart_ids'],
+        spectrum[:, 0],
+        spectrum[:, 1],
+        bins=v['bins'],
+        beamline=v['beamline'],
+        p0=v['p0'],
+        **kwargs
+    )
+    return dict((k, r[k]) for k in ('d', 'd_effective', 'p0', 'p1', 'p1_effective', 'p1_std'))
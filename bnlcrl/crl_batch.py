@@ -0,0 +1,420 @@
+# -*- coding: utf-8 -*-
+u"""Batched CRL model: many cartridge sets and operating points at once.
+
+The transfer matrices of all requested cartridge sets (subsets of the slots in ``<beamline>_crl.json``) are built
+with NumPy for arrays of energies, so a sweep over every subset and a dense energy grid is a handful of array
+operations per slot. Results agree with :class:`bnlcrl.crl_simulator.CRLSimulator` for cartridge ids given in the
+order of their positions.
+
+Each cartridge may name its lens material with the ``material`` key of ``<beamline>_crl.json`` (``Al`` uses
+``Al_delta.dat``), the cartridges without it use ``data_file``. Delta is looked up once per distinct material, so all
+delta arrays have a trailing axis over the slots.
+
+:meth:`CRLBatch.calc_transmission` integrates the absorption in the parabolic lens profiles (``<material>_atten.dat``)
+over the illuminated aperture, so :meth:`CRLBatch.simulate` also reports the transmission, the effective aperture and
+the gain of every set.
+
+Each cartridge may declare the plane it focuses in with the ``plane`` key of ``<beamline>_crl.json``: ``h``, ``v`` or
+``hv`` (default, 2-D lenses). :meth:`CRLBatch.simulate_planes` propagates both planes at once: the block-diagonal 4x4
+matrix is kept as a pair of 2x2 matrices along a leading axis, and a cartridge acting in the other plane only is a
+drift. The other methods and the modules built on :class:`CRLBatch` model both planes the same and do not accept
+the sets with such cartridges (see :meth:`CRLBatch.get_masks`).
+
+:copyright: Copyright (c) 2016 mrakitin.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import re
+
+import numpy as np
+
+from bnlcrl.crl_simulator import CONFIG_DIR, DEFAULTS_FILE, check_planes, material_data_file
+from bnlcrl.result_set import ResultSet
+from bnlcrl.tables import find_characteristic_values
+from bnlcrl.utils import read_json, read_parameters, resolve_parameters
+
+PLANES = ('h', 'v')
+WAVELENGTH_ENERGY = 1.23984198e-06  # wavelength [m] times photon energy [eV]
+
+
+class CRLBatch:
+    def __init__(self, **kwargs):
+        # Get input variables:
+        # The lens profile and the source size are used by the transmission only, not by CRLSimulator:
+        self.parameters = dict(read_parameters(DEFAULTS_FILE),
+                               **read_parameters(DEFAULTS_FILE, section='batch_parameters'))
+        for key, value in resolve_parameters(self.parameters, kwargs).items():
+            setattr(self, key, value)
+
+        self.config_file = os.path.join(CONFIG_DIR, '{}_crl.json'.format(self.beamline))
+        self.slots = sorted(read_json(self.config_file)['crl'], key=lambda x: x['offset_cart'])
+        self.ids = [self.parameters['cart_ids']['element_type'](x['id']) for x in self.slots]
+        lens_config = {}
+        for i in self.r_array:
+            for j in self.lens_array:
+                lens_config['T_{}_{}'.format(j, i)] = (i * 1e-6, j)
+        self.radii = np.array([lens_config[x['name']][0] for x in self.slots])
+        self.lens_numbers = np.array([lens_config[x['name']][1] for x in self.slots])
+        self.offsets = np.array([x['offset_cart'] for x in self.slots])
+        data_files = [material_data_file(x, self.data_file) for x in self.slots]
+        self.materials = sorted(set(data_files))  # the distinct data files
+        self.material_index = np.array([self.materials.index(x) for x in data_files])
+        atten_files = dict((x, _atten_file(y, self.data_file)) for x, y in zip(data_files, self.slots))
+        self.atten_files = [atten_files[x] for x in self.materials]
+        # Geometric aperture radius of the parabolic lenses in each slot:
+        self.apertures = np.sqrt(self.radii * (self.lens_thickness - self.web_thickness))
+        # Whether each slot focuses in the horizontal and vertical planes, shape (2, len(slots)):
+        for x in self.slots:
+            if x.get('plane', 'hv') not in ('h', 'v', 'hv'):
+                raise Exception('Unknown plane <{}> of the cartridge <{}>, use h, v or hv.'.format(x['plane'], x['id']))
+        self.planes = np.array([[p in x.get('plane', 'hv') for x in self.slots] for p in PLANES])
+        # Free space from each slot to the next one (zero after the last slot):
+        self.gaps = np.append(np.diff(self.offsets) * self.dl_cart, 0.)
+
+    def calc_focus(self, T, last, p0, teta0, masks, paired=False):
+        """Calculate ``p1``, ``f`` and ``d`` from the total transfer matrices (see ``crl_simulator.simulate``)."""
+        p0 = np.asarray(p0, dtype=float)
+        teta0 = np.asarray(teta0, dtype=float)
+        if not paired:
+            p0 = p0[..., None]
+            teta0 = teta0[..., None]
+        y0 = p0 * np.tan(teta0)
+        y = T[..., 0, 0] * y0 + T[..., 0, 1] * teta0
+        teta = T[..., 1, 0] * y0 + T[..., 1, 1] * teta0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            p1 = np.where(last >= 0, y / np.tan(np.pi - teta), np.nan)
+            f = 1 / (1 / p0 + 1 / p1)
+        d = self.d_ssa_focus - (p0 + p1 + self.offsets[np.maximum(last, 0)] * self.dl_cart)
+        return {
+            'd': d,
+            'f': f,
+            'lens_number': np.asarray(masks, dtype=int).dot(self.lens_numbers),
+            'p1': p1,
+        }
+
+    def calc_lens_arrays(self, delta, planes=False):
+        """Calculate the accumulated matrices of every cartridge (see ``CRLSimulator.calc_lens_array``).
+
+        :param delta: array of the index of refraction values of shape ``(..., len(slots))`` (see :meth:`find_delta`).
+        :param planes: a flag that the first axis of ``delta`` (of length 2) corresponds to the H and V planes.
+        :return: array of shape ``delta.shape + (2, 2)``.
+        """
+        delta = np.asarray(delta, dtype=float)
+        f = -2. * delta / self.radii
+        if planes:
+            f = f * self.planes.reshape((2,) + (1,) * (delta.ndim - 2) + (len(self.slots),))
+        T_fs = np.zeros(f.shape + (2, 2))
+        T_fs[..., 0, 0] = 1
+        T_fs[..., 1, 0] = f
+        T_fs[..., 1, 1] = 1
+        A = T_fs.copy()
+        A[..., 0, 1] = self.dl_lens
+        A[..., 1, 1] = f * self.dl_lens + 1
+        L = T_fs.copy()
+        B = A.copy()
+        powers = self.lens_numbers - 1
+        # Binary exponentiation of A with per-cartridge powers:
+        while powers.any():
+            odd = (powers % 2 == 1)[..., None, None]
+            L = np.where(odd, np.matmul(B, L), L)
+            B = np.matmul(B, B)
+            powers = powers // 2
+        return L
+
+    def calc_transmission(self, energies, masks, p0, teta0, p1, paired=False):
+        """Calculate the transmission, the effective aperture and the gain of the cartridge sets.
+
+        A lens of radius ``R`` is ``r ** 2 / R + web_thickness`` thick at the distance ``r`` from the axis, so the
+        transmission of the beam uniformly illuminating the radius ``a`` (the beam size ``p0 * tan(teta0)`` limited by
+        the smallest geometric aperture) is ``exp(-w) * (1 - exp(-x)) / x`` with ``x = a ** 2 * sum(N / (R * l))``
+        and ``w = sum(N * web_thickness / l)`` over the inserted lenses (``l`` is the attenuation length). The gain is
+        the ratio of the flux density in the focal spot to the one without the lenses at the same place; the spot is
+        the demagnified ``source_size`` broadened by diffraction on the effective aperture.
+
+        :param energies: photon energies [eV].
+        :param masks: boolean array of shape ``(n_sets, len(slots))`` with the inserted cartridges.
+        :param p0: distance(s) from source to the CRL broadcastable with ``energies`` [m].
+        :param teta0: divergence(s) of the beam broadcastable with ``energies`` [rad].
+        :param p1: distances from the last lens to the focus (see :meth:`calc_focus`) [m].
+        :param paired: a flag that the last axis of the operating points corresponds to the sets.
+        :return: dictionary of arrays of the shape of ``p1``: ``transmission``, ``effective_aperture`` [m] and
+            ``gain`` (NaN for empty sets and virtual images).
+        """
+        masks = np.asarray(masks, dtype=bool)
+        energies = np.asarray(energies, dtype=float)
+        p0 = np.asarray(p0, dtype=float)
+        teta0 = np.asarray(teta0, dtype=float)
+        atten = self.find_per_material(find_characteristic_values, energies, self.atten_files, characteristic='atten')
+        absorption = np.stack([self.lens_numbers / (self.radii * atten), self.lens_numbers / atten], axis=-1)
+        if paired:
+            absorption = np.einsum('...sjk,sj->...sk', absorption, masks)
+        else:
+            absorption = np.einsum('...jk,sj->...sk', absorption, masks)
+            p0 = p0[..., None]
+            teta0 = teta0[..., None]
+        aperture = np.minimum(np.abs(p0 * np.tan(teta0)), np.where(masks, self.apertures, np.inf).min(axis=-1))
+        x = absorption[..., 0] * aperture ** 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.where(x > 0, -np.expm1(-x) / x, 1.)
+            transmission = np.exp(-absorption[..., 1] * self.web_thickness) * ratio
+            effective_aperture = 2 * aperture * np.sqrt(ratio)
+            wavelength = WAVELENGTH_ENERGY / energies
+            if not paired:
+                wavelength = wavelength[..., None]
+            spot = np.hypot(self.source_size * p1 / p0, 0.75 * wavelength * p1 / effective_aperture)
+            gain = np.where(p1 > 0, transmission * (2 * aperture * (p0 + p1) / p0 / spot) ** 2, np.nan)
+        empty = ~masks.any(axis=-1)
+        return {
+            'effective_aperture': np.where(empty, np.nan, effective_aperture),
+            'gain': np.where(empty, np.nan, gain),
+            'transmission': np.where(empty, np.nan, transmission),
+        }
+
+    def calc_T(self, lens_arrays, masks, paired=False):
+        """Calculate the total transfer matrices of the cartridge sets.
+
+        :param lens_arrays: cartridge matrices of shape ``(..., len(slots), 2, 2)`` (see :meth:`calc_lens_arrays`).
+        :param masks: boolean array of shape ``(n_sets, len(slots))`` with the inserted cartridges.
+        :param paired: a flag that the last axis of ``lens_arrays`` before the slots already corresponds to the sets.
+        :return: tuple of the matrices of shape ``(..., n_sets, 2, 2)`` and the index of the last inserted slot
+            (-1 for empty sets).
+        """
+        masks = np.asarray(masks, dtype=bool)
+        shape = lens_arrays.shape[:-3] + (() if paired else masks.shape[:1])
+        t00, t01, t10, t11 = np.ones(shape), np.zeros(shape), np.zeros(shape), np.ones(shape)
+        trail = np.zeros(masks.shape[0])
+        last = np.full(masks.shape[0], -1)
+        for j in range(len(self.slots)):
+            inserted = masks[:, j]
+            l00, l01, l10, l11 = [lens_arrays[..., j, k, l] for k in range(2) for l in range(2)]
+            if not paired:
+                l00, l01, l10, l11 = l00[..., None], l01[..., None], l10[..., None], l11[..., None]
+            # Drift from the previous inserted cartridge (identity and zero drift for empty sets), then the lenses:
+            q0 = t00 + trail * t10
+            q1 = t01 + trail * t11
+            t00, t01, t10, t11 = (
+                np.where(inserted, l00 * q0 + l01 * t10, t00),
+                np.where(inserted, l00 * q1 + l01 * t11, t01),
+                np.where(inserted, l10 * q0 + l11 * t10, t10),
+                np.where(inserted, l10 * q1 + l11 * t11, t11),
+            )
+            trail = np.where(
+                inserted,
+                self.gaps[j] - self.lens_numbers[j] * self.dl_lens,
+                np.where(last >= 0, trail + self.gaps[j], 0.),
+            )
+            last = np.where(inserted, j, last)
+        T = np.stack([np.stack([t00, t01], axis=-1), np.stack([t10, t11], axis=-1)], axis=-2)
+        return T, last
+
+    def calc_T_subsets(self, lens_arrays):
+        """Calculate the total transfer matrices of all subsets of the slots, including the empty one.
+
+        The subsets are built by doubling: the sets of the first j + 1 slots are the sets of the first j slots without
+        and with the slot j, so the work is proportional to the number of subsets rather than to the number of subsets
+        times the number of slots. The subset index has bit ``i`` set when the slot ``i`` is inserted.
+
+        :param lens_arrays: cartridge matrices of shape ``(..., len(slots), 2, 2)`` (see :meth:`calc_lens_arrays`).
+        :return: tuple of the matrices of shape ``(..., 2 ** len(slots), 2, 2)`` and the index of the last inserted
+            slot (-1 for the empty set).
+        """
+        shape = lens_arrays.shape[:-3] + (1,)
+        t00, t01, t10, t11 = np.ones(shape), np.zeros(shape), np.zeros(shape), np.ones(shape)
+        trail = np.zeros(1)
+        last = np.full(1, -1)
+        for j in range(len(self.slots)):
+            l00, l01, l10, l11 = [lens_arrays[..., j, k, l][..., None] for k in range(2) for l in range(2)]
+            q0 = t00 + trail * t10
+            q1 = t01 + trail * t11
+            t00, t01, t10, t11 = (
+                np.concatenate([t00, l00 * q0 + l01 * t10], axis=-1),
+                np.concatenate([t01, l00 * q1 + l01 * t11], axis=-1),
+                np.concatenate([t10, l10 * q0 + l11 * t10], axis=-1),
+                np.concatenate([t11, l10 * q1 + l11 * t11], axis=-1),
+            )
+            trail = np.concatenate([
+                np.where(last >= 0, trail + self.gaps[j], 0.),
+                np.full(len(last), self.gaps[j] - self.lens_numbers[j] * self.dl_lens),
+            ])
+            last = np.concatenate([last, np.full(len(last), j)])
+        T = np.stack([np.stack([t00, t01], axis=-1), np.stack([t10, t11], axis=-1)], axis=-2)
+        return T, last
+
+    def find_delta(self, energies, interpolate=False):
+        """Find delta of every slot for an array of energies with a single table lookup per material.
+
+        :param energies: photon energies [eV].
+        :param interpolate: a flag to interpolate linearly between the tabulated energies.
+        :return: array of delta values of shape ``energies.shape + (len(slots),)``.
+        """
+        return self.find_per_material(find_characteristic_values, energies, interpolate=interpolate)
+
+    def find_per_material(self, function, energies, data_files=None, **kwargs):
+        """Call ``function(energies, data_file, **kwargs)`` once per material and spread the results over the slots.
+
+        :param function: lookup function (see :mod:`bnlcrl.tables`).
+        :param energies: photon energies [eV].
+        :param data_files: data files of the materials in the order of ``materials``, the delta files by default.
+        :return: array of shape ``energies.shape + (len(slots),)``.
+        """
+        values = np.stack([function(energies, x, **kwargs) for x in data_files or self.materials], axis=-1)
+        return values[..., self.material_index]
+
+    def get_cart_ids(self, mask):
+        return [self.ids[i] for i in np.flatnonzero(mask)]
+
+    def get_masks(self, cart_ids_list=None, planes=False):
+        """Convert lists of cartridge ids to masks, all non-empty subsets of the slots by default.
+
+        :param cart_ids_list: list of lists of cartridge ids.
+        :param planes: a flag to accept the cartridges focusing in one plane only, which :meth:`simulate_planes`
+            models only.
+        :return: boolean array of shape ``(n_sets, len(slots))``.
+        """
+        n = len(self.slots)
+        if cart_ids_list is None:
+            if not planes:
+                check_planes(self.slots)
+            subsets = np.arange(1, 2 ** n)
+            return (subsets[:, None] >> np.arange(n)) & 1 == 1
+        masks = np.zeros((len(cart_ids_list), n), dtype=bool)
+        for i, cart_ids in enumerate(cart_ids_list):
+            for cart_id in cart_ids:
+                cart_id = self.parameters['cart_ids']['element_type'](cart_id)
+                if cart_id not in self.ids:
+                    msg = 'Specified cart_id <{}> not in the list of available ids: <{}>.'
+                    raise Exception(msg.format(cart_id, ', '.join(self.ids)))
+                masks[i, self.ids.index(cart_id)] = True
+        if not planes:
+            check_planes(x for x, inserted in zip(self.slots, masks.any(axis=0)) if inserted)
+        return masks
+
+    def simulate(self, energies, masks=None, p0=None, teta0=None, delta=None, paired=False, transmission=True):
+        """Simulate the cartridge sets for arrays of operating points.
+
+        :param energies: photon energies [eV].
+        :param masks: inserted cartridges (see :meth:`get_masks`), all non-empty subsets by default.
+        :param p0: distance(s) from source to the CRL broadcastable with ``energies`` [m].
+        :param teta0: divergence(s) of the beam broadcastable with ``energies`` [rad].
+        :param delta: optional precalculated delta values of shape ``energies.shape + (len(slots),)``.
+        :param paired: a flag to evaluate the operating points with the sets at the same position of the last axis
+            instead of every operating point with every set.
+        :param transmission: a flag to calculate the transmission and the gain (see :meth:`calc_transmission`).
+        :return: dictionary of arrays of shape ``energies.shape + (n_sets,)`` (``energies.shape`` if ``paired``) with
+            ``p1``, ``f``, ``d``, ``transmission``, ``effective_aperture``, ``gain`` and per-set ``lens_number``;
+            the arrays are NaN for empty sets.
+        """
+        energies = np.asarray(energies, dtype=float)
+        p0 = np.asarray(self.p0 if p0 is None else p0, dtype=float)
+        teta0 = np.asarray(self.teta0 if teta0 is None else teta0, dtype=float)
+        shape = np.broadcast(energies, p0, teta0).shape
+        if delta is None:
+            delta = self.find_delta(energies)
+        lens_arrays = self.calc_lens_arrays(np.broadcast_to(delta, shape + (len(self.slots),)))
+        if masks is None:
+            masks = self.get_masks()
+            T, last = self.calc_T_subsets(lens_arrays)
+            T, last = T[..., 1:, :, :], last[1:]
+        else:
+            masks = np.asarray(masks, dtype=bool)
+            T, last = self.calc_T(lens_arrays, masks, paired=paired)
+        r = self.calc_focus(T, last, p0, teta0, masks, paired=paired)
+        if transmission:
+            r.update(self.calc_transmission(energies, masks, p0, teta0, r['p1'], paired=paired))
+        return r
+
+    def sweep(self, energies, masks=None, p0=None, teta0=None):
+        """Simulate the cartridge sets for an array of energies and return one row per energy and set.
+
+        :param energies: photon energies [eV].
+        :param masks: inserted cartridges (see :meth:`get_masks`), all non-empty subsets by default.
+        :param p0: distance from source to the CRL [m].
+        :param teta0: divergence of the beam [rad].
+        :return: :class:`bnlcrl.result_set.ResultSet` with ``energy``, ``cart_ids`` (space-separated), the results of
+            :meth:`simulate` and ``lens_number``, ordered by energy, then by set.
+        """
+        energies = np.asarray(energies, dtype=float).ravel()
+        r = self.simulate(energies, masks, p0=p0, teta0=teta0)
+        masks = self.get_masks() if masks is None else np.asarray(masks, dtype=bool)
+        cart_ids = np.array([' '.join(self.get_cart_ids(x)) for x in masks])
+        columns = {
+            'cart_ids': np.tile(cart_ids, len(energies)),
+            'energy': np.repeat(energies, len(masks)),
+            'lens_number': np.tile(r.pop('lens_number'), len(energies)),
+        }
+        for k, v in r.items():
+            columns[k] = v.ravel()
+        names = ['energy', 'cart_ids', 'lens_number', 'p1', 'f', 'd', 'transmission', 'effective_aperture', 'gain']
+        return ResultSet(columns, names=names)
+
+    def simulate_planes(self, energies, masks, p0=None, teta0_h=None, teta0_v=None, delta=None):
+        """Simulate the cartridge sets in the horizontal and vertical planes.
+
+        :param energies: photon energies [eV].
+        :param masks: inserted cartridges (see :meth:`get_masks` with ``planes``).
+        :param p0: distance(s) from source to the CRL broadcastable with ``energies`` [m].
+        :param teta0_h: horizontal divergence(s) of the beam broadcastable with ``energies`` [rad].
+        :param teta0_v: vertical divergence(s) of the beam broadcastable with ``energies`` [rad].
+        :param delta: optional precalculated delta values of shape ``energies.shape + (len(slots),)``.
+        :return: dictionary of arrays of shape ``energies.shape + (n_sets,)`` with ``p1``, ``f`` and ``d`` suffixed
+            by ``_h``/``_v`` and per-set ``lens_number_h``/``lens_number_v``; a plane without lenses focusing in it
+            has the virtual image of the source (negative ``p1``).
+        """
+        energies = np.asarray(energies, dtype=float)
+        p0 = np.asarray(self.p0 if p0 is None else p0, dtype=float)
+        teta0_h = np.asarray(self.teta0 if teta0_h is None else teta0_h, dtype=float)
+        teta0_v = np.asarray(self.teta0 if teta0_v is None else teta0_v, dtype=float)
+        shape = np.broadcast(energies, p0, teta0_h, teta0_v).shape
+        if delta is None:
+            delta = self.find_delta(energies)
+        # The planes are the first axis of all arrays. The matrices of the sets without 1-D cartridges are the same in
+        # both planes and are calculated once:
+        masks = np.asarray(masks, dtype=bool)
+        split = (masks & (self.planes[0] != self.planes[1])).any(axis=1)
+        T = np.empty((2,) + shape + (len(masks), 2, 2))
+        last = np.empty(len(masks), dtype=int)
+        delta = np.broadcast_to(delta, shape + (len(self.slots),))
+        if not split.all():
+            T[..., ~split, :, :], last[~split] = self.calc_T(self.calc_lens_arrays(delta), masks[~split])
+        if split.any():
+            lens_arrays = self.calc_lens_arrays(np.broadcast_to(delta, (2,) + delta.shape), planes=True)
+            T[..., split, :, :], last[split] = self.calc_T(lens_arrays, masks[split])
+        teta0 = np.stack([np.broadcast_to(teta0_h, shape), np.broadcast_to(teta0_v, shape)])
+        r = self.calc_focus(T, last, p0, teta0, masks)
+        result = {}
+        for i, plane in enumerate(PLANES):
+            for key in ('d', 'f', 'p1'):
+                result['{}_{}'.format(key, plane)] = r[key][i]
+            result['lens_number_{}'.format(plane)] = (masks & self.planes[i]).astype(int).dot(self.lens_numbers)
+        return result
+
+
+def simulate_planes(**kwargs):
+    """Simulate one cartridge set in the horizontal and vertical planes (see ``defaults_crl.json``)."""
+    parameters = read_parameters(DEFAULTS_FILE, 'simulate_planes')
+    v = resolve_parameters(parameters, kwargs)
+    kwargs = dict((k, x) for k, x in kwargs.items() if k not in parameters)
+    b = CRLBatch(beamline=v['beamline'], **kwargs)
+    masks = b.get_masks([v['cart_ids']], planes=True)
+    if not masks.any():
+        raise Exception('No lenses in the beam!')
+    r = b.simulate_planes([v['energy']], masks, p0=v['p0'], teta0_h=v['teta0_h'], teta0_v=v['teta0_v'])
+    return dict((k, r[k][0].item()) for k in sorted(r.keys()))
+
+
+def _atten_file(cartridge, data_file):
+    """Find the attenuation length data file of the cartridge material, the formula of ``data_file`` if not specified.
+
+    :param cartridge: cartridge of ``<beamline>_crl.json``.
+    :param data_file: delta data file of the cartridges without the ``material`` key, named ``<formula>_delta.dat``.
+    :return: name of the ``<formula>_atten.dat`` file.
+    """
+    if cartridge.get('material'):
+        return '{}_atten.dat'.format(cartridge['material'])
+    m = re.match(r'^(.+)_delta\.dat$', os.path.basename(data_file))
+    if not m:
+        raise Exception('Cannot find the attenuation length data file for <{}>, name it <formula>_delta.dat.'.format(
+            data_file))
+    return os.path.join(os.path.dirname(data_file), '{}_atten.dat'.format(m.group(1)))
@@ -4,81 +4,340 @@
 
 from __future__ import division
 
-import copy
+import collections
 import json
 import math
 import os
+import threading
 
-from bnlcrl.delta_finder import DeltaFinder
-from bnlcrl.utils import convert_types, defaults_file, read_json
+from bnlcrl import optics, timing
+from bnlcrl.delta_finder import find_characteristic
+from bnlcrl.utils import defaults_file, read_config, read_parameters, resolve_parameters
 
 parms = defaults_file(suffix='crl')
 DAT_DIR = parms['dat_dir']
 CONFIG_DIR = parms['config_dir']
 DEFAULTS_FILE = parms['defaults_file']
 
+DELTA_CACHE_SIZE = 4096  # number of the delta values kept, the least recently used ones are dropped
+
+# Delta values found before, keyed by (data_file, energy, formula, calc_delta), in the order of their use:
+_deltas = collections.OrderedDict()
+_deltas_lock = threading.Lock()
+
+
+def find_delta(energy, data_file, formula=None, calc_delta=False, use_numpy=False):
+    """Find delta (see :func:`bnlcrl.delta_finder.find_characteristic`), reusing the last
+    :data:`DELTA_CACHE_SIZE` values found.
+
+    :param energy: photon energy [eV].
+    :param data_file: data file with delta values.
+    :param formula: material's formula (for the analytical calculation), the DeltaFinder default if not specified.
+    :param calc_delta: a flag to calculate delta analytically.
+    :param use_numpy: a flag to use NumPy.
+    :return: delta.
+    """
+    key = (data_file, energy, formula, calc_delta)
+    with _deltas_lock:
+        if key in _deltas:
+            timing.count('crl_simulator.delta_cache_hits')
+            # Move to the end (OrderedDict.move_to_end is not available on Python 2 and Jython):
+            _deltas[key] = _deltas.pop(key)
+            return _deltas[key]
+    timing.count('crl_simulator.delta_cache_misses')
+    kwargs = {'formula': formula} if formula else {}
+    delta = find_characteristic(
+        energy=energy,
+        precise=True,
+        data_file=data_file,
+        use_numpy=use_numpy,
+        calc_delta=calc_delta,
+        **kwargs
+    ).characteristic_value
+    with _deltas_lock:
+        _deltas[key] = delta
+        while len(_deltas) > DELTA_CACHE_SIZE:
+            _deltas.popitem(last=False)
+    return delta
+
+
+def material_data_file(cartridge, data_file):
+    """Find the delta data file of the cartridge material (``material`` key), ``data_file`` if not specified."""
+    return '{}_delta.dat'.format(cartridge['material']) if cartridge.get('material') else data_file
+
+
+# The stateless core: the functions below take all inputs as arguments, share only the read-only configs (see
+# bnlcrl.utils.read_config) and the delta cache, and return new objects, so they can be called from many threads.
+
+CRLResult = collections.namedtuple('CRLResult', (
+    'T', 'd', 'd_ideal', 'delta', 'deltas', 'f', 'ideal_focus', 'n', 'p1', 'p1_ideal', 'p1_ideal_from_source', 'radii',
+    'teta', 'y', 'y0',
+))
+
+
+def calc_transfer_matrix(cart_ids, transfocator_config, lens_config, deltas, data_file, dl_cart, dl_lens,
+                         use_numpy=False):
+    """Calculate the total transfer matrix of the inserted cartridges (lenses and the drifts between them).
+
+    :param cart_ids: ids of the inserted cartridges in the order of their positions.
+    :param transfocator_config: cartridges of the beamline (see :func:`read_transfocator_config`).
+    :param lens_config: radius and number of lenses by the cartridge name (see :func:`get_lens_config`).
+    :param deltas: delta by the data file of the material (see :func:`find_deltas`).
+    :param data_file: data file of the cartridges without the ``material`` key.
+    :param dl_cart: distance between two cartridges [m].
+    :param dl_lens: distance between two lenses [m].
+    :param use_numpy: a flag to use NumPy, the flat 4-tuples kernel of :mod:`bnlcrl.optics` otherwise.
+    :return: 2x2 matrix (nested lists or NumPy array).
+    """
+    if not cart_ids:
+        raise Exception('No lenses in the beam!')
+    cartridges = [_find_cartridge(transfocator_config, x) for x in cart_ids]
+    lenses = [lens_config[x['name']] for x in cartridges]
+    numpy = _numpy() if use_numpy else None
+    T = None
+    for i, c in enumerate(cartridges):
+        L = calc_lens_array_matrix(
+            lenses[i]['radius'],
+            lenses[i]['lens_number'],
+            deltas[material_data_file(c, data_file)],
+            dl_lens,
+            use_numpy=use_numpy,
+        )
+        if i == 0:
+            T = L if numpy else optics.from_nested(L)
+            continue
+        previous = cartridges[i - 1]
+        dist = (c['offset_cart'] - previous['offset_cart']) * dl_cart - lenses[i - 1]['lens_number'] * dl_lens
+        if numpy:
+            T = numpy.dot(L, numpy.dot([[1, dist], [0, 1]], T))
+        else:
+            T = optics.mul(optics.from_nested(L), optics.mul(optics.drift(dist), T))
+    return T if numpy else optics.to_nested(T)
+
+
+def calc_ideal_focus(radius, n, delta, p0):
+    """Calculate the focal distance of the ideal lens and the image distances.
+
+    :param radius: radius of the lenses [m].
+    :param n: number of lenses.
+    :param delta: delta of the lens material.
+    :param p0: distance from source to the lens [m].
+    :return: dictionary with ``ideal_focus``, ``p1_ideal`` and ``p1_ideal_from_source``.
+    """
+    assert n > 0
+    assert delta != 0
+    ideal_focus = radius / (2. * n * delta)
+    p1_ideal = 1. / (1. / ideal_focus - 1. / p0)
+    return {
+        'ideal_focus': ideal_focus,
+        'p1_ideal': p1_ideal,
+        'p1_ideal_from_source': p1_ideal + p0,
+    }
+
+
+def calc_ideal_lens(radii, n, delta, p0, data_files, radii_tolerance):
+    """Calculate the ideal lens of the inserted cartridges, if they have the same material and radius.
+
+    :param radii: radii of the lenses of the inserted cartridges [m].
+    :param n: total number of lenses.
+    :param delta: delta of the lens material.
+    :param p0: distance from source to the lens [m].
+    :param data_files: data files of the materials of the inserted cartridges.
+    :param radii_tolerance: tolerance to compare the radii [m].
+    :return: dictionary with ``ideal_focus``, ``p1_ideal`` and ``p1_ideal_from_source`` (``None`` and 0 if the ideal
+        lens cannot be calculated).
+    """
+    if len(set(data_files)) > 1:
+        print('Materials of the specified lenses are different! Cannot calculate ideal lens.')
+    elif abs(sum(radii) / len(radii) - radii[0]) < radii_tolerance:
+        return calc_ideal_focus(radii[0], n, delta, p0)
+    else:
+        print('Radii of the specified lenses ({}) are different! Cannot calculate ideal lens.'.format(radii))
+    return {'ideal_focus': None, 'p1_ideal': 0, 'p1_ideal_from_source': 0}
+
+
+def calc_lens_array_matrix(radius, n, delta, dl_lens, use_numpy=False):
+    """Calculate accumulated T_fs for one cartridge with fixed radius.
+
+    :param radius: radius.
+    :param n: number of lenses in one cartridge.
+    :param delta: delta of the lens material.
+    :param dl_lens: distance between two lenses [m].
+    :param use_numpy: a flag to use NumPy.
+    :return: 2x2 matrix (nested lists or NumPy array).
+    """
+    numpy = _numpy() if use_numpy else None
+    if not numpy:
+        return optics.to_nested(optics.lens_array(radius, n, delta, dl_lens))
+    T_dl = [[1, dl_lens], [0, 1]]
+    T_fs = [[1, 0], [-1 / (radius / (2 * delta)), 1]]
+    return numpy.dot(numpy.linalg.matrix_power(numpy.dot(T_fs, T_dl), n - 1), T_fs)
+
+
+def calc_real_lens(y, teta, p0):
+    """Calculate the image distance ``p1`` and the focal distance ``f`` of the real lens from the output ray."""
+    p1 = y / math.tan(math.pi - teta)
+    return p1, 1 / (1 / p0 + 1 / p1)
+
+
+def calc_y_teta(T, y0, teta0, use_numpy=False):
+    """Apply the transfer matrix to the ray.
+
+    :param T: total transfer matrix (see :func:`calc_transfer_matrix`).
+    :param y0: ray coordinate at the first lens [m].
+    :param teta0: ray angle at the first lens [rad].
+    :param use_numpy: a flag to use NumPy.
+    :return: ``(y, teta)`` of the output ray.
+    """
+    numpy = _numpy() if use_numpy else None
+    if not numpy:
+        return optics.apply(optics.from_nested(T), y0, teta0)
+    return tuple(numpy.dot(T, [y0, teta0]))
+
+
+def check_planes(cartridges):
+    """Check that the cartridges focus in both planes, as the model of a single plane assumes.
+
+    The cartridges declaring the ``h`` or ``v`` plane in ``<beamline>_crl.json`` are simulated by
+    :func:`bnlcrl.crl_batch.simulate_planes` only.
+
+    :param cartridges: cartridges of ``<beamline>_crl.json``.
+    """
+    for c in cartridges:
+        if c.get('plane', 'hv') != 'hv':
+            msg = 'Cartridge <{}> focuses in the <{}> plane only, use simulate_planes.'
+            raise Exception(msg.format(c['id'], c['plane']))
+
+
+def find_deltas(cart_ids, transfocator_config, energy, data_file, calc_delta=False, use_numpy=False):
+    """Find delta for each distinct material of the inserted cartridges.
+
+    :return: dictionary of delta by the data file of the material.
+    """
+    deltas = {}
+    for i in cart_ids:
+        c = _find_cartridge(transfocator_config, i)
+        f = material_data_file(c, data_file)
+        if f not in deltas:
+            deltas[f] = find_delta(energy, f, formula=c.get('material'), calc_delta=calc_delta, use_numpy=use_numpy)
+    return deltas
+
+
+def get_available_ids(transfocator_config, element_type=str):
+    return [element_type(x['id']) for x in transfocator_config]
+
+
+def get_lens_config(r_array, lens_array):
+    """Get the radius [m] and the number of lenses by the cartridge name (e.g. ``T_8_1000``)."""
+    lens_config = {}
+    for i in r_array:
+        for j in lens_array:
+            lens_config['T_{}_{}'.format(j, i)] = {
+                'radius': i * 1e-6,
+                'lens_number': j,
+            }
+    return lens_config
+
+
+def read_transfocator_config(beamline):
+    """Read the cartridges of the beamline from ``<beamline>_crl.json`` (shared, must not be modified)."""
+    return read_config(os.path.join(CONFIG_DIR, '{}_crl.json'.format(beamline)))['crl']
+
+
+def simulate(**kwargs):
+    """Simulate the CRL without any per-call state shared between threads (the core of :class:`CRLSimulator`).
+
+    :param kwargs: parameters of ``defaults_crl.json``, the defaults are used for the missing ones.
+    :return: :class:`CRLResult`, ``T`` is ``None`` and ``p1``, ``d`` etc. are 0 if no cartridges are inserted.
+    """
+    return _simulate(resolve_parameters(read_parameters(DEFAULTS_FILE), kwargs))
+
+
+def _simulate(v):
+    """Simulate the CRL for the resolved parameters (see :func:`bnlcrl.utils.resolve_parameters`)."""
+    transfocator_config = read_transfocator_config(v['beamline'])
+    cart_ids = v['cart_ids']
+    y0 = v['p0'] * math.tan(v['teta0'])
+    if not _check_ids(cart_ids, get_available_ids(transfocator_config)):
+        return CRLResult(
+            T=None, d=0, d_ideal=0, delta=None, deltas=None, f=0, ideal_focus=None, n=None, p1=0, p1_ideal=0,
+            p1_ideal_from_source=0, radii=None, teta=None, y=None, y0=y0,
+        )
+    check_planes(_find_cartridge(transfocator_config, x) for x in cart_ids)
+    use_numpy = bool(v['use_numpy'] and _numpy())
+    lens_config = get_lens_config(v['r_array'], v['lens_array'])
+
+    # Find delta (the index of refraction) once per material of the inserted cartridges:
+    with timing.span('crl_simulator.find_delta'):
+        deltas = find_deltas(cart_ids, transfocator_config, v['energy'], v['data_file'], calc_delta=v['calc_delta'],
+                             use_numpy=use_numpy)
+    data_files = [material_data_file(_find_cartridge(transfocator_config, x), v['data_file']) for x in cart_ids]
+    delta = deltas[data_files[0]]
+
+    # Perform calculations:
+    with timing.span('crl_simulator.calc_T_total'):
+        T = calc_transfer_matrix(cart_ids, transfocator_config, lens_config, deltas, v['data_file'], v['dl_cart'],
+                                 v['dl_lens'], use_numpy=use_numpy)
+    y, teta = calc_y_teta(T, y0, v['teta0'], use_numpy=use_numpy)
+    p1, f = calc_real_lens(y, teta, v['p0'])
+
+    lenses = [lens_config[_find_cartridge(transfocator_config, x)['name']] for x in cart_ids]
+    radii = [x['radius'] for x in lenses]
+    n = sum(x['lens_number'] for x in lenses)
+    ideal = calc_ideal_lens(radii, n, delta, v['p0'], data_files, v['radii_tolerance'])
+
+    last = _find_cartridge(transfocator_config, cart_ids[-1])['offset_cart'] * v['dl_cart']
+    return CRLResult(
+        T=T,
+        d=v['d_ssa_focus'] - (v['p0'] + p1 + last),
+        d_ideal=v['d_ssa_focus'] - (v['p0'] + ideal['p1_ideal'] + last),
+        delta=delta,
+        deltas=deltas,
+        f=f,
+        ideal_focus=ideal['ideal_focus'],
+        n=n,
+        p1=p1,
+        p1_ideal=ideal['p1_ideal'],
+        p1_ideal_from_source=ideal['p1_ideal_from_source'],
+        radii=radii,
+        teta=teta,
+        y=y,
+        y0=y0,
+    )
+
 
 class CRLSimulator:
-    def __init__(self, **kwargs):
-        # Check importable libs:
-        self._check_imports()
+    """Simulate the CRL (a wrapper over :func:`simulate` keeping the inputs and the results as attributes)."""
 
-        # Get input variables:
-        d = read_json(DEFAULTS_FILE)
-        self.parameters = convert_types(d['parameters'])
-        for key, default_val in self.parameters.items():
-            if key in kwargs.keys():
-                setattr(self, key, self.parameters[key]['type'](kwargs[key]))
-            elif not hasattr(self, key) or getattr(self, key) is None:
-                setattr(self, key, default_val['default'])
-
-        # Initialize non-input variables:
-        self.radii = None
-        self.n = None
-        self.T = None
-        self.y = None
-        self.teta = None
-        self.ideal_focus = None
-        self.p1 = 0
-        self.p1_ideal = 0
-        self.p1_ideal_from_source = 0
-        self.d = 0
-        self.d_ideal = 0
-        self.f = 0
-
-        # Read CRL config and check inputs:
-        self.read_config_file()  # defines self.config_file and self.transfocator_config
-        self._get_available_ids()  # defines self.available_ids
-        if not self._check_ids():
-            if self.verbose:
-                self.print_result()
-            return
+    def __init__(self, **kwargs):
+        self.stats = None
+        if kwargs.get('timing'):
+            with timing.record() as r:
+                self._run(**kwargs)
+            self.stats = r.get()
+        else:
+            self._run(**kwargs)
 
-        # Initialize non-input variables using methods:
-        self._get_lens_config()  # defines self.lens_config
-        self._calc_y0()  # defines self.y0
+    def calc_caustic(self, z, y0=None, teta0=None, outfile=None):
+        """Calculate the beam envelope along z downstream of the last lens (requires NumPy).
 
-        # Find delta (the index of refraction) from other class:
-        delta_obj = DeltaFinder(
-            energy=self.energy,
-            precise=True,
-            data_file=self.data_file,
-            use_numpy=self.use_numpy,
-            verbose=False,  # self.verbose,
-            calc_delta=self.calc_delta,
+        :param z: distances from the last lens [m].
+        :param y0: ray coordinate(s) at the first lens, the simulated ray by default [m].
+        :param teta0: ray angle(s) at the first lens, the simulated ray by default [rad].
+        :param outfile: optional CSV file to stream the envelope to.
+        :return: dictionary with the envelope and the waist position/size.
+        """
+        if self.T is None:
+            raise Exception('No lenses in the beam!')
+        from bnlcrl.caustic import calc_caustic
+
+        return calc_caustic(
+            self.T,
+            z,
+            self.y0 if y0 is None else y0,
+            self.teta0 if teta0 is None else teta0,
+            outfile=outfile,
         )
-        self.delta = delta_obj.characteristic_value
-
-        # Perform calculations:
-        self.calc_T_total()
-        self.calc_y_teta()
-        self.calc_real_lens()
-        self.calc_ideal_lens()
-        self.d = self.calc_delta_focus(self.p1)
-        self.d_ideal = self.calc_delta_focus(self.p1_ideal)
-
-        if self.verbose:
-            self.print_result()
 
     def calc_delta_focus(self, p):
         if p is not None:
@@ -90,92 +349,66 @@ class CRLSimulator:
 
     @staticmethod
     def calc_ideal_focus(**kwargs):
-        # Get input variables:
-        d = read_json(DEFAULTS_FILE)
-        parameters = convert_types(d['cli_functions']['calc_ideal_focus']['parameters'])
-        for key, default_val in parameters.items():
-            if key in kwargs.keys():
-                locals()[key] = parameters[key]['type'](kwargs[key])
-            elif key not in locals() or locals()[key] is None:
-                locals()[key] = default_val['default']
-
-        # Perform calculation:
-        assert locals()['n'] > 0
-        assert locals()['delta'] != 0
-        ideal_focus = locals()['radius'] / (2. * locals()['n'] * locals()['delta'])
-        p1_ideal = 1. / (1. / ideal_focus - 1. / locals()['p0'])
-        p1_ideal_from_source = p1_ideal + locals()['p0']
-        return {
-            'ideal_focus': ideal_focus,
-            'p1_ideal': p1_ideal,
-            'p1_ideal_from_source': p1_ideal_from_source,
-        }
+        v = resolve_parameters(read_parameters(DEFAULTS_FILE, 'calc_ideal_focus'), kwargs)
+        return calc_ideal_focus(v['radius'], v['n'], v['delta'], v['p0'])
 
     def calc_ideal_lens(self):
-        self._get_radii_n()
-        if abs(sum(self.radii) / len(self.radii) - self.radii[0]) < self.radii_tolerance:
-            d = self.calc_ideal_focus(
-                radius=self.radii[0],
-                n=self.n,
-                delta=self.delta,
-                p0=self.p0
-            )
-            for k in d.keys():
-                setattr(self, k, d[k])
-        else:
-            print('Radii of the specified lenses ({}) are different! Cannot calculate ideal lens.'.format(self.radii))
+        d = calc_ideal_lens(self.radii, self.n, self.delta, self.p0,
+                            [self._find_data_file_by_id(x) for x in self.cart_ids], self.radii_tolerance)
+        for k in d.keys():
+            setattr(self, k, d[k])
 
-    def calc_lens_array(self, radius, n):
-        """Calculate accumulated T_fs for one cartridge with fixed radius.
+    def calc_jacobian(self):
+        """Calculate analytic derivatives of ``p1`` and ``d`` with respect to energy, p0, teta0 and dl_cart.
+
+        See :func:`bnlcrl.sensitivity.calc_sensitivity` (requires NumPy), the derivatives with respect to energy use the
+        slope of the delta table, so the analytical delta (``calc_delta``) is not supported.
+
+        :return: dictionary with the derivatives, e.g. ``dp1_denergy`` or ``dd_dp0``.
+        """
+        if self.T is None:
+            raise Exception('No lenses in the beam!')
+        if self.calc_delta:
+            raise Exception('The Jacobian is available for the tabulated delta only, not with calc_delta.')
+        from bnlcrl.sensitivity import calc_sensitivity
+
+        r = calc_sensitivity(
+            self.cart_ids,
+            self.energy,
+            p0=self.p0,
+            teta0=self.teta0,
+            beamline=self.beamline,
+            d_ssa_focus=self.d_ssa_focus,
+            data_file=self.data_file,
+            dl_cart=self.dl_cart,
+            dl_lens=self.dl_lens,
+            lens_array=self.lens_array,
+            r_array=self.r_array,
+        )
+        return dict((k, float(r[k])) for k in r.keys() if k.startswith('d') and k != 'd')
+
+    def calc_lens_array(self, radius, n, delta=None):
+        """Calculate accumulated T_fs for one cartridge with fixed radius (see :func:`calc_lens_array_matrix`).
 
         :param radius: radius.
         :param n: number of lenses in one cartridge.
+        :param delta: delta of the lens material, ``self.delta`` by default.
         :return T_fs_accum: accumulated T_fs.
         """
-        T_dl = self._calc_T_dl(self.dl_lens)
-        T_fs = self._calc_T_fs(radius)
-
-        T_fs_accum = self._dot(self._matrix_power(self._dot(T_fs, T_dl), n - 1), T_fs)
-        return T_fs_accum
+        return calc_lens_array_matrix(radius, n, self.delta if delta is None else delta, self.dl_lens,
+                                      use_numpy=self.use_numpy)
 
     def calc_real_lens(self):
-        self.p1 = self.y / math.tan(math.pi - self.teta)
-        self.f = 1 / (1 / self.p0 + 1 / self.p1)
+        self.p1, self.f = calc_real_lens(self.y, self.teta, self.p0)
 
     def calc_T_total(self):
-        dist_list = []
-        for i in range(len(self.cart_ids) - 1):
-            dist_list.append(self._calc_distance(self.cart_ids[i], self.cart_ids[i + 1]))
-
-        R_list = []
-        N_list = []
-        for i in range(len(self.cart_ids)):
-            j = self._find_element_by_id(self.cart_ids[i])
-            name = self.transfocator_config[j]['name']
-            R_list.append(self.lens_config[name]['radius'])
-            N_list.append(self.lens_config[name]['lens_number'])
-
-        if len(self.cart_ids) == 1:
-            self.T = self.calc_lens_array(R_list[0], N_list[0])
-        elif len(self.cart_ids) > 1:
-            A = self._calc_T_dl(dist_list[0])
-            B = self.calc_lens_array(R_list[0], N_list[0])
-            self.T = self._dot(A, B)
-            for i in range(len(self.cart_ids) + len(self.cart_ids) - 3):
-                if i % 2 == 0:
-                    B = self.calc_lens_array(R_list[int((i + 2) / 2)], N_list[int((i + 2) / 2)])
-                    self.T = self._dot(B, self.T)
-                else:
-                    A = self._calc_T_dl(dist_list[int((i + 1) / 2)])
-                    self.T = self._dot(A, self.T)
-        else:
-            raise Exception('No lenses in the beam!')
+        self.T = calc_transfer_matrix(self.cart_ids, self.transfocator_config, self.lens_config, self.deltas,
+                                      self.data_file, self.dl_cart, self.dl_lens, use_numpy=self.use_numpy)
 
     def calc_y_teta(self):
-        (self.y, self.teta) = self._dot(self.T, [self.y0, self.teta0])
+        (self.y, self.teta) = calc_y_teta(self.T, self.y0, self.teta0, use_numpy=self.use_numpy)
 
     def get_inserted_lenses(self):
-        self._get_radii_n()
         return {
             'ids': self.cart_ids,
             'radii': self.radii,
@@ -223,59 +456,7 @@ class CRLSimulator:
 
     def read_config_file(self):
         self.config_file = os.path.join(CONFIG_DIR, '{}_crl.json'.format(self.beamline))
-        self.transfocator_config = read_json(self.config_file)['crl']
-
-    def _calc_distance(self, id1, id2):
-        """Calculate distance between two arbitrary cartridges specified by ids.
-
-        :param id1: id of cartridge 1.
-        :param id2: id of cartridge 2.
-        :return dist: calculated distance.
-        """
-
-        el_num1 = self._find_element_by_id(id1)
-        el_num2 = self._find_element_by_id(id2)
-
-        lens_num1 = self.lens_config[self.transfocator_config[el_num1]['name']]['lens_number']
-        coord1 = self.transfocator_config[el_num1]['offset_cart'] * self.dl_cart
-        coord2 = self.transfocator_config[el_num2]['offset_cart'] * self.dl_cart
-        dist = coord2 - coord1 - lens_num1 * self.dl_lens
-        return dist
-
-    def _calc_T_dl(self, dl):
-        T_dl = [
-            [1, dl],
-            [0, 1],
-        ]
-        return T_dl
-
-    def _calc_T_fs(self, radius):
-        T_fs = [
-            [1, 0],
-            [-1 / (radius / (2 * self.delta)), 1],
-        ]
-        return T_fs
-
-    def _calc_y0(self):
-        self.y0 = self.p0 * math.tan(self.teta0)
-
-    def _check_ids(self):
-        """Check for incorrect input."""
-        if not self.cart_ids:
-            return False
-
-        for input_id in self.cart_ids:
-            if input_id not in self.available_ids:
-                msg = 'Specified cart_id <{}> not in the list of available ids: <{}>.'
-                raise Exception(msg.format(input_id, ', '.join(self.available_ids)))
-
-        len_total = len(self.cart_ids)
-        len_unique = len(set(self.cart_ids))
-        if len_total != len_unique:
-            msg = 'Number of non-unique cartridge ids: {}'
-            raise Exception(msg.format(len_total - len_unique + 1))
-
-        return True
+        self.transfocator_config = read_transfocator_config(self.beamline)
 
     def _check_imports(self):
         self.available_libs = {
@@ -283,36 +464,11 @@ class CRLSimulator:
         }
         for key in self.available_libs.keys():
             try:
-                __import__(key)
                 setattr(self, key, __import__(key))
                 self.available_libs[key] = True
-            except:
+            except ImportError:
                 self.available_libs[key] = False
 
-    def _dot(self, A, B):
-        """Multiplies matrix A by matrix B."""
-        if self.use_numpy and self.available_libs['numpy']:
-            C = self.numpy.dot(A, B)
-        else:
-            B0 = B[0]
-            lenB = len(B)
-            lenA = len(A)
-            if len(A[0]) != lenB:  # Check matrix dimensions
-                raise Exception('Matrices have wrong dimensions')
-            if isinstance(B0, list) or isinstance(B0, tuple):  # B is matrix
-                lenB0 = len(B0)
-                C = [[0 for _ in range(lenB0)] for _ in range(lenA)]
-                for i in range(lenA):
-                    for j in range(lenB0):
-                        for k in range(lenB):
-                            C[i][j] += A[i][k] * B[k][j]
-            else:  # B is vector
-                C = [0 for _ in range(lenB)]
-                for i in range(lenA):
-                    for k in range(lenB):
-                        C[i] += A[i][k] * B[k]
-        return C
-
     def _find_element_by_id(self, id):
         element_number = None
         for i in range(len(self.transfocator_config)):
@@ -321,68 +477,69 @@ class CRLSimulator:
                 break
         return element_number
 
-    def _find_lens_parameters_by_id(self, id):
-        return self._find_lens_parameters_by_name(self._find_name_by_id(id))
+    def _find_data_file_by_id(self, id):
+        return material_data_file(self.transfocator_config[self._find_element_by_id(id)], self.data_file)
 
-    def _find_lens_parameters_by_name(self, name):
-        return self.lens_config[name]
+    def _find_lens_parameters_by_id(self, id):
+        return self.lens_config[self._find_name_by_id(id)]
 
     def _find_name_by_id(self, id):
-        real_id = self._find_element_by_id(id)
-        name = self.transfocator_config[real_id]['name']
-        return name
+        return self.transfocator_config[self._find_element_by_id(id)]['name']
 
-    def _get_available_ids(self):
-        self.available_ids = []
-        for i in range(len(self.transfocator_config)):
-            self.available_ids.append(self.parameters['cart_ids']['element_type'](self.transfocator_config[i]['id']))
-
-    def _get_lens_config(self):
-        self.lens_config = {}
-        for i in self.r_array:
-            for j in self.lens_array:
-                self.lens_config['T_{}_{}'.format(j, i)] = {
-                    'radius': i * 1e-6,
-                    'lens_number': j,
-                }
-
-    def _get_radii_n(self):
-        self.radii = []
-        self.n = 0
-        for i in self.cart_ids:
-            name = self._find_name_by_id(i)
-            lens = self._find_lens_parameters_by_name(name)
-            self.radii.append(lens['radius'])
-            self.n += lens['lens_number']
-
-    def _matrix_power(self, A, n):
-        """Multiply matrix A n times.
-
-        :param A: input square matrix.
-        :param n: power.
-        :return B: resulted matrix.
-        """
-        if len(A) != len(A[0]):
-            raise Exception('Matrix is not square: {} x {}'.format(len(A), len(A[0])))
+    def _run(self, **kwargs):
+        # Check importable libs:
+        self._check_imports()
 
-        if self.use_numpy and self.available_libs['numpy']:
-            B = self.numpy.linalg.matrix_power(A, n)
-        else:
-            if n > 0:
-                B = copy.deepcopy(A)
-                for i in range(n - 1):
-                    B = self._dot(A, B)
-            elif n == 0:
-                B = []
-                for i in range(len(A)):
-                    row = []
-                    for j in range(len(A[0])):
-                        if i == j:
-                            row.append(1)
-                        else:
-                            row.append(0)
-                    B.append(row)
-            else:
-                raise Exception('Negative power <{}> is not supported for matrix power operation.'.format(n))
-
-        return B
+        # Get input variables:
+        self.parameters = read_parameters(DEFAULTS_FILE)
+        v = resolve_parameters(self.parameters, kwargs)
+        for key, value in v.items():
+            setattr(self, key, value)
+        self.use_numpy = bool(self.use_numpy and self.available_libs['numpy'])
+        self.read_config_file()  # defines self.config_file and self.transfocator_config
+        self.available_ids = get_available_ids(self.transfocator_config, self.parameters['cart_ids']['element_type'])
+        self.lens_config = get_lens_config(self.r_array, self.lens_array)
+
+        # Perform calculations:
+        r = _simulate(v)
+        for key, value in zip(r._fields, r):
+            setattr(self, key, value)
+
+        if self.verbose:
+            with timing.span('crl_simulator.print_result'):
+                self.print_result()
+
+
+def _check_ids(cart_ids, available_ids):
+    """Check for incorrect input."""
+    if not cart_ids:
+        return False
+
+    for input_id in cart_ids:
+        if input_id not in available_ids:
+            msg = 'Specified cart_id <{}> not in the list of available ids: <{}>.'
+            raise Exception(msg.format(input_id, ', '.join(available_ids)))
+
+    len_total = len(cart_ids)
+    len_unique = len(set(cart_ids))
+    if len_total != len_unique:
+        msg = 'Number of non-unique cartridge ids: {}'
+        raise Exception(msg.format(len_total - len_unique + 1))
+
+    return True
+
+
+def _find_cartridge(transfocator_config, cart_id):
+    for c in transfocator_config:
+        if cart_id == c['id']:
+            return c
+    return None
+
+
+def _numpy():
+    """Get NumPy if it can be imported, ``None`` otherwise."""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
@@ -7,44 +7,118 @@ Author: Maksim Rakitin (BNL)
 2016
 """
 
+import bisect
+import collections
 import json
 import math
 import os
+import threading
 
-from bnlcrl import visualize as vis
-from bnlcrl.utils import convert_types, defaults_file, read_json
+from bnlcrl import timing
+from bnlcrl.utils import defaults_file, read_config, read_parameters, resolve_parameters
 
 parms = defaults_file(suffix='delta')
 DAT_DIR = parms['dat_dir']
 CONFIG_DIR = parms['config_dir']
 DEFAULTS_FILE = parms['defaults_file']
 
+# Parsed data files, keyed by file name, with their modification times:
+_data_files = {}
+_data_files_lock = threading.Lock()
+
 
 class DeltaFinder:
+    """Find delta, attenuation length or transmission (a wrapper over :func:`find_characteristic`)."""
+
     def __init__(self, **kwargs):
-        # Check importable libs:
-        self._check_imports()
+        self.stats = None
+        if kwargs.get('timing'):
+            with timing.record() as r:
+                self._run(**kwargs)
+            self.stats = r.get()
+        else:
+            self._run(**kwargs)
 
-        # Get input variables:
-        d = read_json(DEFAULTS_FILE)
+    def calculate_delta(self):
+        self.analytical_delta = calc_formula_delta(self.energy, self.formula)
+
+    def print_info(self):
+        msg = 'Found {}={} for the closest energy={} eV from {}.'
+        print(msg.format(self.characteristic, self.characteristic_value, self.closest_energy, self.method))
+
+    def save_to_file(self):
+        e_min = self.default_e_min
+        counter = 0
+        try:
+            os.remove(self.outfile)
+        except:
+            pass
+        while e_min < self.default_e_max:
+            e_max = min(e_min + self.n_points * self.e_step, self.default_e_max)
+            for f in self.elements:  # comma-separated list of elements, the last one is saved
+                content = request_content(f, self.characteristic, e_min, e_max, self.n_points, thickness=self.thickness)
 
-        self.server_info = d['server_info']
-        self.parameters = convert_types(d['parameters'])
+            if counter > 0:
+                # Get rid of headers (2 first rows) and the first data row to avoid data overlap:
+                content = '\n'.join(content.split('\n')[3:])
+
+            with open(self.outfile, 'a') as f:
+                f.write(content)
+
+            counter += 1
+            e_min = e_max
+
+        if self.verbose:
+            print('Data from {} eV to {} eV saved to the <{}> file.'.format(
+                self.default_e_min, self.default_e_max, self.outfile))
+            print('Energy step: {} eV, number of points/chunk: {}, number of chunks {}.'.format(
+                self.e_step, self.n_points, counter))
 
-        self.default_e_min = self.parameters['e_min']['type'](self.parameters['e_min']['default'])
-        self.default_e_max = self.parameters['e_max']['type'](self.parameters['e_max']['default'])
+    def _request_from_server(self):
+        """Request the data of every element of the formula, plot and save them."""
+        from bnlcrl import visualize as vis
+
+        d = []
+        for f in self.elements:  # to support multiple chemical elements comma-separated list
+            e_min, e_max = _energy_range(self.energy, self.precise, self.e_min, self.e_max)
+            d.append(request_content(f, self.characteristic, e_min, e_max, self.n_points, thickness=self.thickness))
+        self.content = d[-1]
+        data, columns = vis.parse_data(d, self.elements)
+        if data is not None and columns is not None:
+            file_name = _output_file_name(self.elements, self.characteristic)
+            if self.plot:
+                vis.plot_data(
+                    data=data,
+                    elements=self.elements,
+                    property=self.characteristic,
+                    thickness=self.thickness,
+                    e_min=self.e_min,
+                    e_max=self.e_max,
+                    n_points=self.n_points,
+                    file_name=file_name,
+                    x_label=columns[0],
+                    show_plot=self.show_plot,
+                    columns=columns,
+                )
+            if self.save:
+                vis.save_to_csv(data=data, file_name=file_name, columns=columns)
+
+    def _run(self, **kwargs):
+        # Get input variables:
+        self.server_info = read_config(DEFAULTS_FILE)['server_info']
+        self.parameters = read_parameters(DEFAULTS_FILE)
 
-        for key, default_val in self.parameters.items():
-            if key in kwargs.keys():
-                setattr(self, key, self.parameters[key]['type'](kwargs[key]))
-            elif not hasattr(self, key) or getattr(self, key) is None:
-                setattr(self, key, default_val['default'])
+        self.default_e_min = self.parameters['e_min']['default']
+        self.default_e_max = self.parameters['e_max']['default']
+
+        values = resolve_parameters(self.parameters, kwargs)
+        for key, value in values.items():
+            setattr(self, key, value)
 
         self.characteristic_value = None
         self.analytical_delta = None
         self.closest_energy = None
         self.content = None
-        self.raw_content = None
         self.method = None  # can be 'file', 'server', 'calculation'
         self.output = None
         self.elements = self.formula.split(',')
@@ -54,234 +128,193 @@ class DeltaFinder:
             self.save_to_file()
             return
 
-        if not self.data_file:
-            self.method = 'server'
+        if not self.data_file and not self.calc_delta and (self.plot or self.save):
             self._request_from_server()
-        else:
-            self.method = 'file'
-            self.data_file = os.path.join(DAT_DIR, self.data_file)
 
+        r = find_characteristic(content=self.content, **values)
+        for key, value in zip(r._fields, r):
+            setattr(self, key, value)
+        if self.data_file:
+            self.data_file = os.path.join(DAT_DIR, self.data_file)
         if self.calc_delta:
-            if self.available_libs['periodictable']:
-                self.method = 'calculation'
-                self.calculate_delta()
-                self.characteristic_value = self.analytical_delta
-                self.closest_energy = self.energy
-            else:
-                raise ValueError('"periodictable" library is not available. Install it if you want to use it.')
-        else:
-            self._find_characteristic_value()
+            self.analytical_delta = self.characteristic_value
 
         if self.verbose:
             self.print_info()
 
         if self.save_output:
             return_dict = {}
-            for k in d['cli_functions']['find_delta']['returns']:
+            for k in read_config(DEFAULTS_FILE)['cli_functions']['find_delta']['returns']:
                 return_dict[k] = getattr(self, k)
             file_name = '{}.json'.format(_output_file_name(self.elements, self.characteristic))
-            with open(file_name, 'w') as f:
+            with timing.span('delta_finder.save_output'), open(file_name, 'w') as f:
                 json.dump(return_dict, f)
 
-    def calculate_delta(self):
-        rho = getattr(self.periodictable, self.formula).density
-        z = getattr(self.periodictable, self.formula).number
-        mass = getattr(self.periodictable, self.formula).mass
-        z_over_a = z / mass
-        wl = 2 * math.pi * 1973 / self.energy  # lambda= (2pi (hc))/E
-        self.analytical_delta = 2.7e-6 * wl ** 2 * rho * z_over_a
 
-    def print_info(self):
-        msg = 'Found {}={} for the closest energy={} eV from {}.'
-        print(msg.format(self.characteristic, self.characteristic_value, self.closest_energy, self.method))
+# The stateless core: the functions below take all inputs as arguments, share only the read-only configs (see
+# bnlcrl.utils.read_config) and the parsed data files, and return new objects, so they can be called from many threads.
 
-    def save_to_file(self):
-        self.e_min = self.default_e_min
-        self.e_max = self.e_min
-        counter = 0
-        try:
-            os.remove(self.outfile)
-        except:
-            pass
-        while self.e_max < self.default_e_max:
-            self.e_max += self.n_points * self.e_step
-            if self.e_max > self.default_e_max:
-                self.e_max = self.default_e_max
+DeltaResult = collections.namedtuple('DeltaResult', (
+    'characteristic', 'characteristic_value', 'closest_energy', 'element', 'method',
+))
 
-            self._request_from_server()
 
-            if counter > 0:
-                # Get rid of headers (2 first rows) and the first data row to avoid data overlap:
-                content = self.content.split('\n')
-                self.content = '\n'.join(content[3:])
+def analytic_delta(energy, density, z_over_a):
+    """Calculate delta from the wavelength, density and Z/A of the material (works with NumPy arrays of energies).
 
-            with open(self.outfile, 'a') as f:
-                f.write(self.content)
+    :param energy: photon energy [eV].
+    :param density: density of the material [g/cm^3].
+    :param z_over_a: ratio of the atomic number to the atomic mass (mean over the atoms of a compound).
+    :return: delta.
+    """
+    wl = 2 * math.pi * 1973 / energy  # lambda= (2pi (hc))/E
+    return 2.7e-6 * wl ** 2 * density * z_over_a
 
-            counter += 1
-            self.e_min = self.e_max
 
-        if self.verbose:
-            print('Data from {} eV to {} eV saved to the <{}> file.'.format(
-                self.default_e_min, self.default_e_max, self.outfile))
-            print('Energy step: {} eV, number of points/chunk: {}, number of chunks {}.'.format(
-                self.e_step, self.n_points, counter))
+def calc_formula_delta(energy, formula):
+    """Calculate delta of the element (e.g. ``Be``) with its density, Z and mass from ``periodictable``."""
+    try:
+        import periodictable
+    except ImportError:
+        raise ValueError('"periodictable" library is not available. Install it if you want to use it.')
+    element = getattr(periodictable, formula)
+    return analytic_delta(energy, element.density, element.number / element.mass)
 
-    def _check_imports(self):
-        self.available_libs = {
-            'numpy': None,
-            'periodictable': None,
-            'requests': None,
-        }
-        for key in self.available_libs.keys():
-            try:
-                __import__(key)
-                setattr(self, key, __import__(key))
-                self.available_libs[key] = True
-            except:
-                self.available_libs[key] = False
-
-    def _find_characteristic_value(self):
-        skiprows = 2
-        energy_column = 0
-        characteristic_value_column = 1
-        error_msg = 'Error! Use energy range from {} to {} eV.'
-        if self.use_numpy and self.available_libs['numpy']:
-            if self.data_file:
-                data = self.numpy.loadtxt(self.data_file, skiprows=skiprows)
-
-                self.default_e_min = data[0, energy_column]
-                self.default_e_max = data[-1, energy_column]
-
-                try:
-                    idx_previous = self.numpy.where(data[:, energy_column] <= self.energy)[0][-1]
-                    idx_next = self.numpy.where(data[:, energy_column] > self.energy)[0][0]
-                except IndexError:
-                    raise Exception(error_msg.format(self.default_e_min, self.default_e_max))
-
-                idx = idx_previous if abs(data[idx_previous, energy_column] - self.energy) <= abs(
-                    data[idx_next, energy_column] - self.energy) else idx_next
-
-                self.characteristic_value = data[idx][characteristic_value_column]
-                self.closest_energy = data[idx][energy_column]
-            else:
-                raise Exception('Processing with NumPy is only possible with the specified file, not content.')
-        else:
-            if not self.content:
-                with open(self.data_file, 'r') as f:
-                    self.raw_content = f.read()
-            else:
-                if type(self.content) != list:
-                    self.raw_content = self.content
-
-            self.content = self.raw_content.strip().split('\n')
-
-            energies = []
-            characteristic_values = []
-            for i in range(skiprows, len(self.content)):
-                energies.append(float(self.content[i].split()[energy_column]))
-                characteristic_values.append(float(self.content[i].split()[characteristic_value_column]))
-
-            self.default_e_min = energies[0]
-            self.default_e_max = energies[-1]
-
-            indices_previous = []
-            indices_next = []
-            try:
-                for i in range(len(energies)):
-                    if energies[i] <= self.energy:
-                        indices_previous.append(i)
-                    else:
-                        indices_next.append(i)
-                idx_previous = indices_previous[-1]
-                idx_next = indices_next[0]
-            except IndexError:
-                raise Exception(error_msg.format(self.default_e_min, self.default_e_max))
-
-            idx = idx_previous if abs(energies[idx_previous] - self.energy) <= abs(
-                energies[idx_next] - self.energy) else idx_next
-
-            self.characteristic_value = characteristic_values[idx]
-            self.closest_energy = energies[idx]
-        if self.characteristic == 'atten':
-            self.characteristic_value *= 1e-6  # Atten Length (microns)
-
-    def _get_remote_file_content(self):
-        get_url = '{}{}'.format(self.server_info['server'], self.file_name)
-        r = self.requests.get(get_url)
-        self.content = r.text
-        return self.content
-
-    def _get_remote_file_name(self, formula=None):
-        if self.precise:
-            e_min = self.energy - 1.0
-            e_max = self.energy + 1.0
+
+def find_characteristic(content=None, **kwargs):
+    """Find delta, attenuation length or transmission for the closest energy (the core of :class:`DeltaFinder`).
+
+    The value is taken from the data file if ``data_file`` is specified, calculated analytically if ``calc_delta``,
+    and requested from the server otherwise.
+
+    :param content: optional text of the data already requested from the server.
+    :param kwargs: parameters of ``defaults_delta.json``, the defaults are used for the missing ones.
+    :return: :class:`DeltaResult`.
+    """
+    v = resolve_parameters(read_parameters(DEFAULTS_FILE), kwargs)
+    element = v['formula'].split(',')[-1]
+    if v['calc_delta']:
+        value = calc_formula_delta(v['energy'], v['formula'])
+        return DeltaResult(v['characteristic'], value, v['energy'], element, 'calculation')
+    if v['data_file']:
+        method = 'file'
+        data_file = os.path.join(DAT_DIR, v['data_file'])
+        if v['use_numpy']:
+            from bnlcrl.tables import read_table
+
+            energies, values = read_table(data_file)
         else:
-            e_min = self.e_min
-            e_max = self.e_max
-        payload = {
-            self.server_info[self.characteristic]['fields']['density']: -1,
-            self.server_info[self.characteristic]['fields']['formula']: formula,
-            self.server_info[self.characteristic]['fields']['material']: 'Enter Formula',
-            self.server_info[self.characteristic]['fields']['max']: e_max,
-            self.server_info[self.characteristic]['fields']['min']: e_min,
-            self.server_info[self.characteristic]['fields']['npts']: self.n_points,
-            self.server_info[self.characteristic]['fields']['output']: 'Text File',
-            self.server_info[self.characteristic]['fields']['scan']: 'Energy',
-        }
-        if self.characteristic == 'atten':
-            payload[self.server_info[self.characteristic]['fields']['fixed']] = 90.0
-            payload[self.server_info[self.characteristic]['fields']['plot']] = 'Log'
-            payload[self.server_info[self.characteristic]['fields']['output']] = 'Plot',
-        elif self.characteristic == 'transmission':
-            payload[self.server_info[self.characteristic]['fields']['plot']] = 'Linear'
-            payload[self.server_info[self.characteristic]['fields']['output']] = 'Plot',
-            payload[self.server_info[self.characteristic]['fields']['thickness']] = self.thickness  # um
-        r = self.requests.post(
-            '{}{}'.format(self.server_info['server'], self.server_info[self.characteristic]['post_url']),
-            payload
-        )
+            energies, values = _read_data_file(data_file)
+    else:
+        method = 'server'
+        if v['use_numpy']:
+            raise Exception('Processing with NumPy is only possible with the specified file, not content.')
+        if content is None:
+            e_min, e_max = _energy_range(v['energy'], v['precise'], v['e_min'], v['e_max'])
+            content = request_content(element, v['characteristic'], e_min, e_max, v['n_points'],
+                                      thickness=v['thickness'])
+        energies, values = _parse_content(content.strip().split('\n'))
+    value, closest_energy = find_closest(energies, values, v['energy'])
+    if v['characteristic'] == 'atten':
+        value *= 1e-6  # Atten Length (microns)
+    return DeltaResult(v['characteristic'], value, closest_energy, element, method)
+
+
+def find_closest(energies, values, energy):
+    """Find the value for the closest energy, the lower one if the energy is right in between.
+
+    :param energies: sorted energies.
+    :param values: values at the energies.
+    :param energy: photon energy [eV], from the first energy to below the last one.
+    :return: tuple of the value and the closest energy.
+    """
+    i = bisect.bisect_right(energies, energy)
+    if i == 0 or i == len(energies):
+        raise Exception('Error! Use energy range from {} to {} eV.'.format(energies[0], energies[-1]))
+    idx = i - 1 if abs(energies[i - 1] - energy) <= abs(energies[i] - energy) else i
+    return values[idx], energies[idx]
+
+
+def request_content(formula, characteristic, e_min, e_max, n_points, thickness=None):
+    """Request the data for the energy range from the server (see ``server_info`` in ``defaults_delta.json``).
+
+    :param formula: chemical formula.
+    :param characteristic: ``delta``, ``atten`` or ``transmission``.
+    :param e_min: the lowest energy [eV].
+    :param e_max: the highest energy [eV].
+    :param n_points: number of points.
+    :param thickness: thickness of the material for ``transmission`` [um].
+    :return: text of the data file.
+    """
+    server_info = read_config(DEFAULTS_FILE)['server_info']
+    try:
+        import requests
+    except ImportError:
+        msg = 'Cannot use online resource <{}> to get {}. Use local file instead.'
+        raise Exception(msg.format(server_info['server'], characteristic))
+    fields = server_info[characteristic]['fields']
+    payload = {
+        fields['density']: -1,
+        fields['formula']: formula,
+        fields['material']: 'Enter Formula',
+        fields['max']: e_max,
+        fields['min']: e_min,
+        fields['npts']: n_points,
+        fields['output']: 'Text File',
+        fields['scan']: 'Energy',
+    }
+    if characteristic == 'atten':
+        payload[fields['fixed']] = 90.0
+        payload[fields['plot']] = 'Log'
+        payload[fields['output']] = 'Plot'
+    elif characteristic == 'transmission':
+        payload[fields['plot']] = 'Linear'
+        payload[fields['output']] = 'Plot'
+        payload[fields['thickness']] = thickness  # um
+    timing.count('delta_finder.server_requests')
+    with timing.span('delta_finder.request_from_server'):
+        r = requests.post('{}{}'.format(server_info['server'], server_info[characteristic]['post_url']), payload)
         content = r.text
 
         # The file name should be something like '/tmp/xray2565.dat':
         try:
-            self.file_name = str(
-                content.split('{}='.format(self.server_info[self.characteristic]['file_tag']))[1]
+            file_name = str(
+                content.split('{}='.format(server_info[characteristic]['file_tag']))[1]
                     .split('>')[0]
                     .replace('"', '')
             )
         except:
             raise Exception('\n\nFile name cannot be found! Server response:\n<{}>'.format(content.strip()))
-
-    def _request_from_server(self):
-        if self.available_libs['requests']:
-            d = []
-            for f in self.formula.split(','):  # to support multiple chemical elements comma-separated list
-                self._get_remote_file_name(formula=f)
-                r = self._get_remote_file_content()
-                d.append(r)
-            if self.plot or self.save:
-                df, columns = vis.to_dataframe(d, self.elements)
-                if df is not None and columns is not None:
-                    file_name = _output_file_name(self.elements, self.characteristic)
-                    if self.plot:
-                        vis.plot_data(
-                            df=df,
-                            elements=self.elements,
-                            property=self.characteristic,
-                            thickness=self.thickness,
-                            e_min=self.e_min,
-                            e_max=self.e_max,
-                            n_points=self.n_points,
-                            file_name=file_name,
-                            x_label=columns[0],
-                            show_plot=self.show_plot,
-                        )
-                    if self.save:
-                        vis.save_to_csv(df=df, file_name=file_name)
-        else:
-            msg = 'Cannot use online resource <{}> to get {}. Use local file instead.'
-            raise Exception(msg.format(self.server_info['server'], self.characteristic))
+        return requests.get('{}{}'.format(server_info['server'], file_name)).text
+
+
+def _energy_range(energy, precise, e_min, e_max):
+    return (energy - 1.0, energy + 1.0) if precise else (e_min, e_max)
+
+
+def _parse_content(lines, skiprows=2, energy_column=0, characteristic_value_column=1):
+    energies = []
+    characteristic_values = []
+    for i in range(skiprows, len(lines)):
+        energies.append(float(lines[i].split()[energy_column]))
+        characteristic_values.append(float(lines[i].split()[characteristic_value_column]))
+    return energies, characteristic_values
+
+
+def _read_data_file(file_name):
+    """Parse the data file once and reuse the result until the file changes."""
+    mtime = os.path.getmtime(file_name)
+    with _data_files_lock:
+        cached = _data_files.get(file_name)
+        if cached and cached[0] == mtime:
+            timing.count('delta_finder.cache_hits')
+            return cached[1]
+    timing.count('delta_finder.file_reads')
+    with timing.span('delta_finder.parse'), open(file_name, 'r') as f:
+        data = _parse_content(f.read().strip().split('\n'))
+    with _data_files_lock:
+        _data_files[file_name] = (mtime, data)
+    return data
 
 
 def _output_file_name(elements, characteristic):
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+u"""Inverse solver: the energy or ``p0`` putting the focus of a cartridge set at the target.
+
+``d`` is evaluated on a coarse grid for all cartridge sets at once to find a bracket with a root, skipping the pole
+where the image goes to infinity. Then all brackets are refined simultaneously with a bracketed secant method
+(Illinois modification of regula falsi) falling back to bisection when the secant step leaves the bracket.
+
+When solving for energy, delta is interpolated linearly between the tabulated energies so ``d`` is continuous.
+
+:copyright: Copyright (c) 2016 mrakitin.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+from bnlcrl.crl_batch import CRLBatch
+from bnlcrl.crl_simulator import DEFAULTS_FILE
+from bnlcrl.tables import read_table
+from bnlcrl.utils import read_parameters, resolve_parameters
+
+BRACKETS = {
+    'energy': (1000., None),  # the upper limit is the last energy of the tables
+    'p0': (0.1, 100.),
+}
+
+
+def solve(cart_ids_list, variable='energy', energy=None, p0=None, target=0., x_min=None, x_max=None, xtol=1e-9,
+          max_iter=100, n_grid=64, **kwargs):
+    """Find the energy or ``p0`` at which ``d`` of each cartridge set equals the target.
+
+    :param cart_ids_list: list of lists of cartridges ids.
+    :param variable: ``energy`` or ``p0``.
+    :param energy: photon energy when solving for ``p0`` [eV].
+    :param p0: distance from source to the CRL when solving for energy [m].
+    :param target: target ``d`` [m], 0 puts the focus at ``d_ssa_focus``.
+    :param x_min: lower limit of the search interval.
+    :param x_max: upper limit of the search interval.
+    :param xtol: absolute tolerance of the solution.
+    :param max_iter: maximum number of refinement iterations.
+    :param n_grid: number of grid points used to find the brackets.
+    :param kwargs: other parameters of the CRL model (see :class:`bnlcrl.crl_batch.CRLBatch`).
+    :return: dictionary of arrays per cartridge set: ``solution``, ``residual`` (``d`` - target), ``converged``,
+        ``iterations`` and ``bracket_width``; ``solution`` and ``residual`` are NaN when no root was found.
+    """
+    if variable not in BRACKETS:
+        raise Exception('Unknown variable <{}>, use one of: {}.'.format(variable, ', '.join(sorted(BRACKETS))))
+    b = CRLBatch(**kwargs)
+    masks = b.get_masks(cart_ids_list)
+    if not masks.any(axis=1).all():
+        raise Exception('No lenses in the beam!')
+    if variable == 'energy':
+        p0 = b.p0 if p0 is None else p0
+        x_min = BRACKETS['energy'][0] if x_min is None else x_min
+        x_max = min(read_table(x)[0][-1] for x in b.materials) if x_max is None else x_max
+
+        def g(x):
+            delta = b.find_delta(x, interpolate=True)
+            return b.simulate(x, masks, p0=p0, delta=delta, paired=True, transmission=False)['d'] - target
+    else:
+        if energy is None:
+            raise Exception('Energy must be specified to solve for p0.')
+        x_min = BRACKETS['p0'][0] if x_min is None else x_min
+        x_max = BRACKETS['p0'][1] if x_max is None else x_max
+        delta = b.find_delta(energy)
+
+        def g(x):
+            r = b.simulate(np.full(x.shape, energy), masks, p0=x, delta=np.broadcast_to(delta, x.shape + delta.shape),
+                           paired=True, transmission=False)
+            return r['d'] - target
+
+    # Brackets: the sign change with the smallest |d| at its ends (a pole has large |d| on both sides):
+    n_sets = len(masks)
+    grid = np.repeat(np.linspace(x_min, x_max, n_grid)[:, None], n_sets, axis=1)
+    values = g(grid)
+    with np.errstate(invalid='ignore'):
+        change = (np.sign(values[:-1]) * np.sign(values[1:]) <= 0) & np.isfinite(values[:-1] + values[1:])
+    score = np.where(change, np.abs(values[:-1]) + np.abs(values[1:]), np.inf)
+    k = np.argmin(score, axis=0)
+    found = np.isfinite(score[k, np.arange(n_sets)])
+    a = grid[k, np.arange(n_sets)]
+    c = grid[k + 1, np.arange(n_sets)]
+    ga = values[k, np.arange(n_sets)]
+    gc = values[k + 1, np.arange(n_sets)]
+    g_bracket = np.minimum(np.abs(ga), np.abs(gc))
+
+    # Refinement:
+    iterations = np.zeros(n_sets, dtype=int)
+    side = np.zeros(n_sets, dtype=int)  # which end was replaced in the previous step: -1 - c, 1 - a
+    solution = np.where(np.abs(ga) <= np.abs(gc), a, c)
+    active = found & (ga != 0) & (gc != 0)
+    for _ in range(max_iter):
+        if not active.any():
+            break
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x = c - gc * (c - a) / (gc - ga)
+        # Bisection when the secant step is not strictly inside the bracket:
+        inside = np.isfinite(x) & (x > np.minimum(a, c)) & (x < np.maximum(a, c))
+        x = np.where(active, np.where(inside, x, (a + c) / 2), a)
+        gx = g(x)
+        iterations += active
+        solution = np.where(active, x, solution)
+        replace_c = active & (np.sign(gx) == np.sign(gc))
+        replace_a = active & ~replace_c
+        # Illinois modification: halve the value at the end kept twice in a row:
+        ga = np.where(replace_c & (side == -1), ga / 2, ga)
+        gc = np.where(replace_a & (side == 1), gc / 2, gc)
+        c, gc = np.where(replace_c, x, c), np.where(replace_c, gx, gc)
+        a, ga = np.where(replace_a, x, a), np.where(replace_a, gx, ga)
+        side = np.where(replace_c, -1, np.where(replace_a, 1, side))
+        active &= (gx != 0) & (np.abs(c - a) > xtol)
+
+    residual = g(np.where(found, solution, x_min))
+    # A bracket around the pole also shrinks to zero width, but |d| grows instead of decreasing:
+    found &= np.abs(residual) <= g_bracket
+    residual = np.where(found, residual, np.nan)
+    return {
+        'bracket_width': np.where(found, np.abs(c - a), np.nan),
+        'converged': found & ((np.abs(c - a) <= xtol) | (residual == 0)),
+        'iterations': iterations,
+        'residual': residual,
+        'solution': np.where(found, solution, np.nan),
+    }
+
+
+def solve_focus(**kwargs):
+    """Solve for energy or ``p0`` for one cartridge set (see ``defaults_crl.json``)."""
+    parameters = read_parameters(DEFAULTS_FILE, 'solve_focus')
+    v = resolve_parameters(parameters, kwargs)
+    kwargs = dict((k, x) for k, x in kwargs.items() if k not in parameters)
+    r = solve(
+        [v['cart_ids']],
+        variable=v['variable'],
+        energy=v['energy'] or None,
+        p0=v['p0'],
+        target=v['target'],
+        beamline=v['beamline'],
+        **kwargs
+    )
+    return {
+        'converged': bool(r['converged'][0]),
+        'iterations': int(r['iterations'][0]),
+        'residual': float(r['residual'][0]),
+        'solution': float(r['solution'][0]),
+        'variable': v['variable'],
+    }
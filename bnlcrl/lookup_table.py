@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+u"""Precomputed cartridge set x energy lookup table stored as memory-mapped arrays.
+
+Every non-empty cartridge set of the beamline is evaluated on an energy grid with :class:`bnlcrl.crl_batch.CRLBatch`
+and ``p1``, ``f``, ``d``, the transmission, the gain and the number of lenses are saved as ``.npy`` files in the table
+directory. For each energy the sets are also sorted by ``d``, so the best set for a target ``d`` is a binary search in
+one row.
+
+The table is rebuilt when the beamline JSON, the material table or the model parameters change.
+
+:copyright: Copyright (c) 2016 mrakitin.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+
+import json
+import os
+import threading
+
+import numpy as np
+
+from bnlcrl.crl_batch import CRLBatch
+from bnlcrl.crl_simulator import DEFAULTS_FILE
+from bnlcrl.tables import data_file_path, file_digest
+from bnlcrl.utils import read_json, read_parameters, resolve_parameters
+
+COLUMNS = ('p1', 'f', 'd', 'transmission', 'gain')
+FORMAT_VERSION = 2
+META_FILE = 'meta.json'
+MODEL_PARAMETERS = ('beamline', 'd_ssa_focus', 'data_file', 'dl_cart', 'dl_lens', 'lens_array', 'lens_thickness', 'p0',
+                    'r_array', 'source_size', 'teta0', 'web_thickness')
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+class LookupTable:
+    def __init__(self, table_dir=None, e_min=1000., e_max=29990., e_step=10., chunk_size=256, **kwargs):
+        """Open the lookup table, building it if it does not exist or is outdated.
+
+        :param table_dir: directory with the table files, ``<beamline>_crl_table`` in the current directory by default.
+        :param e_min: the lowest energy of the grid [eV].
+        :param e_max: the highest energy of the grid [eV].
+        :param e_step: energy step of the grid [eV].
+        :param chunk_size: number of energies evaluated at once while building.
+        :param kwargs: parameters of the CRL model (see :class:`bnlcrl.crl_batch.CRLBatch`).
+        """
+        self.batch = CRLBatch(**kwargs)
+        self.table_dir = table_dir or '{}_crl_table'.format(self.batch.beamline)
+        self.chunk_size = chunk_size
+        self.grid = {'e_min': float(e_min), 'e_max': float(e_max), 'e_step': float(e_step)}
+        self.source_files = [self.batch.config_file] + [
+            data_file_path(x) for x in self.batch.materials + self.batch.atten_files
+        ]
+        self.arrays = {}
+        self.meta = None
+        self.source_mtimes = None
+        self.open()
+
+    def build(self):
+        """Evaluate all cartridge sets on the energy grid and save them to the table directory."""
+        if not os.path.isdir(self.table_dir):
+            os.makedirs(self.table_dir)
+        meta_file = os.path.join(self.table_dir, META_FILE)
+        if os.path.exists(meta_file):
+            os.remove(meta_file)
+
+        energies = np.arange(self.grid['e_min'], self.grid['e_max'] + self.grid['e_step'] / 2, self.grid['e_step'])
+        masks = self.batch.get_masks()
+        shape = (len(energies), len(masks))
+        np.save(self._path('energies'), energies)
+        np.save(self._path('masks'), masks)
+        np.save(self._path('lens_number'), masks.astype(int).dot(self.batch.lens_numbers))
+        out = {}
+        for key in COLUMNS + ('d_sorted',):
+            out[key] = np.lib.format.open_memmap(self._path(key), mode='w+', dtype=np.float64, shape=shape)
+        out['order'] = np.lib.format.open_memmap(self._path('order'), mode='w+', dtype=np.int32, shape=shape)
+        for start in range(0, len(energies), self.chunk_size):
+            s = slice(start, start + self.chunk_size)
+            r = self.batch.simulate(energies[s], masks)
+            for key in COLUMNS:
+                out[key][s] = r[key]
+            order = np.argsort(r['d'], axis=1, kind='stable')
+            out['order'][s] = order
+            out['d_sorted'][s] = np.take_along_axis(r['d'], order, axis=1)
+        for a in out.values():
+            a.flush()
+        del out
+
+        with open(meta_file, 'w') as f:
+            json.dump(self._fingerprint(), f, sort_keys=True, indent=4)
+
+    def find_configuration(self, energy, target=0.):
+        """Find the cartridge set with ``d`` closest to the target at the closest grid energy.
+
+        :param energy: photon energy [eV].
+        :param target: target ``d`` [m], 0 puts the focus at ``d_ssa_focus``.
+        :return: dictionary with the cartridge ids and their ``p1``, ``f``, ``d``, transmission, gain and number of
+            lenses.
+        """
+        energies = self.arrays['energies']
+        i = int(np.clip(np.searchsorted(energies, energy), 1, len(energies) - 1))
+        if abs(energies[i - 1] - energy) <= abs(energies[i] - energy):
+            i -= 1
+        row = self.arrays['d_sorted'][i]
+        k = int(np.clip(np.searchsorted(row, target), 1, len(row) - 1))
+        if abs(row[k - 1] - target) <= abs(row[k] - target):
+            k -= 1
+        j = int(self.arrays['order'][i, k])
+        return {
+            'cart_ids': self.batch.get_cart_ids(self.arrays['masks'][j]),
+            'd': float(self.arrays['d'][i, j]),
+            'energy': float(energies[i]),
+            'f': float(self.arrays['f'][i, j]),
+            'gain': float(self.arrays['gain'][i, j]),
+            'lens_number': int(self.arrays['lens_number'][j]),
+            'p1': float(self.arrays['p1'][i, j]),
+            'transmission': float(self.arrays['transmission'][i, j]),
+        }
+
+    def is_stale(self):
+        """Check if the source files changed since the table was opened."""
+        return self.source_mtimes != [os.path.getmtime(x) for x in self.source_files]
+
+    def open(self):
+        """Memory-map the table files, rebuilding the table first if it is missing or outdated."""
+        fingerprint = self._fingerprint()
+        try:
+            meta = read_json(os.path.join(self.table_dir, META_FILE))
+        except Exception:
+            meta = None
+        if meta != fingerprint:
+            self.build()
+        self.meta = fingerprint
+        self.source_mtimes = [os.path.getmtime(x) for x in self.source_files]
+        self.arrays = {}
+        for key in ('energies', 'masks', 'lens_number', 'order', 'd_sorted') + COLUMNS:
+            self.arrays[key] = np.load(self._path(key), mmap_mode='r')
+
+    def _fingerprint(self):
+        d = {
+            'format_version': FORMAT_VERSION,
+            'grid': self.grid,
+            'parameters': dict((k, getattr(self.batch, k)) for k in MODEL_PARAMETERS),
+            'sources': dict((os.path.basename(x), file_digest(x)) for x in self.source_files),
+        }
+        # Normalize to what JSON stores, e.g. tuples become lists:
+        return json.loads(json.dumps(d))
+
+    def _path(self, key):
+        return os.path.join(self.table_dir, '{}.npy'.format(key))
+
+
+def find_configuration(**kwargs):
+    """Find the cartridge set focusing closest to the target ``d`` at the given energy (see ``defaults_crl.json``).
+
+    Opened tables are kept per directory and reopened if their source files change.
+    """
+    v = resolve_parameters(read_parameters(DEFAULTS_FILE, 'find_configuration'), kwargs)
+
+    model = dict((k, v[k]) for k in ('beamline', 'lens_thickness', 'source_size', 'web_thickness'))
+    key = (v['table_dir'],) + tuple(sorted(model.items()))
+    # The first calls wait for the one opening the table instead of opening it again:
+    with _tables_lock:
+        t = _tables.get(key)
+        if t is None or t.is_stale():
+            t = LookupTable(table_dir=v['table_dir'], **model)
+            _tables[key] = t
+    return t.find_configuration(v['energy'], target=v['target'])
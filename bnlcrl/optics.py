@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+u"""Pure-Python 2x2 ray-transfer matrix kernel (no NumPy required, e.g. under Jython).
+
+A matrix ``[[a, b], [c, d]]`` is a flat 4-tuple ``(a, b, c, d)`` and all products are unrolled, so no lists are
+allocated and no indices are looped over. :func:`mul_array` multiplies many matrices stored one after another in flat
+``array('d')`` buffers.
+
+:copyright: Copyright (c) 2016 mrakitin.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+
+from array import array
+
+IDENTITY = (1., 0., 0., 1.)
+
+
+def apply(m, y, teta):
+    """Propagate the ray (``y``, ``teta``) through the matrix."""
+    return m[0] * y + m[1] * teta, m[2] * y + m[3] * teta
+
+
+def drift(dl):
+    return 1., dl, 0., 1.
+
+
+def from_nested(A):
+    return A[0][0], A[0][1], A[1][0], A[1][1]
+
+
+def lens(radius, delta):
+    """Thin parabolic lens (see ``crl_simulator.calc_lens_array_matrix``)."""
+    return 1., 0., -2. * delta / radius, 1.
+
+
+def lens_array(radius, n, delta, dl_lens):
+    """Calculate the matrix of ``n`` lenses spaced by ``dl_lens`` (see ``crl_simulator.calc_lens_array_matrix``)."""
+    f = -2. * delta / radius
+    # T_fs * T_dl to the power of n - 1, then multiplied by T_fs:
+    m = power((1., dl_lens, f, f * dl_lens + 1.), n - 1)
+    return m[0] + m[1] * f, m[1], m[2] + m[3] * f, m[3]
+
+
+def mul(a, b):
+    """Multiply two matrices."""
+    a0, a1, a2, a3 = a
+    b0, b1, b2, b3 = b
+    return a0 * b0 + a1 * b2, a0 * b1 + a1 * b3, a2 * b0 + a3 * b2, a2 * b1 + a3 * b3
+
+
+def mul_array(a, b, out=None):
+    """Multiply the matrices of two flat arrays pairwise.
+
+    :param a: flat ``array('d')`` of ``4 * n`` values.
+    :param b: flat ``array('d')`` of ``4 * n`` values.
+    :param out: optional array of the same size to write to (may be ``a`` or ``b``).
+    :return: array with the products.
+    """
+    if len(a) != len(b) or len(a) % 4:
+        raise Exception('Arrays must contain the same number of 2x2 matrices.')
+    if out is None:
+        out = array('d', [0.]) * len(a)
+    for i in range(0, len(a), 4):
+        a0, a1, a2, a3 = a[i], a[i + 1], a[i + 2], a[i + 3]
+        b0, b1, b2, b3 = b[i], b[i + 1], b[i + 2], b[i + 3]
+        out[i] = a0 * b0 + a1 * b2
+        out[i + 1] = a0 * b1 + a1 * b3
+        out[i + 2] = a2 * b0 + a3 * b2
+        out[i + 3] = a2 * b1 + a3 * b3
+    return out
+
+
+def power(a, n):
+    """Raise the matrix to a non-negative integer power by repeated squaring."""
+    if n < 0:
+        raise Exception('Negative power <{}> is not supported for matrix power operation.'.format(n))
+    m = IDENTITY
+    while n:
+        if n & 1:
+            m = mul(a, m)
+        a = mul(a, a)
+        n >>= 1
+    return m
+
+
+def to_nested(m):
+    return [[m[0], m[1]], [m[2], m[3]]]
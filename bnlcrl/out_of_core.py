@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+u"""Out-of-core sweeps of the CRL model over energy x p0 x teta0 x cartridge sets.
+
+The grid is evaluated with :class:`bnlcrl.crl_batch.CRLBatch` in chunks of about ``chunk_size`` results (whole rows
+of the cartridge sets), and every chunk is written straight into the preallocated ``.npy`` files of the result
+columns, each of shape ``(len(energies), len(p0), len(teta0), n_sets)``. So the memory of the process is bounded by
+the chunk, not by the grid.
+
+Completed chunks are recorded in ``done.npy`` after their columns are flushed, so an interrupted sweep resumes from
+the first missing chunk when it is run again with the same parameters. The results are opened lazily with
+:func:`open_sweep`::
+
+    r = open_sweep('sweep')
+    r['d'][i_energy, i_p0, i_teta0, :]  # only the pages read are loaded
+
+:copyright: Copyright (c) 2016 mrakitin.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+
+import json
+import os
+
+import numpy as np
+
+from bnlcrl import timing
+from bnlcrl.crl_batch import CRLBatch
+from bnlcrl.lookup_table import MODEL_PARAMETERS
+from bnlcrl.tables import data_file_path, file_digest
+from bnlcrl.utils import read_json
+
+AXES = ('energy', 'p0', 'teta0')
+COLUMNS = ('p1', 'f', 'd', 'transmission', 'effective_aperture', 'gain')
+DEFAULT_CHUNK_SIZE = 65536  # number of results evaluated at once
+FORMAT_VERSION = 1
+META_FILE = 'meta.json'
+
+
+class OutOfCoreSweep:
+    def __init__(self, sweep_dir, energies, p0=None, teta0=None, cart_ids_list=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                 dtype='float64', **kwargs):
+        """Prepare the sweep directory, or check that an existing one has the same parameters to resume it.
+
+        :param sweep_dir: directory with the sweep files.
+        :param energies: photon energies [eV].
+        :param p0: distances from source to the CRL [m], the one of the model by default.
+        :param teta0: divergences of the beam [rad], the one of the model by default.
+        :param cart_ids_list: list of lists of cartridges ids, all non-empty subsets of the slots by default.
+        :param chunk_size: approximate number of results (operating points times cartridge sets) in a chunk.
+        :param dtype: data type of the result columns, e.g. ``float32`` halves the size of the files.
+        :param kwargs: parameters of the CRL model (see :class:`bnlcrl.crl_batch.CRLBatch`).
+        """
+        self.batch = CRLBatch(**kwargs)
+        self.sweep_dir = sweep_dir
+        self.axes = {
+            'energy': np.asarray(energies, dtype=float).ravel(),
+            'p0': np.asarray(self.batch.p0 if p0 is None else p0, dtype=float).ravel(),
+            'teta0': np.asarray(self.batch.teta0 if teta0 is None else teta0, dtype=float).ravel(),
+        }
+        self.masks = self.batch.get_masks(cart_ids_list)
+        self.all_subsets = cart_ids_list is None
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(len(self.axes[x]) for x in AXES) + (len(self.masks),)
+        # Operating points (energy, p0, teta0) per chunk:
+        self.chunk_points = max(1, int(chunk_size) // len(self.masks))
+        n_points = int(np.prod(self.shape[:-1]))
+        self.n_chunks = -(-n_points // self.chunk_points)
+        self.source_files = [self.batch.config_file] + [
+            data_file_path(x) for x in self.batch.materials + self.batch.atten_files
+        ]
+        self._prepare()
+
+    def is_complete(self):
+        return bool(np.load(self._path('done'), mmap_mode='r').all())
+
+    def run(self, max_chunks=None):
+        """Evaluate the chunks which are not done yet.
+
+        :param max_chunks: maximum number of chunks evaluated in this call, all remaining chunks by default.
+        :return: number of the chunks evaluated.
+        """
+        done = np.load(self._path('done'), mmap_mode='r+')
+        todo = np.flatnonzero(~done)
+        if max_chunks is not None:
+            todo = todo[:max_chunks]
+        n_sets = self.shape[-1]
+        n_points = int(np.prod(self.shape[:-1]))
+        delta = self.batch.find_delta(self.axes['energy'])
+        for i in todo:
+            with timing.span('out_of_core.chunk'):
+                start = int(i) * self.chunk_points
+                stop = min(start + self.chunk_points, n_points)
+                ie, ip, it = np.unravel_index(np.arange(start, stop), self.shape[:-1])
+                r = self.batch.simulate(
+                    self.axes['energy'][ie],
+                    None if self.all_subsets else self.masks,
+                    p0=self.axes['p0'][ip],
+                    teta0=self.axes['teta0'][it],
+                    delta=delta[ie],
+                )
+                for key in COLUMNS:
+                    a = np.load(self._path(key), mmap_mode='r+')
+                    a.reshape(-1, n_sets)[start:stop] = r[key]
+                    a.flush()
+                    del a
+            done[i] = True
+            done.flush()
+            timing.count('out_of_core.chunks')
+        return len(todo)
+
+    def _fingerprint(self):
+        d = {
+            'axes': dict((k, v.tolist()) for k, v in self.axes.items()),
+            'chunk_points': self.chunk_points,
+            'dtype': self.dtype.name,
+            'format_version': FORMAT_VERSION,
+            'parameters': dict((k, getattr(self.batch, k)) for k in MODEL_PARAMETERS if k not in AXES),
+            'sets': self.masks.astype(int).tolist(),
+            'sources': dict((os.path.basename(x), file_digest(x)) for x in self.source_files),
+        }
+        # Normalize to what JSON stores, e.g. tuples become lists:
+        return json.loads(json.dumps(d))
+
+    def _path(self, key):
+        return os.path.join(self.sweep_dir, '{}.npy'.format(key))
+
+    def _prepare(self):
+        fingerprint = self._fingerprint()
+        meta_file = os.path.join(self.sweep_dir, META_FILE)
+        if os.path.exists(meta_file):
+            if read_json(meta_file) != fingerprint:
+                raise Exception('The sweep in <{}> has different parameters, use another directory.'.format(
+                    self.sweep_dir))
+            return
+        if not os.path.isdir(self.sweep_dir):
+            os.makedirs(self.sweep_dir)
+        for key in AXES:
+            np.save(self._path(key), self.axes[key])
+        np.save(self._path('masks'), self.masks)
+        np.save(self._path('lens_number'), self.masks.astype(int).dot(self.batch.lens_numbers))
+        for key in COLUMNS:
+            # Allocate the file without touching the data:
+            a = np.lib.format.open_memmap(self._path(key), mode='w+', dtype=self.dtype, shape=self.shape)
+            del a
+        np.save(self._path('done'), np.zeros(self.n_chunks, dtype=bool))
+        # The meta file is written last, a directory without it is prepared again:
+        with open(meta_file, 'w') as f:
+            json.dump(fingerprint, f, sort_keys=True)
+
+
+def open_sweep(sweep_dir):
+    """Open the results of a sweep as read-only memory-mapped arrays.
+
+    :param sweep_dir: directory with the sweep files.
+    :return: dictionary with the result columns of shape ``(len(energy), len(p0), len(teta0), n_sets)``, the axes
+        ``energy``, ``p0`` and ``teta0``, ``masks`` of the cartridge sets, per-set ``lens_number`` and ``done`` with
+        the flags of the completed chunks.
+    """
+    if not os.path.exists(os.path.join(sweep_dir, META_FILE)):
+        raise Exception('No sweep found in <{}>.'.format(sweep_dir))
+    return dict(
+        (k, np.load(os.path.join(sweep_dir, '{}.npy'.format(k)), mmap_mode='r'))
+        for k in AXES + COLUMNS + ('done', 'lens_number', 'masks')
+    )
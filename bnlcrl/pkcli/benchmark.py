@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+u"""Run the benchmarks (see :mod:`bnlcrl.benchmarks`).
+
+:copyright: Copyright (c) 2016 mrakitin.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+
+from bnlcrl import benchmarks
+
+
+def check(baseline_file=None, ratio=benchmarks.DEFAULT_RATIO, repeat=5, min_time=0.05):
+    """Run the regression gate and fail if a benchmark is slower than ``ratio`` times its baseline.
+
+    Args:
+        baseline_file (str): baseline JSON file, the one of the package by default.
+        ratio (float): maximum allowed ratio of the normalized timings to the baseline.
+        repeat (int): number of rounds of each benchmark.
+        min_time (float): minimum duration of a round [s].
+    """
+    comparison = benchmarks.check(
+        baseline_file=baseline_file,
+        ratio=float(ratio),
+        repeat=int(repeat),
+        min_time=float(min_time),
+    )
+    for x in comparison:
+        print('{:<40} {:>10.4g} {:>10.4g} {:>6.2f}{}'.format(
+            x['name'], x['baseline'], x['current'], x['ratio'], '  SLOWER' if x['regressed'] else ''))
+    regressed = [x['name'] for x in comparison if x['regressed']]
+    if regressed:
+        raise Exception('Slower than {} times the baseline: {}.'.format(ratio, ', '.join(regressed)))
+
+
+def list_names():
+    """Print the names of the benchmarks."""
+    for name in benchmarks.select_names():
+        print(name)
+
+
+def run(outfile='-', select=None, repeat=5, min_time=0.05):
+    """Run the benchmarks and write the timings as JSON.
+
+    Args:
+        outfile (str): output JSON file, ``-`` for stdout.
+        select (str): shell-style pattern of the benchmark names to run, e.g. ``find_delta/*``, all by default.
+        repeat (int): number of rounds of each benchmark.
+        min_time (float): minimum duration of a round [s].
+    """
+    benchmarks.write(
+        benchmarks.run(select=select, repeat=int(repeat), min_time=float(min_time)),
+        outfile=outfile,
+    )
+
+
+def update_baseline(baseline_file=None, repeat=5, min_time=0.05):
+    """Measure the benchmarks of the regression gate and write them to the baseline file.
+
+    Args:
+        baseline_file (str): baseline JSON file, the one of the package by default.
+        repeat (int): number of rounds of each benchmark.
+        min_time (float): minimum duration of a round [s].
+    """
+    benchmarks.update_baseline(baseline_file=baseline_file, repeat=int(repeat), min_time=float(min_time))
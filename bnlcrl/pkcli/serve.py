@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+u"""Run the local JSON-RPC simulation server (see :mod:`bnlcrl.server`).
+
+:copyright: Copyright (c) 2016 mrakitin.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+
+from bnlcrl import timing as _timing
+from bnlcrl.server import SimulationServer
+
+
+def default_command(host='127.0.0.1', port=8000, workers=8, timing=False):
+    """Serve ``simulate_crl``, ``find_delta`` and ``calc_ideal_focus`` over JSON-RPC until interrupted.
+
+    Args:
+        host (str): host name or address to listen on.
+        port (int): port to listen on.
+        workers (int): number of threads handling the requests.
+        timing (bool): collect the phase timings and counters of all requests (shown in ``/metrics``).
+    """
+    if timing:
+        _timing.enable()
+    server = SimulationServer(host=host, port=int(port), workers=int(workers))
+    print('Serving JSON-RPC on http://{}:{}/ (metrics at /metrics).'.format(*server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
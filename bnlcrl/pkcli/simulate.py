@@ -4,11 +4,27 @@ u"""Utilities for X-Ray beamlines.
 The module to perform the following operations:
 
 - simulate Compound Refractive Lenses (``CRL``) in the approximation of thick lens;
+- simulate the CRL separately in the horizontal and vertical planes;
 - get the Index of Refraction (``Delta``) value;
-- calculate ideal focal distance.
+- find the energies for target delta or attenuation length values;
+- calculate ideal focal distance;
+- find the cartridge set for the target focus in the precomputed lookup table;
+- plan cartridge moves for energy scans;
+- simulate chromatic focusing over an input spectrum;
+- run Monte Carlo tolerance analysis of the lenses;
+- solve for the energy or p0 focusing the cartridge set at the target;
+- process a stream of JSON-lines requests in one process;
+- sweep the CRL over fine energy x p0 x teta0 grids into memory-mapped files.
+
+Every command generated from the defaults JSON files accepts ``--profile`` (see :mod:`bnlcrl.profiling`).
 """
+import sys
+
 import argh
 
+# The NumPy-backed modules (e.g. lookup_table) are imported by the commands using them, so simulate-crl starts without
+# NumPy:
+from bnlcrl import profiling, stream
 from bnlcrl.crl_simulator import CRLSimulator, DEFAULTS_FILE as DEFAULTS_FILE_CRL
 from bnlcrl.delta_finder import DeltaFinder, DEFAULTS_FILE as DEFAULTS_FILE_DELTA
 
@@ -25,3 +41,77 @@ config_delta = read_json(DEFAULTS_FILE_DELTA)
 functions_list = get_cli_functions(config_delta)
 for content in functions_list:
     exec(content)
+
+# Methods available for the streamed and served requests:
+METHODS = {
+    'calc_ideal_focus': calc_ideal_focus,
+    'find_delta': find_delta,
+    'find_energy': find_energy,
+    'simulate_crl': simulate_crl,
+}
+
+
+@argh.arg('--output-format', choices=stream.OUTPUT_FORMATS)
+def batch(infile='-', outfile='-', output_format='jsonl'):
+    """Process JSON-lines requests of simulate_crl, find_delta and calc_ideal_focus from a file or stdin.
+
+    Each line is a JSON object with the parameters and an optional ``method`` (``simulate_crl`` by default). Errors
+    are reported per line in the output.
+
+    Args:
+        infile (str): input file, ``-`` for stdin.
+        outfile (str): output file, ``-`` for stdout.
+        output_format (str): ``jsonl`` or ``csv``.
+    """
+    f_in = sys.stdin if infile == '-' else open(infile, 'r')
+    f_out = sys.stdout if outfile == '-' else open(outfile, 'w')
+    try:
+        r = stream.process_lines(f_in, f_out, METHODS, output_format=output_format)
+    finally:
+        if f_in is not sys.stdin:
+            f_in.close()
+        if f_out is not sys.stdout:
+            f_out.close()
+        else:
+            f_out.flush()
+    if r['errors']:
+        sys.stderr.write('{} of {} lines failed.\n'.format(r['errors'], r['count']))
+
+
+@argh.arg('energy', nargs=3, type=float, help='start, stop and number of the photon energies [eV]')
+@argh.arg('--p0', nargs=3, type=float, help='start, stop and number of the distances from source to the CRL [m]')
+@argh.arg('--teta0', nargs=3, type=float, help='start, stop and number of the divergences of the beam [rad]')
+@argh.arg('--chunk-size', type=int)
+@argh.arg('--dtype', choices=('float32', 'float64'))
+def sweep(sweep_dir, energy, p0=None, teta0=None, beamline='smi', chunk_size=None, dtype='float64'):
+    """Sweep all cartridge sets over an energy x p0 x teta0 grid chunk by chunk into memory-mapped files.
+
+    Running the command again with the same parameters resumes an interrupted sweep. The results are opened with
+    ``bnlcrl.out_of_core.open_sweep(sweep_dir)``.
+
+    Args:
+        sweep_dir (str): directory with the sweep files.
+        energy (list): start, stop and number of the photon energies [eV].
+        p0 (list): start, stop and number of the distances from source to the CRL [m], the default p0 if not set.
+        teta0 (list): start, stop and number of the divergences of the beam [rad], the default teta0 if not set.
+        beamline (str): beamline name.
+        chunk_size (int): approximate number of results evaluated at once, the out_of_core default if not set.
+        dtype (str): data type of the result columns.
+    """
+    import numpy as np
+    from bnlcrl import out_of_core
+
+    def grid(x):
+        return None if x is None else np.linspace(x[0], x[1], int(x[2]))
+
+    s = out_of_core.OutOfCoreSweep(
+        sweep_dir,
+        grid(energy),
+        p0=grid(p0),
+        teta0=grid(teta0),
+        chunk_size=out_of_core.DEFAULT_CHUNK_SIZE if chunk_size is None else int(chunk_size),
+        dtype=dtype,
+        beamline=beamline,
+    )
+    n = s.run()
+    print('Evaluated {} of {} chunks, {} results in <{}>.'.format(n, s.n_chunks, int(np.prod(s.shape)), sweep_dir))
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+u"""Report of the analytic delta validated against the tables of all materials (see :mod:`bnlcrl.validation`).
+
+:copyright: Copyright (c) 2016 mrakitin.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+
+import json
+import os
+
+import argh
+
+from bnlcrl import validation
+from bnlcrl.result_set import ResultSet
+
+
+@argh.arg('--bands', nargs='+', type=float)
+def default_command(outdir='.', bands=None, plot=False, processes=0):
+    """Compare the analytic delta with the tabulated one for every material and write the report.
+
+    Writes ``delta_validation.json`` (statistics per material and energy band), ``delta_validation.csv`` (one row
+    per material and band) and, with ``--plot``, a figure per material to the output directory.
+
+    Args:
+        outdir (str): output directory.
+        bands (list): edges of the energy bands [eV].
+        plot (bool): a flag to render the figures.
+        processes (int): number of processes rendering the figures, the number of CPUs if 0.
+    """
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    report, errors = validation.validate(bands=bands or validation.BANDS)
+    with open(os.path.join(outdir, 'delta_validation.json'), 'w') as f:
+        json.dump(report, f, indent=4, sort_keys=True)
+    rows = [dict(b, formula=k) for k in sorted(report) for b in report[k]['bands']]
+    names = ['formula', 'e_min', 'e_max'] + list(validation.STATISTICS)
+    ResultSet(dict((k, [x[k] for x in rows]) for k in names), names=names).to_csv(
+        os.path.join(outdir, 'delta_validation.csv'))
+    for k in sorted(report):
+        o = report[k]['overall']
+        print('{:<6} mean={:+.4f} rms={:.4f} max_abs={:.4f}'.format(k, o['mean'], o['rms'], o['max_abs']))
+    if plot:
+        validation.render_figures(errors, outdir, processes=int(processes) or None)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+u"""Profiling of the command line functions (``--profile`` and ``--profile-memory`` of ``bnlcrl simulate``).
+
+The functions generated from the defaults JSON files (see :func:`bnlcrl.utils.create_cli_function`) run the
+calculation within :func:`profile`, which writes the ``cProfile`` statistics to a ``.pstats`` file (to be explored
+with :mod:`pstats` or ``snakeviz``) and prints the top functions by cumulative time to stderr. With ``memory`` the
+peak of the memory traced by :mod:`tracemalloc` and the top allocation sites are printed as well.
+
+:copyright: Copyright (c) 2016 mrakitin.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+
+import contextlib
+import sys
+
+# Parameters added to every generated function:
+PARAMETERS = {
+    'profile': {
+        'default': '',
+        'help': 'profile the calculation, write the statistics to the specified .pstats file and print the top '
+                'functions by cumulative time to stderr',
+        'type': str,
+    },
+    'profile_memory': {
+        'default': False,
+        'help': 'a flag to print the peak of the traced memory and the top allocation sites with ``profile``',
+        'type': bool,
+    },
+}
+TOP = 25  # number of the functions and allocation sites printed
+
+
+@contextlib.contextmanager
+def profile(file_name, memory=False, top=TOP, out=None):
+    """Profile the block if ``file_name`` is specified.
+
+    :param file_name: ``.pstats`` file to write the statistics to, nothing is profiled if empty.
+    :param memory: a flag to trace the memory allocations.
+    :param top: number of the functions and allocation sites printed.
+    :param out: file-like object to print the summary to, stderr by default.
+    """
+    if not file_name:
+        yield
+        return
+    # Imported only when profiling, tracemalloc is not available on Python 2 and Jython:
+    import cProfile
+    import pstats
+
+    out = out or sys.stderr
+    trace = False
+    if memory:
+        import tracemalloc
+
+        trace = not tracemalloc.is_tracing()
+        if trace:
+            tracemalloc.start()
+    p = cProfile.Profile()
+    p.enable()
+    try:
+        yield
+    finally:
+        p.disable()
+        if memory:
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            if trace:
+                tracemalloc.stop()
+        p.dump_stats(file_name)
+        print('Profile written to <{}>, top {} functions by cumulative time:'.format(file_name, top), file=out)
+        pstats.Stats(p, stream=out).sort_stats('cumulative').print_stats(top)
+        if memory:
+            print('Peak of the traced memory: {:.1f} KiB, top {} allocation sites:'.format(peak / 1024, top),
+                  file=out)
+            for s in snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)]).statistics(
+                    'lineno')[:top]:
+                print('    {}'.format(s), file=out)
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+u"""Columnar container of many results with bulk writers.
+
+A :class:`ResultSet` keeps one NumPy array per column instead of one dictionary per result, so a row of floats
+takes 8 bytes per column. The writers format a chunk of rows with a single ``%`` operation on a row template, and
+``.npz`` files store the columns as they are.
+
+:copyright: Copyright (c) 2016 mrakitin.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+
+import json
+
+import numpy as np
+
+CHUNK_SIZE = 65536  # number of rows formatted at once
+
+
+class ResultSet(object):
+    __slots__ = ('columns', 'names')
+
+    def __init__(self, columns, names=None):
+        """Create the result set from the columns.
+
+        :param columns: dictionary of 1-D array-likes of the same length.
+        :param names: order of the columns, sorted names by default.
+        """
+        self.names = list(names) if names is not None else sorted(columns.keys())
+        self.columns = {}
+        for name in self.names:
+            self.columns[name] = np.asarray(columns[name])
+            if self.columns[name].ndim != 1:
+                raise Exception('Column <{}> is not one-dimensional.'.format(name))
+        if len(set(len(x) for x in self.columns.values())) > 1:
+            raise Exception('Columns have different lengths: {}.'.format(
+                ', '.join('{}={}'.format(k, len(self.columns[k])) for k in self.names)))
+
+    def __getitem__(self, key):
+        """Get a column by name, a row as a dictionary by index or a new result set by slice or mask."""
+        if isinstance(key, str):
+            return self.columns[key]
+        if isinstance(key, (int, np.integer)):
+            return dict((k, self.columns[k][key].item()) for k in self.names)
+        return ResultSet(dict((k, self.columns[k][key]) for k in self.names), names=self.names)
+
+    def __len__(self):
+        return len(self.columns[self.names[0]]) if self.names else 0
+
+    @property
+    def nbytes(self):
+        return sum(x.nbytes for x in self.columns.values())
+
+    @classmethod
+    def concatenate(cls, result_sets):
+        result_sets = list(result_sets)
+        names = result_sets[0].names
+        return cls(dict((k, np.concatenate([x.columns[k] for x in result_sets])) for k in names), names=names)
+
+    @classmethod
+    def from_npz(cls, file_name):
+        with np.load(file_name) as f:
+            names = [str(x) for x in f['__names__']]
+            return cls(dict((k, f[k]) for k in names), names=names)
+
+    def to_csv(self, file_name):
+        """Write the columns with a header row to a CSV file."""
+        with open(file_name, 'w') as f:
+            self.write_csv(f)
+
+    def to_jsonl(self, file_name):
+        """Write a JSON object per row to a JSON-lines file."""
+        with open(file_name, 'w') as f:
+            self.write_jsonl(f)
+
+    def to_npz(self, file_name):
+        """Write the columns to a NumPy ``.npz`` file (see :meth:`from_npz`)."""
+        arrays = dict(self.columns)
+        arrays['__names__'] = np.array(self.names)
+        np.savez(file_name, **arrays)
+
+    def write_csv(self, f, header=True):
+        """Write the rows (with a header row if ``header``) to a file-like object in CSV format."""
+        if header:
+            f.write(','.join(_csv_quote(x) for x in self.names) + '\n')
+        self._write(f, ','.join(['%s'] * len(self.names)) + '\n', _csv_column)
+
+    def write_jsonl(self, f):
+        """Write a JSON object per row to a file-like object."""
+        template = '{' + ', '.join('{}: %s'.format(json.dumps(x).replace('%', '%%')) for x in self.names) + '}\n'
+        self._write(f, template, _json_column)
+
+    def _write(self, f, template, convert):
+        for start in range(0, len(self), CHUNK_SIZE):
+            values = [convert(self.columns[k][start:start + CHUNK_SIZE]) for k in self.names]
+            n = len(values[0])
+            rows = np.empty((n, len(values)), dtype=object)
+            for j, v in enumerate(values):
+                rows[:, j] = v
+            f.write((template * n) % tuple(rows.ravel().tolist()))
+
+
+def _csv_column(a):
+    if a.dtype.kind in 'US':
+        return [_csv_quote(x) for x in a.astype(str).tolist()]
+    if a.dtype.kind == 'O':
+        # Mixed values, e.g. numbers and error messages:
+        return ['' if x is None else _csv_quote(x) if isinstance(x, str) else x for x in a.tolist()]
+    return a.tolist()
+
+
+def _csv_quote(value):
+    if any(c in value for c in ',"\r\n'):
+        return '"{}"'.format(value.replace('"', '""'))
+    return value
+
+
+def _json_default(value):
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(value).__name__))
+
+
+def _json_column(a):
+    if a.dtype.kind in 'US':
+        return [json.dumps(x) for x in a.astype(str).tolist()]
+    if a.dtype.kind == 'b':
+        return np.where(a, 'true', 'false').tolist()
+    if a.dtype.kind == 'O':
+        # Mixed values, e.g. numbers, tuples and None:
+        return [json.dumps(x, default=_json_default) for x in a.tolist()]
+    if a.dtype.kind == 'f' and not np.isfinite(a).all():
+        v = np.array(a.tolist(), dtype=object)
+        v[np.isnan(a)] = 'NaN'
+        v[np.isposinf(a)] = 'Infinity'
+        v[np.isneginf(a)] = '-Infinity'
+        return v
+    return a.tolist()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+u"""Energy-scan motion planner minimizing the number of cartridge moves.
+
+The focus of every cartridge set is evaluated at every scan step with :class:`bnlcrl.crl_batch.CRLBatch`. Then the
+sequence of sets keeping ``d`` within the tolerance of the target with the fewest total actuations is found by
+dynamic programming over the sets (Viterbi algorithm with the Hamming distance as the transition cost).
+
+A cartridge set is encoded by the integer whose bit ``i`` is set when the slot ``i`` is inserted. The minimum over all
+previous sets of ``cost + hamming distance`` is computed with one pass per bit (distance transform on the hypercube),
+so a step costs O(N 2^N) rather than O(4^N) for N cartridges.
+
+:copyright: Copyright (c) 2016 mrakitin.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+from bnlcrl.crl_batch import CRLBatch
+from bnlcrl.crl_simulator import DEFAULTS_FILE
+from bnlcrl.utils import read_parameters, resolve_parameters
+
+CHUNK_SIZE = 2 ** 21  # maximum number of (energy, set) pairs evaluated at once
+
+_BYTE_POPCOUNT = np.array([bin(i).count('1') for i in range(256)])
+
+
+def plan_energy_scan(**kwargs):
+    """Find the sequence of cartridge sets for the energy scan with the fewest cartridge moves.
+
+    See the ``plan_energy_scan`` entry in ``defaults_crl.json`` for the parameters; other parameters of the CRL model
+    (e.g. ``p0``) are passed to :class:`bnlcrl.crl_batch.CRLBatch`.
+
+    :return: dictionary with the cartridge ids, ``d`` and the number of moves for every step.
+    """
+    parameters = read_parameters(DEFAULTS_FILE, 'plan_energy_scan')
+    v = resolve_parameters(parameters, kwargs)
+    kwargs = dict((k, x) for k, x in kwargs.items() if k not in parameters)
+    energies = np.asarray(v['energies'], dtype=float)
+    if not energies.size:
+        raise Exception('No energies specified!')
+    batch = CRLBatch(beamline=v['beamline'], **kwargs)
+    n = len(batch.slots)
+
+    # Feasible sets and their d at every step (set 0 is the empty one and never feasible):
+    feasible = []
+    feasible_d = []
+    step = max(1, CHUNK_SIZE // 2 ** n)
+    for start in range(0, len(energies), step):
+        r = batch.simulate(energies[start:start + step], transmission=False)
+        with np.errstate(invalid='ignore'):
+            ok = np.abs(r['d'] - v['target']) <= v['tolerance']
+        for i in range(ok.shape[0]):
+            idx = np.flatnonzero(ok[i])
+            if not idx.size:
+                msg = 'No cartridge set focuses within {} m from the target at energy {} eV.'
+                raise Exception(msg.format(v['tolerance'], energies[start + i]))
+            feasible.append(idx + 1)
+            feasible_d.append(r['d'][i, idx])
+
+    # Viterbi over the feasible sets of every step, keeping their back pointers:
+    initial = _encode(batch.get_masks([v['cart_ids']])[0]) if v['cart_ids'] else None
+    if initial is None:
+        cost = np.zeros(len(feasible[0]))
+    else:
+        cost = _popcount(feasible[0] ^ initial).astype(float)
+    back = [None]
+    for t in range(1, len(energies)):
+        previous, current = feasible[t - 1], feasible[t]
+        if len(previous) * len(current) <= n * 2 ** n:
+            total = cost[:, None] + _popcount(previous[:, None] ^ current[None, :])
+            idx = np.argmin(total, axis=0)
+            cost = total[idx, np.arange(len(current))]
+            back.append(previous[idx])
+        else:
+            full = np.full(2 ** n, np.inf)
+            full[previous] = cost
+            full, origin = _distance_transform(full, n)
+            cost = full[current]
+            back.append(origin[current])
+
+    path = [int(feasible[-1][np.argmin(cost)])]
+    for t in range(len(energies) - 1, 0, -1):
+        path.append(int(back[t][np.searchsorted(feasible[t], path[-1])]))
+    path.reverse()
+
+    moves = [0 if initial is None else int(_popcount(path[0] ^ initial))]
+    for t in range(1, len(path)):
+        moves.append(int(_popcount(path[t] ^ path[t - 1])))
+    return {
+        'cart_ids': [batch.get_cart_ids((s >> np.arange(n)) & 1) for s in path],
+        'd': [float(feasible_d[t][np.searchsorted(feasible[t], s)]) for t, s in enumerate(path)],
+        'energies': energies.tolist(),
+        'moves': moves,
+        'total_moves': sum(moves),
+    }
+
+
+def _distance_transform(cost, n):
+    """Calculate ``min(cost[s'] + hamming(s, s'))`` over ``s'`` for every set ``s`` and the minimizing ``s'``."""
+    cost = cost.copy()
+    origin = np.arange(len(cost))
+    for i in range(n):
+        bit = 2 ** i
+        c = cost.reshape(-1, 2, bit)
+        o = origin.reshape(-1, 2, bit)
+        for k in range(2):
+            moved = c[:, 1 - k, :] + 1
+            flipped = moved < c[:, k, :]
+            np.copyto(c[:, k, :], moved, where=flipped)
+            np.copyto(o[:, k, :], o[:, 1 - k, :], where=flipped)
+    return cost, origin
+
+
+def _encode(mask):
+    return int(np.dot(mask, 2 ** np.arange(len(mask))))
+
+
+def _popcount(a):
+    a = np.asarray(a, dtype=np.int64)
+    count = np.zeros(a.shape, dtype=np.int64)
+    while a.any():
+        count += _BYTE_POPCOUNT[a & 255]
+        a = a >> 8
+    return count
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+u"""Analytic sensitivities (Jacobian) of the CRL focus.
+
+The transfer matrix of the cartridge set is propagated lens by lens with forward-mode dual numbers carrying the
+derivatives with respect to energy (through delta of each lens material) and ``dl_cart``; the derivatives with
+respect to ``p0`` and ``teta0`` follow from the input ray. All operating points (energy, ``p0``, ``teta0``) are
+processed as arrays in one call.
+
+Delta is the tabulated value for the closest energy, as :class:`bnlcrl.crl_simulator.CRLSimulator` finds it, while
+its derivative is the interpolated log-slope of the table: the nearest lookup is a step function of energy, so the
+derivative is the one of the smooth curve through the table, not of the lookup. The analytical delta
+(``calc_delta``) is not supported.
+
+:copyright: Copyright (c) 2016 mrakitin.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+from bnlcrl.crl_batch import CRLBatch
+from bnlcrl.tables import find_characteristic_slopes
+
+
+def calc_sensitivity(cart_ids, energies, p0=None, teta0=None, **kwargs):
+    """Calculate ``p1``, ``d`` and their derivatives for arrays of operating points.
+
+    The derivative with respect to energy uses the local slope of the delta table
+    (see :func:`bnlcrl.tables.find_characteristic_slopes`), delta itself is the nearest tabulated value.
+
+    :param cart_ids: cartridges ids.
+    :param energies: photon energies [eV].
+    :param p0: distance(s) from source to the CRL broadcastable with ``energies`` [m].
+    :param teta0: divergence(s) of the beam broadcastable with ``energies`` [rad].
+    :param kwargs: other parameters of the CRL model (see :class:`bnlcrl.crl_batch.CRLBatch`).
+    :return: dictionary of arrays: ``p1``, ``d`` and ``dp1_d<x>``/``dd_d<x>`` for ``x`` in ``energy``, ``p0``,
+        ``teta0`` and ``dl_cart``.
+    """
+    b = CRLBatch(**kwargs)
+    mask = b.get_masks([cart_ids])[0]
+    if not mask.any():
+        raise Exception('No lenses in the beam!')
+    energies = np.asarray(energies, dtype=float)
+    p0 = np.asarray(b.p0 if p0 is None else p0, dtype=float)
+    teta0 = np.asarray(b.teta0 if teta0 is None else teta0, dtype=float)
+    energies, p0, teta0 = np.broadcast_arrays(energies, p0, teta0)
+    delta = b.find_delta(energies)[..., mask]
+    ddelta_denergy = delta * b.find_per_material(find_characteristic_slopes, energies)[..., mask] / energies[..., None]
+
+    # Dual numbers: axis 0 holds the value and the derivatives with respect to energy and dl_cart.
+    shape = (3,) + energies.shape
+    one = np.zeros(shape)
+    one[0] = 1
+    t00, t01, t10, t11 = one, np.zeros(shape), np.zeros(shape), one
+    offsets = b.offsets[mask]
+    lens_numbers = b.lens_numbers[mask]
+    for j, radius in enumerate(b.radii[mask]):
+        if j > 0:
+            # Drift from the previous cartridge:
+            gap = np.zeros(shape)
+            gap[0] = (offsets[j] - offsets[j - 1]) * b.dl_cart - lens_numbers[j - 1] * b.dl_lens
+            gap[2] = offsets[j] - offsets[j - 1]
+            t00, t01 = t00 + _mul(gap, t10), t01 + _mul(gap, t11)
+        f = np.zeros(shape)
+        f[0] = -2 * delta[..., j] / radius
+        f[1] = -2 * ddelta_denergy[..., j] / radius
+        for k in range(lens_numbers[j]):
+            if k > 0:
+                t00, t01 = t00 + b.dl_lens * t10, t01 + b.dl_lens * t11
+            # Thin lens:
+            t10, t11 = t10 + _mul(f, t00), t11 + _mul(f, t01)
+
+    tan0 = np.tan(teta0)
+    y0 = p0 * tan0
+    y = t00 * y0 + t01 * teta0
+    teta = t10 * y0 + t11 * teta0
+    p1 = y[0] / np.tan(np.pi - teta[0])
+    dp1_dy = -1 / np.tan(teta[0])
+    dp1_dteta = y[0] / np.sin(teta[0]) ** 2
+
+    r = {
+        'dp1_ddl_cart': dp1_dy * y[2] + dp1_dteta * teta[2],
+        'dp1_denergy': dp1_dy * y[1] + dp1_dteta * teta[1],
+        'dp1_dp0': dp1_dy * t00[0] * tan0 + dp1_dteta * t10[0] * tan0,
+        'dp1_dteta0': (dp1_dy * (t00[0] * p0 / np.cos(teta0) ** 2 + t01[0])
+                       + dp1_dteta * (t10[0] * p0 / np.cos(teta0) ** 2 + t11[0])),
+        'p1': p1,
+        'd': b.d_ssa_focus - (p0 + p1 + offsets[-1] * b.dl_cart),
+    }
+    # d = d_ssa_focus - (p0 + p1 + offset_cart * dl_cart):
+    r['dd_ddl_cart'] = -r['dp1_ddl_cart'] - offsets[-1]
+    r['dd_denergy'] = -r['dp1_denergy']
+    r['dd_dp0'] = -1 - r['dp1_dp0']
+    r['dd_dteta0'] = -r['dp1_dteta0']
+    return r
+
+
+def _mul(a, b):
+    """Multiply dual numbers."""
+    return np.concatenate([a[:1] * b[:1], a[:1] * b[1:] + a[1:] * b[:1]])
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+u"""Local JSON-RPC 2.0 server running the simulations in a warm process.
+
+``POST /`` accepts a JSON-RPC request (or a batch of them) calling one of :data:`METHODS` with named parameters, the
+same as the command line options of ``bnlcrl simulate`` except the ones writing files or printing
+(:data:`EXCLUDED_PARAMETERS`), a client must not write on the host. The files read are the ones of the package data
+only (:data:`PATH_PARAMETERS`).
+``GET /metrics`` returns the request counters and latencies per method, and the phase timings (see
+:mod:`bnlcrl.timing`) if enabled.
+
+The process keeps the imports, the parsed material tables and the delta values found before, so a request costs only
+the simulation itself. Requests are handled by a fixed pool of threads.
+
+:copyright: Copyright (c) 2016 mrakitin.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+
+import inspect
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from bnlcrl import timing
+from bnlcrl.crl_simulator import CONFIG_DIR, DAT_DIR
+from bnlcrl.pkcli.simulate import METHODS
+from bnlcrl.stream import FILE_PARAMETERS, to_json
+
+# JSON-RPC 2.0 error codes:
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+SERVER_ERROR = -32000
+
+# Parameters writing files (outputs, plots, profiles) or printing on the host are not accepted:
+EXCLUDED_PARAMETERS = FILE_PARAMETERS + ('verbose',)
+# Parameters naming the files read, the directory and the file name pattern:
+PATH_PARAMETERS = {
+    'beamline': (CONFIG_DIR, '{}_crl.json'),
+    'data_file': (DAT_DIR, '{}'),
+    'formula': (DAT_DIR, '{}_delta.dat'),  # find_energy reads <formula>_<characteristic>.dat
+}
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.methods = {}
+
+    def add(self, method, seconds, error):
+        with self.lock:
+            m = self.methods.setdefault(method, {'count': 0, 'errors': 0, 'seconds': 0., 'max_seconds': 0.})
+            m['count'] += 1
+            m['errors'] += int(error)
+            m['seconds'] += seconds
+            m['max_seconds'] = max(m['max_seconds'], seconds)
+
+    def get(self):
+        """Get the counters: totals, requests per second since the start and mean/max latency per method."""
+        with self.lock:
+            uptime = time.time() - self.started
+            methods = {}
+            for k, m in self.methods.items():
+                methods[k] = dict(m, mean_seconds=m['seconds'] / m['count'])
+        count = sum(m['count'] for m in methods.values())
+        return {
+            'count': count,
+            'errors': sum(m['errors'] for m in methods.values()),
+            'methods': methods,
+            'requests_per_second': count / uptime if uptime > 0 else 0.,
+            'uptime': uptime,
+        }
+
+
+class SimulationServer(HTTPServer):
+    def __init__(self, host='127.0.0.1', port=8000, workers=8):
+        """Create the server, use port 0 to pick a free port (see ``server_address``).
+
+        :param host: host name or address to listen on.
+        :param port: port to listen on.
+        :param workers: number of threads handling the requests.
+        """
+        HTTPServer.__init__(self, (host, port), _Handler)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.metrics = Metrics()
+
+    def call(self, request):
+        """Run one JSON-RPC request.
+
+        :param request: decoded JSON-RPC request.
+        :return: JSON-RPC response or ``None`` for notifications.
+        """
+        if not isinstance(request, dict) or request.get('jsonrpc') != '2.0' or 'method' not in request:
+            return _error(None, INVALID_REQUEST, 'Invalid Request')
+        method = request['method']
+        params = request.get('params', {})
+        error = True
+        start = time.time()
+        timing.count('server.requests')
+        try:
+            outside = _outside_paths(params) if isinstance(params, dict) else None
+            if method not in METHODS:
+                response = _error(request.get('id'), METHOD_NOT_FOUND, 'Method <{}> not found'.format(method))
+            elif not isinstance(params, dict):
+                response = _error(request.get('id'), INVALID_PARAMS, 'Parameters must be passed by name')
+            elif any(x in params for x in EXCLUDED_PARAMETERS):
+                response = _error(request.get('id'), INVALID_PARAMS, 'Parameters <{}> are not available on the server'
+                                  .format(', '.join(x for x in EXCLUDED_PARAMETERS if x in params)))
+            elif outside:
+                response = _error(request.get('id'), INVALID_PARAMS, 'Parameters <{}> must name the package data files'
+                                  .format(', '.join(outside)))
+            else:
+                try:
+                    inspect.signature(METHODS[method]).bind(**params)
+                except TypeError as e:
+                    response = _error(request.get('id'), INVALID_PARAMS, str(e))
+                else:
+                    try:
+                        result = METHODS[method](**params)
+                    except Exception as e:
+                        response = _error(request.get('id'), SERVER_ERROR, str(e))
+                    else:
+                        response = {'id': request.get('id'), 'jsonrpc': '2.0', 'result': result}
+                        error = False
+        finally:
+            if error:
+                timing.count('server.errors')
+            self.metrics.add(method if method in METHODS else '<unknown>', time.time() - start, error)
+        return response if 'id' in request else None
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process_request, request, client_address)
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        self.executor.shutdown(wait=True)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path.rstrip('/') != '/metrics':
+            self.send_error(404)
+            return
+        m = self.server.metrics.get()
+        if timing.enabled():
+            m['timing'] = timing.stats()
+        self._send(m)
+
+    def do_POST(self):
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+        except ValueError:
+            self._send(_error(None, PARSE_ERROR, 'Parse error'))
+            return
+        if isinstance(request, list):
+            if not request:
+                self._send(_error(None, INVALID_REQUEST, 'Invalid Request'))
+                return
+            response = [x for x in (self.server.call(r) for r in request) if x is not None]
+        else:
+            response = self.server.call(request)
+        self._send(response or None)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, data):
+        if data is None:
+            self.send_response(204)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = json.dumps(data, default=to_json).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _error(request_id, code, message):
+    return {'error': {'code': code, 'message': message}, 'id': request_id, 'jsonrpc': '2.0'}
+
+
+def _outside_paths(params):
+    """Find the parameters naming files outside their directories (absolute paths, ``..``)."""
+    r = []
+    for key, (directory, pattern) in sorted(PATH_PARAMETERS.items()):
+        if params.get(key) is not None:
+            d = os.path.realpath(directory)
+            if not os.path.realpath(os.path.join(d, pattern.format(params[key]))).startswith(d + os.sep):
+                r.append(key)
+    return r
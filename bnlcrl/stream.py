@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+u"""Streaming processing of JSON-lines requests in one process.
+
+Each input line is a JSON object with the parameters of a method of ``bnlcrl simulate`` and an optional ``method``
+key (``simulate_crl`` by default), e.g.::
+
+    {"cart_ids": ["2", "4", "6"], "energy": 21500}
+    {"method": "find_delta", "energy": 21500, "data_file": "Be_delta.dat"}
+
+Lines are read and processed one by one and written in chunks, so the memory does not grow with the number of lines.
+A line that fails is reported in the output and does not stop the stream. The output has the results only, so a line
+cannot write files, plot or print (:data:`LINE_EXCLUDED_PARAMETERS`).
+
+:copyright: Copyright (c) 2016 mrakitin.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+
+import json
+
+from bnlcrl import profiling
+
+DEFAULT_METHOD = 'simulate_crl'
+# Parameters writing files (outputs, plots, profiles):
+FILE_PARAMETERS = tuple(sorted(profiling.PARAMETERS)) + ('outfile', 'plot', 'save', 'save_output', 'show_plot')
+# Printed output would be mixed with the rows written:
+LINE_EXCLUDED_PARAMETERS = FILE_PARAMETERS + ('verbose',)
+MAX_PENDING = 1000  # errors kept before the first successful line of a CSV stream
+OUTPUT_FORMATS = ('csv', 'jsonl')
+WRITE_ROWS = 1000  # lines written at once
+
+
+def process_lines(lines, out, methods, output_format='jsonl'):
+    """Process JSON-lines requests and write a result per non-empty line.
+
+    JSON-lines output has ``line`` and either ``result`` or ``error`` per line. CSV output has the ``line``, ``error``
+    and result columns taken from the first successful line (missing values are empty). A result with columns not in
+    the header is written as an error, so the lines of a CSV stream should call methods returning the same keys (use
+    JSON-lines otherwise). Up to :data:`MAX_PENDING` errors before the first successful line are kept until the header
+    is known, then the header has the ``line`` and ``error`` columns only.
+
+    The rows are written in chunks of :data:`WRITE_ROWS` lines, CSV with :meth:`bnlcrl.result_set.ResultSet.write_csv`.
+
+    :param lines: iterable of input lines.
+    :param out: file-like object to write to.
+    :param methods: dictionary of the methods by name.
+    :param output_format: ``jsonl`` or ``csv``.
+    :return: dictionary with the numbers of processed lines and errors.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise Exception('Unknown output format <{}>, use one of: {}.'.format(output_format, ', '.join(OUTPUT_FORMATS)))
+    columns = None  # the CSV header, not known before the first successful line
+    header = True
+    rows = []
+    count = 0
+    errors = 0
+    for i, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        count += 1
+        try:
+            result = _process_line(line, methods)
+            row = {'line': i, 'result': result}
+        except Exception as e:
+            errors += 1
+            row = {'error': str(e), 'line': i}
+        if output_format == 'jsonl':
+            rows.append(json.dumps(row, sort_keys=True, default=to_json) + '\n')
+            if len(rows) >= WRITE_ROWS:
+                out.write(''.join(rows))
+                rows = []
+            continue
+        if columns is None and ('error' not in row or len(rows) >= MAX_PENDING):
+            columns = ['line', 'error'] + sorted(row.get('result', {}))
+        if columns is not None:
+            extra = sorted(set(row.get('result', {})) - set(columns))
+            if extra:
+                errors += 1
+                row = {
+                    'error': 'Result columns <{}> are not in the CSV header, use jsonl output'.format(', '.join(extra)),
+                    'line': i,
+                }
+        rows.append(_csv_row(row))
+        if columns is not None and len(rows) >= WRITE_ROWS:
+            _write_csv(out, columns, rows, header)
+            header = False
+            rows = []
+    if output_format == 'jsonl':
+        out.write(''.join(rows))
+    elif rows:
+        _write_csv(out, columns or ['line', 'error'], rows, header)
+    return {'count': count, 'errors': errors}
+
+
+def to_json(value):
+    """Convert NumPy scalars and arrays for :func:`json.dumps`."""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(value).__name__))
+
+
+def _csv_row(row):
+    r = dict(row.get('result', {}))
+    r['line'] = row['line']
+    r['error'] = row.get('error', '')
+    for k, v in r.items():
+        if isinstance(v, (list, tuple)):
+            r[k] = ' '.join(str(x) for x in v)
+    return r
+
+
+def _write_csv(out, columns, rows, header):
+    # Only the CSV output needs NumPy:
+    import numpy as np
+    from bnlcrl.result_set import ResultSet
+
+    values = {}
+    for k in columns:
+        # Object arrays keep the numbers and the messages of a column as they are:
+        values[k] = np.empty(len(rows), dtype=object)
+        values[k][:] = [x.get(k, '') for x in rows]
+    ResultSet(values, names=columns).write_csv(out, header=header)
+
+
+def _process_line(line, methods):
+    params = json.loads(line)
+    if not isinstance(params, dict):
+        raise Exception('Line must be a JSON object')
+    method = params.pop('method', DEFAULT_METHOD)
+    if method not in methods:
+        raise Exception('Unknown method <{}>, use one of: {}.'.format(method, ', '.join(sorted(methods))))
+    excluded = [x for x in LINE_EXCLUDED_PARAMETERS if x in params]
+    if excluded:
+        raise Exception('Parameters <{}> are not available in a stream'.format(', '.join(excluded)))
+    return methods[method](**params)
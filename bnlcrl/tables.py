@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+u"""Cached, vectorized lookups in the material tables (``bnlcrl/package_data/dat/*.dat``).
+
+The tables are parsed once per process and kept as read-only NumPy arrays, so looking up thousands of energies is a
+single :func:`numpy.searchsorted` call instead of one :class:`bnlcrl.delta_finder.DeltaFinder` per energy.
+The inverse lookup (:func:`find_energies`) splits a table into the monotonic segments between the absorption edges
+and looks up all target values in each segment at once.
+
+:copyright: Copyright (c) 2016 mrakitin.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+from bnlcrl.delta_finder import DAT_DIR, DEFAULTS_FILE
+from bnlcrl.utils import read_parameters, resolve_parameters
+
+SKIPROWS = 2
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def data_file_path(data_file):
+    """Resolve a data file name relative to ``bnlcrl/package_data/dat/``."""
+    return data_file if os.path.isabs(data_file) else os.path.join(DAT_DIR, data_file)
+
+
+def file_digest(file_name):
+    """MD5 digest of the file contents, used to detect changed tables and configs."""
+    with open(file_name, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+def find_energies(values, data_file, characteristic='delta'):
+    """Find all energies at which the characteristic equals the target values (the inverse of the lookup).
+
+    The table is split into the monotonic segments between the absorption edges and the energy is interpolated
+    linearly within a segment, so ``find_characteristic_values(energies, ..., interpolate=True)`` returns the targets.
+    A target crossed by several segments has several solutions, a target out of the range of the table has none.
+
+    :param values: target characteristic values (attenuation length in meters, see
+        :func:`find_characteristic_values`).
+    :param data_file: data file name in ``bnlcrl/package_data/dat/`` or an absolute path.
+    :param characteristic: ``delta`` or ``atten``.
+    :return: tuple of arrays (indices of the targets, energies [eV]) sorted by the index, then by the energy.
+    """
+    e, v = read_table(data_file)
+    values = np.asarray(values, dtype=float).ravel()
+    if characteristic == 'atten':
+        values = values / 1e-6  # Atten Length (microns)
+    indices = []
+    energies = []
+    for start, end in find_segments(v):
+        e_s = e[start:end + 1]
+        v_s = v[start:end + 1]
+        if v_s[-1] < v_s[0]:
+            e_s = e_s[::-1]
+            v_s = v_s[::-1]
+        idx = np.nonzero((values >= v_s[0]) & (values <= v_s[-1]))[0]
+        if not idx.size:
+            continue
+        j = np.clip(np.searchsorted(v_s, values[idx], side='right') - 1, 0, len(v_s) - 2)
+        dv = v_s[j + 1] - v_s[j]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction = np.where(dv != 0, (values[idx] - v_s[j]) / dv, 0.)
+        indices.append(idx)
+        energies.append(e_s[j] + fraction * (e_s[j + 1] - e_s[j]))
+    if not indices:
+        return np.empty(0, dtype=int), np.empty(0)
+    indices = np.concatenate(indices)
+    energies = np.concatenate(energies)
+    order = np.lexsort((energies, indices))
+    indices = indices[order]
+    energies = energies[order]
+    # A target equal to the value at the boundary of two segments is found in both of them:
+    keep = np.ones(len(indices), dtype=bool)
+    keep[1:] = (indices[1:] != indices[:-1]) | ~np.isclose(energies[1:], energies[:-1], rtol=1e-12, atol=0)
+    return indices[keep], energies[keep]
+
+
+def find_energy(**kwargs):
+    """Find the energies for the target values of the characteristic (see ``defaults_delta.json``)."""
+    v = resolve_parameters(read_parameters(DEFAULTS_FILE, 'find_energy'), kwargs)
+    data_file = v['data_file'] or '{}_{}.dat'.format(v['formula'], v['characteristic'])
+    indices, energies = find_energies(v['values'], data_file, characteristic=v['characteristic'])
+    return {
+        'characteristic': v['characteristic'],
+        'data_file': data_file,
+        'energies': [energies[indices == i].tolist() for i in range(len(v['values']))],
+        'values': [float(x) for x in v['values']],
+    }
+
+
+def find_characteristic_slopes(energies, data_file):
+    """Find the logarithmic slopes ``d(ln value)/d(ln energy)`` of the table for an array of energies.
+
+    The slopes are calculated at the tabulated energies and interpolated linearly, so the derivative of the
+    characteristic value with respect to energy is ``value * slope / energy`` (the slope of delta is close to -2 away
+    from the absorption edges).
+
+    :param energies: photon energies [eV].
+    :param data_file: data file name in ``bnlcrl/package_data/dat/`` or an absolute path.
+    :return: array of the slopes with the shape of ``energies``.
+    """
+    e, v = read_table(data_file)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slopes = np.gradient(np.log(np.abs(v)), np.log(e))
+    return np.interp(np.asarray(energies, dtype=float), e, slopes)
+
+
+def find_characteristic_values(energies, data_file, characteristic='delta', interpolate=False):
+    """Find the characteristic values for an array of energies.
+
+    By default the value for the closest tabulated energy is returned, as
+    :func:`bnlcrl.delta_finder.find_closest` does.
+
+    :param energies: photon energies [eV].
+    :param data_file: data file name in ``bnlcrl/package_data/dat/`` or an absolute path.
+    :param characteristic: ``delta`` or ``atten`` (attenuation length is converted from microns to meters).
+    :param interpolate: a flag to interpolate linearly between the tabulated energies.
+    :return: array of the characteristic values with the shape of ``energies``.
+    """
+    e, v = read_table(data_file)
+    energies = np.asarray(energies, dtype=float)
+    if energies.size and (energies.min() < e[0] or energies.max() > e[-1]):
+        raise Exception('Error! Use energy range from {} to {} eV.'.format(e[0], e[-1]))
+    if interpolate:
+        values = np.interp(energies, e, v)
+    else:
+        idx_next = np.clip(np.searchsorted(e, energies, side='right'), 1, len(e) - 1)
+        idx_previous = idx_next - 1
+        idx = np.where(
+            np.abs(e[idx_previous] - energies) <= np.abs(e[idx_next] - energies),
+            idx_previous,
+            idx_next,
+        )
+        values = v[idx]
+    if characteristic == 'atten':
+        values = values * 1e-6  # Atten Length (microns)
+    return values
+
+
+def find_segments(values):
+    """Split the values into monotonic segments (the absorption edges and the other extrema are the boundaries).
+
+    :param values: characteristic values of the table.
+    :return: list of tuples (first index, last index) of the segments, adjacent segments share the boundary point.
+    """
+    signs = np.sign(np.diff(values))
+    # A flat step belongs to the segment before it:
+    for i in np.nonzero(signs == 0)[0]:
+        signs[i] = signs[i - 1] if i else 1
+    boundaries = np.nonzero(signs[1:] != signs[:-1])[0] + 1
+    edges = np.concatenate([[0], boundaries, [len(values) - 1]])
+    return list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+
+
+def read_table(data_file):
+    """Read energies and characteristic values from the data file.
+
+    :param data_file: data file name in ``bnlcrl/package_data/dat/`` or an absolute path.
+    :return: tuple of read-only arrays (energies, values).
+    """
+    file_name = data_file_path(data_file)
+    try:
+        mtime = os.path.getmtime(file_name)
+    except OSError:
+        raise Exception('The specified file <{}> not found!'.format(file_name))
+    with _cache_lock:
+        cached = _cache.get(file_name)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    data = np.loadtxt(file_name, skiprows=SKIPROWS, usecols=(0, 1))
+    table = (data[:, 0].copy(), data[:, 1].copy())
+    for a in table:
+        a.flags.writeable = False
+    with _cache_lock:
+        _cache[file_name] = (mtime, table)
+    return table
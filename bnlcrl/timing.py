@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+u"""Opt-in phase timings and counters.
+
+The phases are wrapped in spans (``with timing.span('utils.read_json'): ...``) measured with a monotonic clock, and
+events are counted with ``timing.count('delta_finder.cache_hits')``. Nothing is recorded unless it is enabled:
+
+- globally with :func:`enable` or the ``BNLCRL_TIMING=1`` environment variable, the totals of all threads are
+  returned by :func:`stats`;
+- for a block of code of the current thread with ``with timing.record() as r:``, e.g. a single simulation with
+  ``timing=True`` which adds ``r.get()`` to its result as ``stats``.
+
+When disabled, a span is a shared no-op context manager and a count returns right away.
+
+:copyright: Copyright (c) 2016 mrakitin.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+
+import contextlib
+import os
+import threading
+import time
+
+# A monotonic clock, Python 2 and Jython have time.time only:
+_clock = getattr(time, 'perf_counter', time.time)
+_enabled = os.environ.get('BNLCRL_TIMING', '') not in ('', '0')
+_local = threading.local()
+_lock = threading.Lock()
+_recording = 0  # number of active recorders in all threads
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.spans = {}
+
+    def add(self, name, seconds):
+        with self.lock:
+            s = self.spans.get(name)
+            if s is None:
+                s = self.spans[name] = {'count': 0, 'max_seconds': 0., 'seconds': 0.}
+            s['count'] += 1
+            s['seconds'] += seconds
+            if seconds > s['max_seconds']:
+                s['max_seconds'] = seconds
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def get(self):
+        """Get the counters and the number, total and maximum duration [s] of the spans by name."""
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'spans': dict((k, dict(v)) for k, v in self.spans.items()),
+            }
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class _Span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = _clock()
+        return self
+
+    def __exit__(self, *args):
+        seconds = _clock() - self.start
+        for s in _targets():
+            s.add(self.name, seconds)
+        return False
+
+
+NO_SPAN = _NoSpan()
+_totals = Stats()
+
+
+def count(name, n=1):
+    """Add ``n`` to the counter if enabled."""
+    if not (_enabled or _recording):
+        return
+    for s in _targets():
+        s.count(name, n)
+
+
+def enable(flag=True):
+    """Enable (or disable) collecting the totals of all threads (see :func:`stats`)."""
+    global _enabled
+    _enabled = bool(flag)
+
+
+def enabled():
+    return _enabled
+
+
+@contextlib.contextmanager
+def record():
+    """Collect the spans and counters of the current thread within the block into a new :class:`Stats`."""
+    global _recording
+    s = Stats()
+    if not hasattr(_local, 'recorders'):
+        _local.recorders = []
+    _local.recorders.append(s)
+    with _lock:
+        _recording += 1
+    try:
+        yield s
+    finally:
+        with _lock:
+            _recording -= 1
+        _local.recorders.remove(s)
+
+
+def reset():
+    """Clear the totals."""
+    global _totals
+    _totals = Stats()
+
+
+def span(name):
+    """Get a context manager measuring the duration of the block if enabled."""
+    if not (_enabled or _recording):
+        return NO_SPAN
+    return _Span(name)
+
+
+def stats():
+    """Get the totals collected while enabled (see :meth:`Stats.get`)."""
+    return _totals.get()
+
+
+def _targets():
+    targets = list(getattr(_local, 'recorders', ()))
+    if _enabled:
+        targets.append(_totals)
+    return targets
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+u"""Monte Carlo tolerance analysis of lens imperfections.
+
+Every trial perturbs the radius of each lens, the spacings between the lenses within the cartridges (``dl_lens``),
+the position of each cartridge and the cartridge pitch (``dl_cart``). The perturbed transfer matrices of all trials are
+built as arrays, lens by lens, and the distributions of ``p1`` and ``d`` are reported.
+
+The trials are split into chunks of a fixed size, each with its own random generator spawned from ``seed``, so the
+results do not depend on the number of processes the chunks are spread across.
+
+:copyright: Copyright (c) 2016 mrakitin.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+
+import multiprocessing
+
+import numpy as np
+
+from bnlcrl.crl_batch import CRLBatch
+from bnlcrl.crl_simulator import DEFAULTS_FILE
+from bnlcrl.utils import read_parameters, resolve_parameters
+
+CHUNK_SIZE = 10000
+PERCENTILES = (1, 5, 25, 50, 75, 95, 99)
+PROCESSES_THRESHOLD = 200000  # use multiple processes by default from this number of trials
+
+
+def calc_tolerances(**kwargs):
+    """Summarize the Monte Carlo tolerance analysis (see ``defaults_crl.json``).
+
+    :return: dictionary with the nominal, mean, standard deviation and percentiles of ``p1`` and ``d``.
+    """
+    parameters = read_parameters(DEFAULTS_FILE, 'calc_tolerances')
+    v = resolve_parameters(parameters, kwargs)
+    kwargs = dict((k, x) for k, x in kwargs.items() if k not in parameters)
+    v.update(kwargs)
+    r = run_monte_carlo(**v)
+    return dict((k, r[k]) for k in sorted(r.keys()) if k not in ('d', 'p1', 'histogram_d', 'histogram_p1'))
+
+
+def run_monte_carlo(cart_ids, energy, n_trials=CHUNK_SIZE, radius_error=0.01, dl_lens_error=1e-5, offset_error=1e-5,
+                    dl_cart_error=1e-6, seed=0, processes=0, bins=50, **kwargs):
+    """Run the Monte Carlo tolerance analysis for the cartridge set.
+
+    :param cart_ids: cartridges ids.
+    :param energy: photon energy [eV].
+    :param n_trials: number of trials.
+    :param radius_error: relative rms error of the radius of each lens.
+    :param dl_lens_error: rms error of each distance between two lenses within a cartridge [m].
+    :param offset_error: rms error of the position of each cartridge [m].
+    :param dl_cart_error: rms error of the distance between centers of two neighbouring cartridges [m].
+    :param seed: seed of the random number generator.
+    :param processes: number of processes, 0 to choose automatically.
+    :param bins: number of bins of the histograms.
+    :param kwargs: other parameters of the CRL model (see :class:`bnlcrl.crl_batch.CRLBatch`).
+    :return: dictionary with ``p1``/``d`` of all trials, their nominal values, statistics and histograms.
+    """
+    b = CRLBatch(**kwargs)
+    mask = b.get_masks([cart_ids])[0]
+    if not mask.any():
+        raise Exception('No lenses in the beam!')
+    model = {
+        'd_ssa_focus': b.d_ssa_focus,
+        'delta': b.find_delta(energy)[mask],
+        'dl_cart': b.dl_cart,
+        'dl_lens': b.dl_lens,
+        'lens_numbers': b.lens_numbers[mask],
+        'offsets': b.offsets[mask],
+        'p0': b.p0,
+        'radii': b.radii[mask],
+        'teta0': b.teta0,
+    }
+    errors = {
+        'dl_cart': dl_cart_error,
+        'dl_lens': dl_lens_error,
+        'offset': offset_error,
+        'radius': radius_error,
+    }
+    nominal = _run_trials(model, dict((k, 0.) for k in errors), 1, None)
+
+    sizes = [CHUNK_SIZE] * (n_trials // CHUNK_SIZE)
+    if n_trials % CHUNK_SIZE:
+        sizes.append(n_trials % CHUNK_SIZE)
+    tasks = [(model, errors, s, q) for s, q in zip(sizes, np.random.SeedSequence(seed).spawn(len(sizes)))]
+    if not processes:
+        processes = multiprocessing.cpu_count() if n_trials >= PROCESSES_THRESHOLD else 1
+    processes = min(processes, len(tasks))
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_run_task, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_run_task(t) for t in tasks]
+
+    r = {
+        'n_trials': n_trials,
+        'seed': seed,
+    }
+    for i, key in enumerate(('p1', 'd')):
+        a = np.concatenate([x[i] for x in results])
+        r[key] = a
+        r['{}_nominal'.format(key)] = float(nominal[i][0])
+        r['{}_mean'.format(key)] = float(a.mean())
+        r['{}_std'.format(key)] = float(a.std())
+        percentiles = np.percentile(a, PERCENTILES)
+        r['{}_percentiles'.format(key)] = dict((str(q), float(x)) for q, x in zip(PERCENTILES, percentiles))
+        r['histogram_{}'.format(key)] = np.histogram(a, bins=bins)
+    return r
+
+
+def _run_task(task):
+    return _run_trials(*task)
+
+
+def _run_trials(model, errors, n, seed_sequence):
+    """Calculate ``p1`` and ``d`` for ``n`` perturbed trials."""
+    rng = np.random.default_rng(seed_sequence)
+    n_carts = len(model['radii'])
+    n_max = int(model['lens_numbers'].max())
+
+    radii = model['radii'][:, None] * (1 + errors['radius'] * rng.standard_normal((n, n_carts, n_max)))
+    spacings = model['dl_lens'] + errors['dl_lens'] * rng.standard_normal((n, n_carts, n_max))
+    dl_cart = model['dl_cart'] + errors['dl_cart'] * rng.standard_normal(n)
+    coords = model['offsets'] * dl_cart[:, None] + errors['offset'] * rng.standard_normal((n, n_carts))
+    f = -2 * model['delta'][:, None] / radii
+
+    t00, t01, t10, t11 = np.ones(n), np.zeros(n), np.zeros(n), np.ones(n)
+    for j in range(n_carts):
+        if j > 0:
+            # Drift from the previous cartridge:
+            gap = coords[:, j] - coords[:, j - 1] - model['lens_numbers'][j - 1] * model['dl_lens']
+            t00, t01 = t00 + gap * t10, t01 + gap * t11
+        for k in range(model['lens_numbers'][j]):
+            if k > 0:
+                s = spacings[:, j, k - 1]
+                t00, t01 = t00 + s * t10, t01 + s * t11
+            # Thin lens:
+            t10, t11 = t10 + f[:, j, k] * t00, t11 + f[:, j, k] * t01
+
+    y0 = model['p0'] * np.tan(model['teta0'])
+    y = t00 * y0 + t01 * model['teta0']
+    teta = t10 * y0 + t11 * model['teta0']
+    p1 = y / np.tan(np.pi - teta)
+    d = model['d_ssa_focus'] - (model['p0'] + p1 + coords[:, -1])
+    return p1, d
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+u"""Stateful transfocator with incremental updates of the transfer matrix.
+
+The cartridge slots of ``<beamline>_crl.json`` are kept in a segment tree ordered by their position, so inserting or
+removing a single cartridge updates the total transfer matrix in O(log N) instead of recomputing the full product as
+:meth:`bnlcrl.crl_simulator.CRLSimulator.calc_T_total` does.
+
+Each tree node describes a contiguous range of slots as a tuple ``(M, lead, trail, last)``:
+
+- ``M`` - 2x2 matrix (flat 4-tuple, see :mod:`bnlcrl.optics`) from the first to the last inserted lens in the range;
+- ``lead`` - free space before the first inserted cartridge in the range [m];
+- ``trail`` - free space after the last inserted cartridge in the range [m];
+- ``last`` - slot index of the last inserted cartridge or ``None`` if the range is empty.
+
+:copyright: Copyright (c) 2016 mrakitin.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+
+import math
+import os
+
+from bnlcrl import optics
+from bnlcrl.crl_simulator import CONFIG_DIR, DEFAULTS_FILE, check_planes, find_delta, material_data_file
+from bnlcrl.utils import read_json, read_parameters, resolve_parameters
+
+_EMPTY = (optics.IDENTITY, 0., 0., None)
+
+
+class Transfocator:
+    def __init__(self, **kwargs):
+        # Get input variables:
+        self.parameters = read_parameters(DEFAULTS_FILE)
+        for key, value in resolve_parameters(self.parameters, kwargs).items():
+            setattr(self, key, value)
+
+        self.config_file = os.path.join(CONFIG_DIR, '{}_crl.json'.format(self.beamline))
+        self.slots = sorted(read_json(self.config_file)['crl'], key=lambda x: x['offset_cart'])
+        self.slot_index = {}
+        for i, slot in enumerate(self.slots):
+            self.slot_index[self.parameters['cart_ids']['element_type'](slot['id'])] = i
+        self.lens_config = {}
+        for i in self.r_array:
+            for j in self.lens_array:
+                self.lens_config['T_{}_{}'.format(j, i)] = {
+                    'radius': i * 1e-6,
+                    'lens_number': j,
+                }
+
+        self.size = 1
+        while self.size < len(self.slots):
+            self.size *= 2
+        self.inserted = [False] * len(self.slots)
+        self.tree = [_EMPTY] * (2 * self.size)
+        self.deltas = None
+        self.lens_matrices = None
+
+        self.set_energy(self.energy)
+        if self.cart_ids:
+            self.set_cart_ids(self.cart_ids)
+
+    def get_available_ids(self):
+        return [str(slot['id']) for slot in self.slots]
+
+    def get_cart_ids(self):
+        return [str(self.slots[i]['id']) for i in range(len(self.slots)) if self.inserted[i]]
+
+    def get_result(self):
+        """Calculate the focus for the currently inserted cartridges.
+
+        :return: dictionary with ``p0``, ``p1``, ``f`` and ``d``.
+        """
+        M, _, _, last = self.tree[1]
+        result = {
+            'cart_ids': self.get_cart_ids(),
+            'd': 0,
+            'f': 0,
+            'p0': self.p0,
+            'p1': 0,
+        }
+        if last is None:
+            return result
+        y0 = self.p0 * math.tan(self.teta0)
+        y = M[0] * y0 + M[1] * self.teta0
+        teta = M[2] * y0 + M[3] * self.teta0
+        p1 = y / math.tan(math.pi - teta)
+        result['p1'] = p1
+        result['f'] = 1 / (1 / self.p0 + 1 / p1)
+        result['d'] = self.d_ssa_focus - (self.p0 + p1 + self.slots[last]['offset_cart'] * self.dl_cart)
+        return result
+
+    def insert(self, cart_id):
+        return self._update(cart_id, True)
+
+    def remove(self, cart_id):
+        return self._update(cart_id, False)
+
+    def set_cart_ids(self, cart_ids):
+        """Replace the whole set of inserted cartridges.
+
+        :param cart_ids: ids of the cartridges to insert, all others are removed.
+        :return: dictionary with the result (see :meth:`get_result`).
+        """
+        cart_ids = [self.parameters['cart_ids']['element_type'](x) for x in cart_ids]
+        check_planes(self.slots[self._find_slot(x)] for x in cart_ids)
+        inserted = set(cart_ids)
+        for i, slot in enumerate(self.slots):
+            self.inserted[i] = str(slot['id']) in inserted
+        self._build()
+        return self.get_result()
+
+    def set_energy(self, energy):
+        """Change the photon energy, which requires recalculation of all lens matrices.
+
+        :param energy: photon energy [eV].
+        :return: dictionary with the result (see :meth:`get_result`).
+        """
+        self.energy = self.parameters['energy']['type'](energy)
+        self.deltas = {}
+        for slot in self.slots:
+            data_file = material_data_file(slot, self.data_file)
+            if data_file not in self.deltas:
+                self.deltas[data_file] = find_delta(
+                    self.energy,
+                    data_file,
+                    formula=slot.get('material'),
+                    calc_delta=self.calc_delta,
+                    use_numpy=self.use_numpy,
+                )
+        self.lens_matrices = [self._calc_lens_array(slot) for slot in self.slots]
+        self._build()
+        return self.get_result()
+
+    def toggle(self, cart_id):
+        return self._update(cart_id, not self.inserted[self._find_slot(cart_id)])
+
+    def _build(self):
+        for i in range(len(self.slots)):
+            self.tree[self.size + i] = self._leaf(i)
+        for i in range(self.size - 1, 0, -1):
+            self.tree[i] = _combine(self.tree[2 * i], self.tree[2 * i + 1])
+
+    def _calc_lens_array(self, slot):
+        lens = self.lens_config[slot['name']]
+        delta = self.deltas[material_data_file(slot, self.data_file)]
+        return optics.lens_array(lens['radius'], lens['lens_number'], delta, self.dl_lens)
+
+    def _find_slot(self, cart_id):
+        cart_id = self.parameters['cart_ids']['element_type'](cart_id)
+        if cart_id not in self.slot_index:
+            msg = 'Specified cart_id <{}> not in the list of available ids: <{}>.'
+            raise Exception(msg.format(cart_id, ', '.join(self.get_available_ids())))
+        return self.slot_index[cart_id]
+
+    def _leaf(self, i):
+        if i + 1 < len(self.slots):
+            gap = (self.slots[i + 1]['offset_cart'] - self.slots[i]['offset_cart']) * self.dl_cart
+        else:
+            gap = 0.
+        if not self.inserted[i]:
+            return optics.IDENTITY, gap, 0., None
+        lens_number = self.lens_config[self.slots[i]['name']]['lens_number']
+        return self.lens_matrices[i], 0., gap - lens_number * self.dl_lens, i
+
+    def _update(self, cart_id, inserted):
+        i = self._find_slot(cart_id)
+        if inserted:
+            check_planes([self.slots[i]])
+        if self.inserted[i] != inserted:
+            self.inserted[i] = inserted
+            j = self.size + i
+            self.tree[j] = self._leaf(i)
+            j //= 2
+            while j:
+                self.tree[j] = _combine(self.tree[2 * j], self.tree[2 * j + 1])
+                j //= 2
+        return self.get_result()
+
+
+def _combine(a, b):
+    """Combine two neighbouring nodes, ``a`` is upstream of ``b``."""
+    if a[3] is None:
+        return b[0], a[1] + b[1], b[2], b[3]
+    if b[3] is None:
+        return a[0], a[1], a[2] + b[1], a[3]
+    g = a[2] + b[1]
+    m = a[0]
+    return optics.mul(b[0], (m[0] + g * m[2], m[1] + g * m[3], m[2], m[3])), a[1], b[2], b[3]
@@ -1,7 +1,17 @@
+import copy
 import json
 import os
+import threading
+
 from pykern import pkjinja
 
+from bnlcrl import timing
+
+# Shared read-only JSON configs and their converted parameters (see read_config and read_parameters):
+_configs = {}
+_configs_lock = threading.Lock()
+_parameters = {}
+
 
 def defaults_file(suffix=None, defaults_file_path=None):
     script_path = os.path.dirname(os.path.realpath(__file__))
@@ -88,25 +98,8 @@ def console(class_name, parameters_file):
 
 def convert_types(input_dict):
     """Convert types of values from specified JSON file."""
-    # Eval `type` and `element_type` first:
-    for key in input_dict.keys():
-        if input_dict[key]['type'] == 'tuple':
-            input_dict[key]['type'] = 'list'
-        for el_key in ['type', 'element_type']:
-            if el_key in input_dict[key].keys():
-                input_dict[key][el_key] = eval(input_dict[key][el_key])
-
-    # Convert values:
-    for key in input_dict.keys():
-        if 'default' in input_dict[key].keys() and input_dict[key]['default'] is not None:
-            if 'element_type' in input_dict[key].keys():
-                if input_dict[key]['type'] == list:
-                    for i in range(len(input_dict[key]['default'])):
-                        input_dict[key]['default'][i] = input_dict[key]['element_type'](input_dict[key]['default'][i])
-            else:
-                input_dict[key]['default'] = input_dict[key]['type'](input_dict[key]['default'])
-
-    return input_dict
+    with timing.span('utils.convert_types'):
+        return _convert_types(input_dict)
 
 
 def create_cli_function(function_name, parameters, config):
@@ -120,6 +113,14 @@ def create_cli_function(function_name, parameters, config):
     Returns:
         str: resulted function represented as a string.
     """
+    # The profiling options are added to every function, but not passed to the class:
+    from bnlcrl import profiling
+
+    for key in profiling.PARAMETERS:
+        if key in parameters:
+            raise Exception('Parameter <{}> of <{}> is reserved for profiling.'.format(key, function_name))
+    class_parameters = parameters
+    parameters = dict(parameters, **profiling.PARAMETERS)
 
     # argh_decorators:
     argh_args = ''
@@ -140,6 +141,15 @@ def create_cli_function(function_name, parameters, config):
                 key,
                 ', '.join(["\'{}\'".format(x) for x in parameters[key]['choices'].keys()])
             )
+    # Short options of the named parameters (``short_argument`` or the first letter if no other named parameter starts
+    # with it) are declared explicitly, argh would drop the ones shared with the profiling options otherwise:
+    named = sorted(k for k in class_parameters.keys() if class_parameters[k]['default'] is not None)
+    for key in named:
+        short = class_parameters[key].get('short_argument')
+        if not short and [x[0] for x in named].count(key[0]) == 1:
+            short = key[0]
+        if short:
+            argh_kwargs += "@argh.arg('-{}', '--{}')\n".format(short, key.replace('_', '-'))
     argh_decorators = '{}{}'.format(argh_args, argh_kwargs)
 
     # function_arguments:
@@ -179,13 +189,15 @@ def create_cli_function(function_name, parameters, config):
             format_values.append(choices_str)
         arguments_description += format_str.format(*format_values)
 
-    # class_name:
+    # class_name, the modules of the functions (e.g. ``lookup_table.find_configuration``) are imported when called:
     class_name = config['class_name']
+    module = class_name.split('.')[0]
+    class_import = '    from bnlcrl import {}\n\n'.format(module) if '.' in class_name and module.islower() else ''
 
     # class_arguments:
     class_arguments = ''
-    for key in sorted(parameters.keys()):
-        class_arguments += '        {}={},\n'.format(key, key)
+    for key in sorted(class_parameters.keys()):
+        class_arguments += '            {}={},\n'.format(key, key)
 
     # return_dict
     return_dict = ''
@@ -195,6 +207,9 @@ def create_cli_function(function_name, parameters, config):
         return_dict = '{{\n{}    }}'.format(return_dict)
     else:
         return_dict = config['returns']
+    if 'timing' in parameters:
+        # The phase timings and counters are added on request only:
+        return_dict = "dict({}, **({{'stats': c.stats}} if timing else {{}}))".format(return_dict)
 
     v = {
         'argh_decorators': argh_decorators,
@@ -204,12 +219,34 @@ def create_cli_function(function_name, parameters, config):
         'description_long': description_long,
         'arguments_description': arguments_description,
         'class_name': class_name,
+        'class_import': class_import,
         'class_arguments': class_arguments,
         'return_dict': return_dict,
     }
     return pkjinja.render_resource('cli_function', v)
 
 
+def function_parameters(config, function):
+    """Get the parameters of the CLI function, the common parameters if it has none.
+
+    A parameter of the function may refer to the one defined in another section of the config by the name of the
+    section, e.g. ``"lens_thickness": "batch_parameters"``, the referred parameters are copied.
+
+    Args:
+        config (dict): dictionary with the configuration in JSON format.
+        function (str): name of the CLI function.
+
+    Returns:
+        dict: parameters (not converted).
+    """
+    parameters = config['cli_functions'][function].get('parameters')
+    if parameters is None:
+        return config['parameters']
+    return dict(
+        (k, copy.deepcopy(config[v][k]) if isinstance(v, str) else v) for k, v in parameters.items()
+    )
+
+
 def get_cli_functions(config):
     """Get list of CLI functions' content with the input from JSON config.
 
@@ -221,21 +258,104 @@ def get_cli_functions(config):
     """
     functions_list = []
     for key in config['cli_functions'].keys():
-        if 'parameters' in config['cli_functions'][key]:
-            parameters = convert_types(config['cli_functions'][key]['parameters'])
-        else:
-            parameters = convert_types(config['parameters'])
+        parameters = convert_types(function_parameters(config, key))
         content = create_cli_function(key, parameters, config['cli_functions'][key])
         functions_list.append(content)
     return functions_list
 
 
+def read_config(file_name):
+    """Read the JSON file once and share the result until the file changes.
+
+    The result is shared by all callers and threads, so it must not be modified (see :func:`read_json` for a copy).
+    """
+    try:
+        mtime = os.path.getmtime(file_name)
+    except OSError:
+        raise Exception('The specified file <{}> not found!'.format(file_name))
+    with _configs_lock:
+        cached = _configs.get(file_name)
+        if cached and cached[0] == mtime:
+            timing.count('utils.config_cache_hits')
+            return cached[1]
+    data = read_json(file_name)
+    with _configs_lock:
+        _configs[file_name] = (mtime, data)
+    return data
+
+
+def read_parameters(file_name, function=None, section='parameters'):
+    """Read the converted parameters (see :func:`convert_types`) of the JSON config once and share them.
+
+    Args:
+        file_name (str): JSON config file.
+        function (str): name of the CLI function (see :func:`function_parameters`), the section if not specified.
+        section (str): section of the config with the parameters, the common parameters by default.
+
+    Returns:
+        dict: parameters, which must not be modified.
+    """
+    data = read_config(file_name)
+    key = (file_name, function, section)
+    with _configs_lock:
+        cached = _parameters.get(key)
+        if cached and cached[0] is data:
+            return cached[1]
+    parameters = function_parameters(data, function) if function else data[section]
+    parameters = convert_types(copy.deepcopy(parameters))
+    with _configs_lock:
+        _parameters[key] = (data, parameters)
+    return parameters
+
+
+def resolve_parameters(parameters, kwargs):
+    """Get the value of every parameter, converted to its type if specified in kwargs, its default otherwise.
+
+    Args:
+        parameters (dict): converted parameters (see :func:`read_parameters`).
+        kwargs (dict): specified values.
+
+    Returns:
+        dict: new dictionary with the values, the list defaults are copied.
+    """
+    v = {}
+    for key, p in parameters.items():
+        if key in kwargs and kwargs[key] is not None:
+            v[key] = p['type'](kwargs[key])
+        else:
+            v[key] = list(p['default']) if isinstance(p['default'], list) else p['default']
+    return v
+
+
 def read_json(file_name):
+    timing.count('utils.json_reads')
     try:
-        with open(file_name, 'r') as f:
+        with timing.span('utils.read_json'), open(file_name, 'r') as f:
             data = json.load(f)
     except IOError:
         raise Exception('The specified file <{}> not found!'.format(file_name))
     except ValueError:
         raise Exception('Malformed JSON file <{}>!'.format(file_name))
     return data
+
+
+def _convert_types(input_dict):
+    # Eval `type` and `element_type` first:
+    for key in input_dict.keys():
+        if input_dict[key]['type'] == 'tuple':
+            input_dict[key]['type'] = 'list'
+        for el_key in ['type', 'element_type']:
+            if el_key in input_dict[key].keys():
+                input_dict[key][el_key] = eval(input_dict[key][el_key])
+
+    # Convert values:
+    for key in input_dict.keys():
+        if 'default' in input_dict[key].keys() and input_dict[key]['default'] is not None:
+            if 'element_type' in input_dict[key].keys():
+                if input_dict[key]['type'] == list:
+                    for i in range(len(input_dict[key]['default'])):
+                        input_dict[key]['default'][i] = input_dict[key]['element_type'](input_dict[key]['default'][i])
+            else:
+                input_dict[key]['default'] = input_dict[key]['type'](input_dict[key]['default'])
+
+    return input_dict
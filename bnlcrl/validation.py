@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+u"""Validation of the analytic delta against the tabulated one for all materials.
+
+For every ``*_delta.dat`` table in ``bnlcrl/package_data/dat`` the analytic delta
+(:func:`bnlcrl.delta_finder.analytic_delta`, the formula of ``find_delta --calc-delta``) is evaluated on the whole
+energy grid of the table at once, with the density from the table header and Z/A of the formula from
+``periodictable``. The relative errors ``(tabulated - analytic) / tabulated`` are summarized per energy band, and the
+figures are rendered in parallel processes.
+
+:copyright: Copyright (c) 2016 mrakitin.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+
+import glob
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from bnlcrl.delta_finder import DAT_DIR, analytic_delta
+from bnlcrl.tables import data_file_path, read_table
+
+BANDS = (30., 100., 300., 1000., 3000., 10000., 30000.)  # edges of the energy bands [eV]
+STATISTICS = ('count', 'mean', 'mean_abs', 'rms', 'max_abs')
+
+
+def calc_errors(data_file, density=None):
+    """Calculate the tabulated and the analytic delta and the relative errors on the energy grid of the table.
+
+    :param data_file: ``<formula>_delta.dat`` file name in ``bnlcrl/package_data/dat/`` or an absolute path.
+    :param density: density of the material [g/cm^3], the one of the table header by default.
+    :return: dictionary with ``formula``, ``density``, ``energy``, ``tabulated``, ``analytic`` and ``error``.
+    """
+    formula = os.path.basename(data_file).split('_')[0]
+    energies, tabulated = read_table(data_file)
+    if density is None:
+        density = read_density(data_file)
+    analytic = analytic_delta(energies, density, z_over_a(formula))
+    return {
+        'analytic': analytic,
+        'density': density,
+        'energy': energies,
+        'error': (tabulated - analytic) / tabulated,
+        'formula': formula,
+        'tabulated': tabulated,
+    }
+
+
+def material_files():
+    """Find the delta tables of all materials."""
+    return sorted(os.path.basename(x) for x in glob.glob(os.path.join(DAT_DIR, '*_delta.dat')))
+
+
+def read_density(data_file):
+    """Read the density from the header of the table (e.g. `` Be Density=1.848``)."""
+    with open(data_file_path(data_file)) as f:
+        m = re.search(r'Density=([0-9.eE+-]+)', f.readline())
+    if not m:
+        raise Exception('Density is not found in the header of <{}>.'.format(data_file))
+    return float(m.group(1))
+
+
+def render_figures(errors, outdir, processes=None):
+    """Render a figure per material (the tabulated/analytic delta and the relative error) in a process pool.
+
+    :param errors: list of the results of :func:`calc_errors`.
+    :param outdir: directory to write ``<formula>_delta_validation.png`` to.
+    :param processes: number of processes, the number of CPUs by default.
+    :return: list of the written file names.
+    """
+    jobs = [(x, os.path.join(outdir, '{}_delta_validation.png'.format(x['formula']))) for x in errors]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(_render_figure, jobs))
+
+
+def summarize(energies, errors, bands=BANDS):
+    """Summarize the relative errors per energy band.
+
+    :param energies: sorted energies [eV].
+    :param errors: relative errors at the energies.
+    :param bands: edges of the bands [eV], a band includes its lower edge.
+    :return: list of dictionaries per band with ``e_min``, ``e_max`` and :data:`STATISTICS` (NaN for empty bands).
+    """
+    bands = np.asarray(bands, dtype=float)
+    edges = np.searchsorted(energies, bands)
+    edges[-1] = np.searchsorted(energies, bands[-1], side='right')  # the last band includes the upper edge
+    counts = np.diff(edges)
+
+    def reduce(ufunc, x):
+        # A padding element after the data ends the last band at its upper edge, not at the end of the data:
+        return ufunc.reduceat(np.append(x, 0.), edges)[:-1]
+
+    errors = np.asarray(errors, dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        s = {
+            'count': counts,
+            'max_abs': reduce(np.maximum, np.abs(errors)),
+            'mean': reduce(np.add, errors) / counts,
+            'mean_abs': reduce(np.add, np.abs(errors)) / counts,
+            'rms': np.sqrt(reduce(np.add, errors ** 2) / counts),
+        }
+    result = []
+    for i in range(len(counts)):
+        r = {'e_max': float(bands[i + 1]), 'e_min': float(bands[i])}
+        for k in STATISTICS:
+            r[k] = int(counts[i]) if k == 'count' else (float(s[k][i]) if counts[i] else float('nan'))
+        result.append(r)
+    return result
+
+
+def validate(data_files=None, bands=BANDS):
+    """Validate the analytic delta for the materials.
+
+    :param data_files: list of the delta tables, all of them by default (see :func:`material_files`).
+    :param bands: edges of the energy bands [eV].
+    :return: tuple of the report (per formula: ``density``, ``bands`` and ``overall`` statistics) and the list of the
+        results of :func:`calc_errors`.
+    """
+    report = {}
+    errors = []
+    for data_file in data_files or material_files():
+        e = calc_errors(data_file)
+        errors.append(e)
+        report[e['formula']] = {
+            'bands': summarize(e['energy'], e['error'], bands),
+            'density': e['density'],
+            'overall': summarize(e['energy'], e['error'], (e['energy'][0], e['energy'][-1]))[0],
+        }
+    return report, errors
+
+
+def z_over_a(formula):
+    """Calculate Z/A of the formula (e.g. ``SiO2``) with ``periodictable``."""
+    try:
+        import periodictable
+    except ImportError:
+        raise Exception('"periodictable" library is not available. Install it if you want to use it.')
+    atoms = periodictable.formula(formula).atoms
+    return sum(n * x.number for x, n in atoms.items()) / sum(n * x.mass for x, n in atoms.items())
+
+
+def _render_figure(job):
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import pyplot as plt
+
+    e, file_name = job
+    fig, (ax1, ax2) = plt.subplots(2, 1, sharex=True, figsize=(10, 8))
+    ax1.loglog(e['energy'], e['tabulated'], label='Tabulated (Henke)')
+    ax1.loglog(e['energy'], e['analytic'], label='Analytic')
+    ax1.set_ylabel('Delta')
+    ax1.set_title('{} (density={} g/cm$^3$)'.format(e['formula'], e['density']))
+    ax1.legend()
+    ax1.grid(True)
+    ax2.semilogx(e['energy'], e['error'] * 100)
+    ax2.set_xlabel('Energy, [eV]')
+    ax2.set_ylabel('Relative Delta difference, %')
+    ax2.grid(True)
+    fig.savefig(file_name)
+    plt.close(fig)
+    return file_name
@@ -1,16 +1,129 @@
-from io import StringIO  # StringIO behaves like a file object
-
 import numpy as np
 
+DECIMATIONS = ('lttb', 'minmax', 'none')
+DPI = 100
+
+
+def decimate(x, y, max_points, decimation='minmax'):
+    """Find the indices of the points to plot within the budget.
+
+    :param x: x values (sorted).
+    :param y: y values.
+    :param max_points: maximum number of points.
+    :param decimation: ``minmax`` (the extremes per bin), ``lttb`` (Largest-Triangle-Three-Buckets) or ``none``.
+    :return: sorted indices of the points.
+    """
+    if decimation == 'minmax':
+        return decimate_minmax(y, max_points // 2)
+    if decimation == 'lttb':
+        return decimate_lttb(x, y, max_points)
+    if decimation == 'none':
+        return np.arange(len(y))
+    raise Exception('Unknown decimation <{}>, use one of: {}.'.format(decimation, ', '.join(DECIMATIONS)))
+
+
+def decimate_lttb(x, y, n_out):
+    """Select ``n_out`` points with the Largest-Triangle-Three-Buckets algorithm (the first and the last are kept).
+
+    :return: sorted indices of the points.
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # The points between the first and the last ones are split into n_out - 2 buckets:
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    # Mean of each bucket and of the last point (the next bucket of the last bucket):
+    counts = np.append(np.diff(edges), 1)
+    mean_x = np.add.reduceat(x[1:], edges - 1) / counts
+    mean_y = np.add.reduceat(y[1:], edges - 1) / counts
+    indices = np.empty(n_out, dtype=int)
+    indices[0] = 0
+    indices[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        area = np.abs((x[a] - mean_x[i + 1]) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (mean_y[i + 1] - y[a]))
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+    return indices
+
+
+def decimate_minmax(y, n_bins):
+    """Keep the minimum and the maximum of each of ``n_bins`` bins of consecutive points, and the first/last points.
+
+    :return: sorted indices of the points.
+    """
+    n = len(y)
+    if n_bins < 1 or 2 * n_bins + 2 >= n:
+        return np.arange(n)
+    size = -(-n // n_bins)
+    # Pad the last bin with its last value to reshape the points to (n_bins, size):
+    bins = np.pad(np.asarray(y, dtype=float), (0, size * n_bins - n), mode='edge').reshape(n_bins, size)
+    offsets = np.arange(n_bins) * size
+    indices = np.concatenate([[0, n - 1], offsets + bins.argmin(axis=1), offsets + bins.argmax(axis=1)])
+    return np.unique(np.minimum(indices, n - 1))
+
 
-def plot_data(df, elements, property, thickness, e_min, e_max, n_points, file_name='data', x_label=None,
-              figsize=(10, 6), show_plot=False):
+def parse_data(d, elements, skiprows=2):
+    """Parse a list of strings, each representing the read data, into one 2-D array.
+
+    The first column is the energy of the first string, the other columns are the values (the 2nd column of the
+    data) of each string. Every line must have a number per column, malformed data are rejected.
+
+    :param d: a list of strings, each representing the read data.
+    :param elements: Chemical elements of interest.
+    :param skiprows: number of header lines.
+    :return: a tuple of the array and the column names (``None`` for no data).
+    """
+    data = None
+    columns = None
+    for i, str_data in enumerate(d):
+        header = str_data.split('\n', skiprows)
+        names = [x.strip() for x in header[skiprows - 1].strip().split(',')]
+        try:
+            values = np.loadtxt(header[skiprows].splitlines(), ndmin=2)
+        except ValueError as e:
+            raise Exception('Malformed data of <{}>: {}'.format(elements[i], e))
+        if values.shape[1] != len(names):
+            raise Exception('Malformed data of <{}>: {} values per line in {} columns.'.format(
+                elements[i], values.shape[1], len(names)))
+        if data is None:
+            data = np.empty((len(values), len(d) + 1))
+            data[:, 0] = values[:, 0]
+            columns = [names[0]]
+        elif len(values) != len(data) or not np.array_equal(values[:, 0], data[:, 0]):
+            raise Exception('Energies of <{}> differ from the ones of <{}>.'.format(elements[i], elements[0]))
+        data[:, i + 1] = values[:, 1]
+        columns.append('{} {}'.format(names[1], elements[i]) if len(elements) > 1 else names[1])
+    return data, columns
+
+
+def plot_data(data, elements, property, thickness, e_min, e_max, n_points, file_name='data', x_label=None,
+              figsize=(10, 6), show_plot=False, columns=None, max_points=None, decimation='minmax'):
+    """Plot the values against the energy, decimated to about two points per horizontal pixel by default.
+
+    :param data: 2-D array with the energy in the first column (see :func:`parse_data`) or a DataFrame.
+    :param columns: column names of the array.
+    :param max_points: maximum number of points plotted per line.
+    :param decimation: method of :func:`decimate`.
+    """
     from matplotlib import pyplot as plt
-    thickness = ', thickness={} [$\mathrm{{\mu}}$m]'.format(thickness) if property == 'transmission' else ''
+    if hasattr(data, 'columns'):
+        columns = [str(x) for x in data.columns]
+        data = data.values
+    if max_points is None:
+        max_points = int(2 * figsize[0] * DPI)
+    thickness = r', thickness={} [$\mathrm{{\mu}}$m]'.format(thickness) if property == 'transmission' else ''
 
-    fig = plt.figure(figsize=figsize)
-    axes = fig.add_subplot(111)
-    ax = df.plot(x_label, grid=True, ax=axes)
+    fig = plt.figure(figsize=figsize, dpi=DPI)
+    ax = fig.add_subplot(111)
+    for j in range(1, data.shape[1]):
+        idx = decimate(data[:, 0], data[:, j], max_points, decimation=decimation)
+        ax.plot(data[idx, 0], data[idx, j], label=columns[j])
+    ax.grid(True)
+    ax.legend()
     ax.set_title(r'{}: {} ({}-{} eV, {} points{})'.format(
         property.capitalize(),
         ', '.join(elements),
@@ -19,15 +132,22 @@ def plot_data(df, elements, property, thickness, e_min, e_max, n_points, file_na
         n_points,
         thickness,
     ))
-    ax.set_xlabel(x_label)
+    ax.set_xlabel(x_label or columns[0])
     ax.set_ylabel('{}'.format(property.capitalize()))
     plt.savefig('{}.png'.format(file_name))
     if show_plot:
         plt.show()
+    plt.close(fig)
 
 
-def save_to_csv(df, file_name='data', index=False):
-    df.to_csv('{}.csv'.format(file_name), index=index)
+def save_to_csv(data, file_name='data', index=False, columns=None):
+    """Save the array (see :func:`parse_data`) with the column names, or a DataFrame, to a CSV file."""
+    if hasattr(data, 'to_csv'):
+        data.to_csv('{}.csv'.format(file_name), index=index)
+        return
+    from bnlcrl.result_set import ResultSet
+
+    ResultSet(dict((k, data[:, j]) for j, k in enumerate(columns)), names=columns).to_csv('{}.csv'.format(file_name))
 
 
 def to_dataframe(d, elements):
@@ -38,17 +158,7 @@ def to_dataframe(d, elements):
     :return: a tuple of DataFrame and the parsed columns.
     """
     import pandas as pd
-    df = None
-    columns = None
-    for i, str_data in enumerate(d):
-        element = elements[i]
-        c = StringIO(str_data)
-        title, columns = str_data.split('\n')[0:2]
-        columns = [x.strip() for x in columns.strip().split(',')]
-        columns[1] = '{} {}'.format(columns[1], element) if len(elements) > 1 else columns[1]
-        data = np.loadtxt(c, skiprows=2)
-        if df is None:
-            df = pd.DataFrame(data[:, :2], columns=columns[:2])
-        else:
-            df[columns[1]] = data[:, 1]
-    return df, columns
+    data, columns = parse_data(d, elements)
+    if data is None:
+        return None, None
+    return pd.DataFrame(data, columns=columns), columns
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+import asyncio
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+from bnlcrl import aio, delta_finder
+from bnlcrl.pkcli import simulate
+
+
+class _Henke(BaseHTTPRequestHandler):
+    """Stand-in for the server of the X-ray database: the tables are taken from the local data files."""
+
+    def do_GET(self):
+        self._send(self.server.files[self.path])
+
+    def do_POST(self):
+        with self.server.lock:
+            self.server.active += 1
+            self.server.max_active = max(self.server.max_active, self.server.active)
+        try:
+            form = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+            time.sleep(0.05)
+            with self.server.lock:
+                name = '/tmp/xray{}.dat'.format(len(self.server.files))
+                with open(os.path.join(delta_finder.DAT_DIR, '{}_delta.dat'.format(form['Formula'][0]))) as f:
+                    self.server.files[name] = f.read()
+            self._send('<meta http-equiv="refresh" content="0; URL={}">'.format(name))
+        finally:
+            with self.server.lock:
+                self.server.active -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, text):
+        body = text.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def henke(tmpdir, monkeypatch):
+    s = ThreadingHTTPServer(('127.0.0.1', 0), _Henke)
+    s.active = s.max_active = 0
+    s.files = {}
+    s.lock = threading.Lock()
+    t = threading.Thread(target=s.serve_forever)
+    t.start()
+    with open(delta_finder.DEFAULTS_FILE) as f:
+        d = json.load(f)
+    d['server_info']['server'] = 'http://127.0.0.1:{}'.format(s.server_address[1])
+    f = str(tmpdir.join('defaults_delta.json'))
+    with open(f, 'w') as f_:
+        json.dump(d, f_)
+    monkeypatch.setattr(delta_finder, 'DEFAULTS_FILE', f)
+    yield s
+    s.shutdown()
+    s.server_close()
+    t.join()
+
+
+def test_find_delta_many(henke):
+    queries = [{'energy': e, 'formula': f} for e in (9000, 21500, 25000) for f in ('Al', 'Be', 'C')]
+    r = asyncio.run(aio.find_delta_many_async(queries, limit=3))
+    assert 1 < henke.max_active <= 3
+    for q, x in zip(queries, r):
+        d = simulate.find_delta(q['energy'], data_file='{}_delta.dat'.format(q['formula']))
+        assert 'server' == x['method']
+        assert d['characteristic_value'] == x['characteristic_value']
+        assert d['closest_energy'] == x['closest_energy']
+
+
+def test_find_delta_errors(henke):
+    r = asyncio.run(aio.find_delta_many_async(
+        [{'energy': 21500, 'formula': 'Be'}, {'energy': 1e6, 'formula': 'Be'}],
+        return_exceptions=True,
+    ))
+    assert 'server' == r[0]['method']
+    assert isinstance(r[1], Exception)
+
+
+def test_simulate_crl():
+    queries = [{'cart_ids': ['2', '4', '6'], 'energy': e, 'p0': 6.52} for e in (9000, 21500)]
+
+    async def f():
+        # The event loop keeps running while the simulations are calculated:
+        ticks = []
+        task = asyncio.ensure_future(aio.simulate_crl_many_async(queries, limit=1))
+        while not task.done():
+            ticks.append(1)
+            await asyncio.sleep(0)
+        return task.result(), ticks
+
+    r, ticks = asyncio.run(f())
+    assert ticks
+    for q, x in zip(queries, r):
+        assert simulate.simulate_crl(**q) == x
+    assert simulate.simulate_crl(['2'], 21500) == asyncio.run(aio.simulate_crl_async(['2'], 21500))
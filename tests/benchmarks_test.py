@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+import json
+import os
+
+import pytest
+from bnlcrl import benchmarks
+
+
+def test_check(tmpdir):
+    f = str(tmpdir.join('baseline.json'))
+    benchmarks.write({'benchmarks': {'get_cli_functions/delta': {'normalized': 1e-6}}}, outfile=f)
+    r = benchmarks.check(baseline_file=f, retries=1, repeat=2, min_time=0.001)
+    assert ['get_cli_functions/delta'] == [x['name'] for x in r]
+    assert r[0]['regressed']
+    benchmarks.write({'benchmarks': {'get_cli_functions/delta': {'normalized': 1e6}}}, outfile=f)
+    assert not benchmarks.check(baseline_file=f, repeat=2, min_time=0.001)[0]['regressed']
+
+
+@pytest.mark.skipif(not os.environ.get('BNLCRL_BENCHMARK_GATE'), reason='set BNLCRL_BENCHMARK_GATE=1 to run')
+def test_regression_gate():
+    ratio = float(os.environ.get('BNLCRL_BENCHMARK_RATIO', benchmarks.DEFAULT_RATIO))
+    r = benchmarks.check(ratio=ratio)
+    assert sorted(benchmarks.GATE) == [x['name'] for x in r]
+    assert [] == ['{name}: {ratio:.2f}'.format(**x) for x in r if x['regressed']]
+
+
+def test_run(tmpdir):
+    r = benchmarks.run(select=['calc_ideal_focus/*', 'find_delta/Be_delta.dat/*'], repeat=2, min_time=0.001)
+    assert ['calc_ideal_focus/grid', 'find_delta/Be_delta.dat/numpy', 'find_delta/Be_delta.dat/python'] == \
+        [x['name'] for x in r['benchmarks']]
+    for x in r['benchmarks']:
+        s = x['stats']
+        assert 2 == s['rounds']
+        assert 0 < s['min'] <= s['median'] <= s['max']
+    f = str(tmpdir.join('benchmarks.json'))
+    benchmarks.write(r, outfile=f)
+    with open(f) as f:
+        assert r == json.load(f)
+
+
+def test_select():
+    names = benchmarks.select_names()
+    for group in ('all_subsets', 'calc_ideal_focus', 'cli_startup', 'energy_sweep', 'optics', 'simulate_crl'):
+        assert any(x.startswith(group + '/') for x in names)
+    assert 44 == len(benchmarks.select_names('find_delta/*'))
+    with pytest.raises(Exception):
+        benchmarks.select_names('unknown')
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+import pytest
+from bnlcrl.crl_simulator import CRLSimulator
+
+
+def _simulator():
+    return CRLSimulator(cart_ids=['2', '4', '6', '7', '8'], energy=21500, p0=6.52)
+
+
+def test_caustic_single_ray():
+    c = _simulator()
+    z = np.linspace(0, 3, 30001)
+    d = c.calc_caustic(z)
+    assert len(d['envelope']) == len(z)
+    assert abs(d['waist_position'] - c.p1) < 1e-4
+    assert d['waist_size'] < 1e-7
+
+
+def test_caustic_bundle_outfile(tmpdir):
+    c = _simulator()
+    z = np.linspace(0, 3, 3001)
+    teta0 = np.linspace(-6e-5, 6e-5, 11)
+    y0 = c.p0 * np.tan(teta0)
+    d = c.calc_caustic(z, y0=y0, teta0=teta0)
+    outfile = str(tmpdir.join('caustic.csv'))
+    s = c.calc_caustic(z, y0=y0, teta0=teta0, outfile=outfile)
+    assert s['envelope'] is None
+    assert s['waist_position'] == d['waist_position']
+    data = np.loadtxt(outfile, delimiter=',', skiprows=1)
+    assert np.allclose(data[:, 1], d['envelope'])
+
+
+def test_caustic_no_lenses():
+    c = CRLSimulator(cart_ids=[], energy=21500)
+    with pytest.raises(Exception):
+        c.calc_caustic([0, 1])
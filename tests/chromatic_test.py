@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+import pytest
+from bnlcrl.chromatic import calc_chromatic_focus
+from bnlcrl.pkcli import simulate
+
+ndigits = 10
+
+
+def test_monochromatic():
+    d = simulate.simulate_crl(['2', '4', '6', '7', '8'], 21500, p0=6.52)
+    r = calc_chromatic_focus(['2', '4', '6', '7', '8'], [21500], [2.], p0=6.52)
+    assert round(d['p1'], ndigits) == round(r['p1'], ndigits)
+    assert round(d['d'], ndigits) == round(r['d'], ndigits)
+    assert 0 == r['p1_std']
+    assert abs(r['p1_effective'] - d['p1']) < 1e-6
+
+
+def test_spectrum(tmpdir):
+    energies = np.linspace(21000, 22000, 2001)
+    weights = np.exp(-((energies - 21500) / 100) ** 2)
+    spectrum_file = str(tmpdir.join('spectrum.dat'))
+    np.savetxt(spectrum_file, np.column_stack([energies, weights]), header='energy flux')
+    r = simulate.simulate_spectrum(['2', '4', '6', '7', '8'], spectrum_file, p0=6.52)
+    d = simulate.simulate_crl(['2', '4', '6', '7', '8'], 21500, p0=6.52)
+    assert abs(r['p1'] - d['p1']) < 1e-3
+    assert 0.005 < r['p1_std'] < 0.02
+    with pytest.raises(Exception):
+        calc_chromatic_focus(['2'], energies, weights[:-1])
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+import json
+import os
+
+import numpy as np
+import pytest
+from bnlcrl import crl_batch, crl_simulator, transfocator
+from bnlcrl.crl_batch import CRLBatch
+from bnlcrl.crl_simulator import CRLSimulator
+from bnlcrl.lookup_table import LookupTable
+from bnlcrl.scan_planner import plan_energy_scan
+from bnlcrl.tables import find_characteristic_values
+from bnlcrl.transfocator import Transfocator
+from bnlcrl.pkcli import simulate
+
+
+def test_materials(tmpdir, monkeypatch):
+    cart_ids = ['2', '4', '6', '7', '8']
+    be = CRLBatch().simulate([21500], CRLBatch().get_masks([cart_ids]), p0=6.52)['d'][0, 0]
+    _write_config(tmpdir, monkeypatch, {'2': {'material': 'Al'}, '6': {'material': 'C'}})
+    c = CRLSimulator(beamline='test', cart_ids=cart_ids, energy=21500, p0=6.52)
+    assert ['Al_delta.dat', 'Be_delta.dat', 'C_delta.dat'] == sorted(c.deltas.keys())
+    b = CRLBatch(beamline='test')
+    assert ['Al_delta.dat', 'Be_delta.dat', 'C_delta.dat'] == b.materials
+    assert ['Al_atten.dat', 'Be_atten.dat', 'C_atten.dat'] == b.atten_files
+    d = b.simulate([21500], b.get_masks([cart_ids]), p0=6.52)['d'][0, 0]
+    assert abs(d - c.d) < 1e-10
+    assert abs(d - be) > 0.1
+    t = Transfocator(beamline='test', cart_ids=cart_ids, energy=21500, p0=6.52)
+    assert abs(t.get_result()['d'] - c.d) < 1e-10
+
+
+def test_atten_files():
+    assert ['Si_atten.dat'] == CRLBatch(data_file='Si_delta.dat').atten_files
+    with pytest.raises(Exception) as e:
+        CRLBatch(data_file='be.dat')
+    assert 'be.dat' in str(e.value)
+
+
+def test_transmission():
+    b = CRLBatch()
+    masks = b.get_masks([['6'], ['2', '4', '6', '7', '8']])
+    r = b.simulate([8000., 21500.], masks, p0=6.52)
+    # Direct integration of the absorption over the illuminated disk:
+    atten = find_characteristic_values(21500, 'Be_atten.dat', characteristic='atten')
+    aperture = min(6.52 * np.tan(b.teta0), b.apertures[5])
+    r_ = np.linspace(0, aperture, 100001)
+    y = np.exp(-b.lens_numbers[5] * (r_ ** 2 / b.radii[5] + b.web_thickness) / atten) * 2 * r_ / aperture ** 2
+    assert abs(np.sum((y[1:] + y[:-1]) / 2 * np.diff(r_)) - r['transmission'][1, 0]) < 1e-8
+    assert (r['transmission'][:, 1] < r['transmission'][:, 0]).all()
+    assert (r['transmission'][0] < r['transmission'][1]).all()
+    assert (r['gain'] > 1).all()
+    assert (r['effective_aperture'] < 2 * aperture).all()
+
+
+def test_simulate_planes():
+    cart_ids = ['2', '4', '6', '7', '8']
+    d = simulate.simulate_crl(cart_ids, 21500, p0=6.52)
+    r = simulate.simulate_planes(cart_ids, 21500, p0=6.52)
+    assert r['d_h'] == r['d_v']
+    assert abs(r['d_h'] - d['d']) < 1e-10
+    assert r['lens_number_v'] == 31
+
+
+def test_simulate_planes_1d(tmpdir, monkeypatch):
+    reference = CRLBatch()
+    _write_config(tmpdir, monkeypatch, {'2': {'plane': 'h'}})
+    b = CRLBatch(beamline='test')
+    energies = np.array([9000., 21500.])
+    masks = b.get_masks([['2'], ['2', '4', '6', '7', '8'], ['4', '6']], planes=True)
+    r = b.simulate_planes(energies, masks, p0=6.52, teta0_v=2e-5)
+    h = reference.simulate(energies, masks, p0=6.52)
+    assert np.allclose(r['d_h'], h['d'])
+    # Cartridge 2 is a drift in the vertical plane, so the image is the virtual source:
+    assert np.allclose(r['p1_v'][:, 0], -(6.52 + (b.lens_numbers[1] - 1) * b.dl_lens))
+    assert (r['p1_v'][:, 1] != r['p1_h'][:, 1]).all()
+    assert np.allclose(r['d_v'][:, 2], reference.simulate(energies, masks[2:], p0=6.52, teta0=2e-5)['d'][:, 0])
+    assert [2, 31, 20] == r['lens_number_h'].tolist()
+    assert [0, 29, 20] == r['lens_number_v'].tolist()
+
+
+def test_planes_rejected(tmpdir, monkeypatch):
+    _write_config(tmpdir, monkeypatch, {'2': {'plane': 'h'}})
+    msg = 'Cartridge <2> focuses in the <h> plane only, use simulate_planes.'
+    b = CRLBatch(beamline='test')
+    for f in (
+        lambda: b.get_masks([['2', '4']]),
+        lambda: b.simulate([21500.]),
+        lambda: LookupTable(table_dir=str(tmpdir.join('table')), beamline='test'),
+        lambda: plan_energy_scan(beamline='test', energies=[21500.]),
+        lambda: CRLSimulator(beamline='test', cart_ids=['2', '4'], energy=21500),
+        lambda: crl_simulator.simulate(beamline='test', cart_ids=['2'], energy=21500),
+        lambda: Transfocator(beamline='test', cart_ids=['2'], energy=21500),
+        lambda: Transfocator(beamline='test', energy=21500).insert('2'),
+    ):
+        with pytest.raises(Exception) as e:
+            f()
+        assert msg == str(e.value)
+    # The sets without the cartridge are not affected:
+    c = CRLSimulator(beamline='test', cart_ids=['4', '6'], energy=21500, p0=6.52)
+    assert abs(b.simulate([21500.], b.get_masks([['4', '6']]), p0=6.52)['d'][0, 0] - c.d) < 1e-10
+    assert ['4'] == Transfocator(beamline='test', cart_ids=['4'], energy=21500).remove('2')['cart_ids']
+
+
+def _write_config(tmpdir, monkeypatch, changes):
+    with open(os.path.join(crl_batch.CONFIG_DIR, 'smi_crl.json')) as f:
+        config = json.load(f)
+    for x in config['crl']:
+        x.update(changes.get(x['id'], {}))
+    with open(str(tmpdir.join('test_crl.json')), 'w') as f:
+        json.dump(config, f)
+    for m in crl_batch, crl_simulator, transfocator:
+        monkeypatch.setattr(m, 'CONFIG_DIR', str(tmpdir))
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+import collections
+import contextlib
+import io
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+from bnlcrl import crl_simulator, delta_finder, optics
+from bnlcrl.crl_simulator import CRLResult, CRLSimulator, find_delta, simulate
+from bnlcrl.delta_finder import DeltaFinder, find_characteristic
+
+CART_IDS_LIST = [['2', '4', '6', '7', '8'], ['4', '6'], ['1'], ['2', '3', '5']]
+ENERGIES = [8000., 12000., 21500., 28000.]
+
+
+def test_delta_cache(monkeypatch):
+    monkeypatch.setattr(crl_simulator, 'DELTA_CACHE_SIZE', 2)
+    monkeypatch.setattr(crl_simulator, '_deltas', collections.OrderedDict())
+    for e in (8000., 12000., 8000., 21500.):
+        find_delta(e, 'Be_delta.dat')
+    # The least recently used energy is dropped:
+    assert [8000., 21500.] == [x[1] for x in crl_simulator._deltas]
+
+
+def test_save_to_file(tmpdir, monkeypatch):
+    formulas = []
+
+    def request_content(formula, *args, **kwargs):
+        formulas.append(formula)
+        return 'header\nheader\n{}\n'.format(formula)
+
+    monkeypatch.setattr(delta_finder, 'request_content', request_content)
+    outfile = str(tmpdir.join('out.dat'))
+    DeltaFinder(formula='Be,Si', outfile=outfile)
+    # Every element is requested separately for each chunk:
+    assert ['Be', 'Si'] * 6 == formulas
+    with open(outfile) as f:
+        assert 'Si' in f.read()
+
+
+def test_simulate():
+    kwargs = {'cart_ids': ['2', '4', '6', '7', '8'], 'energy': 21500, 'p0': 6.52}
+    r = simulate(**kwargs)
+    assert isinstance(r, CRLResult)
+    c = CRLSimulator(**kwargs)
+    for k in r._fields:
+        assert getattr(c, k) == getattr(r, k)
+    assert abs(r.d - 0.00120167289264) < 1e-12
+    r = simulate(cart_ids=[], energy=21500)
+    assert r.T is None and 0 == r.d
+
+
+def test_wrappers():
+    # The methods of the class recalculate the results from the attributes:
+    for use_numpy in (False, True):
+        c = CRLSimulator(cart_ids=['2', '4', '6', '7', '8'], energy=21500, p0=6.52, use_numpy=use_numpy)
+        assert use_numpy == c.use_numpy and c.available_libs['numpy']
+        expected = (c.y, c.teta, c.p1, c.f, c.p1_ideal)
+        c.y = c.teta = c.p1 = c.f = c.p1_ideal = None
+        c.calc_y_teta()
+        c.calc_real_lens()
+        c.calc_ideal_lens()
+        assert expected == (c.y, c.teta, c.p1, c.f, c.p1_ideal)
+        T = c.calc_lens_array(c.radii[0], 8)
+        expected = optics.to_nested(optics.lens_array(c.radii[0], 8, c.delta, c.dl_lens))
+        for i, j in itertools.product(range(2), range(2)):
+            assert abs(T[i][j] - expected[i][j]) < 1e-12
+
+
+def test_thread_pool():
+    # Every thread gets the same results as one thread does:
+    cases = list(itertools.product(CART_IDS_LIST, ENERGIES, (6.2, 6.52), (False, True)))
+
+    def f(case):
+        cart_ids, energy, p0, use_numpy = case
+        r = simulate(cart_ids=cart_ids, energy=energy, p0=p0, use_numpy=use_numpy)
+        delta = find_characteristic(energy=energy, data_file='Be_delta.dat', precise=True, use_numpy=use_numpy)
+        return r.p1, r.d, r.d_ideal, delta.characteristic_value, delta.closest_energy
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        expected = [f(x) for x in cases]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            for _ in range(5):
+                assert expected == list(executor.map(f, cases))
+        for case, e in zip(cases, expected):
+            cart_ids, energy, p0, use_numpy = case
+            c = CRLSimulator(cart_ids=cart_ids, energy=energy, p0=p0, use_numpy=use_numpy)
+            assert (c.p1, c.d, c.d_ideal) == e[:3]
+            d = DeltaFinder(energy=energy, data_file='Be_delta.dat', precise=True, use_numpy=use_numpy)
+            assert (d.characteristic_value, d.closest_energy) == e[3:]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+import pytest
+from bnlcrl.crl_batch import CRLBatch
+from bnlcrl.inverse_solver import solve
+
+
+def test_solve_energy():
+    cart_ids_list = [['2', '4', '6', '7', '8'], ['4', '6'], ['1']]
+    r = solve(cart_ids_list, p0=6.52)
+    assert r['converged'].all()
+    assert np.allclose(r['residual'], 0, atol=1e-8)
+    assert abs(r['solution'][0] - 21512.1) < 1
+
+
+def test_solve_p0():
+    cart_ids_list = [['2', '6'], ['4', '6'], ['1']]
+    r = solve(cart_ids_list, variable='p0', energy=21500, target=0.1)
+    b = CRLBatch()
+    found = np.isfinite(r['solution'])
+    assert found[:2].all()
+    assert r['converged'][found].all()
+    for cart_ids, p0 in zip(np.array(cart_ids_list, dtype=object)[found], r['solution'][found]):
+        d = b.simulate([21500], b.get_masks([cart_ids]), p0=p0)['d'][0, 0]
+        assert abs(d - 0.1) < 1e-8
+    with pytest.raises(Exception):
+        solve(cart_ids_list, variable='p0')
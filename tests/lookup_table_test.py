@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+import json
+import os
+import threading
+
+from bnlcrl import lookup_table
+from bnlcrl.crl_simulator import CRLSimulator, DEFAULTS_FILE
+from bnlcrl.lookup_table import LookupTable, META_FILE, find_configuration
+from bnlcrl.utils import read_parameters
+
+ndigits = 10
+
+
+def test_find_configuration(tmpdir):
+    t = LookupTable(table_dir=str(tmpdir), e_min=21000, e_max=22000, e_step=100, p0=6.52)
+    r = t.find_configuration(21480, target=0.)
+    assert 21500 == r['energy']
+    c = CRLSimulator(cart_ids=r['cart_ids'], energy=21500, p0=6.52)
+    assert round(c.d, ndigits) == round(r['d'], ndigits)
+    assert round(c.p1, ndigits) == round(r['p1'], ndigits)
+    assert abs(r['d']) == abs(t.arrays['d'][t.arrays['energies'] == 21500]).min()
+    assert 0 < r['transmission'] < 1
+
+
+def test_rebuild(tmpdir):
+    t = LookupTable(table_dir=str(tmpdir), e_min=21000, e_max=22000, e_step=500)
+    meta_file = os.path.join(str(tmpdir), META_FILE)
+    meta = t.meta
+    with open(meta_file, 'w') as f:
+        json.dump({}, f)
+    t = LookupTable(table_dir=str(tmpdir), e_min=21000, e_max=22000, e_step=500)
+    with open(meta_file) as f:
+        assert meta == json.load(f)
+    assert 3 == len(t.arrays['energies'])
+
+
+def test_model_parameters(tmpdir):
+    r = find_configuration(energy=21500, table_dir=str(tmpdir))
+    # The table is rebuilt for another lens profile:
+    r2 = find_configuration(energy=21500, table_dir=str(tmpdir), web_thickness=1e-4)
+    assert r['cart_ids'] == r2['cart_ids']
+    assert r2['transmission'] < r['transmission']
+    # The options of find_configuration refer to the defaults of the batch model:
+    p = read_parameters(DEFAULTS_FILE, 'find_configuration')
+    assert read_parameters(DEFAULTS_FILE, section='batch_parameters')['web_thickness'] == p['web_thickness']
+
+
+def test_concurrent_first_calls(monkeypatch, tmpdir):
+    builds = []
+    build = LookupTable.build
+    monkeypatch.setattr(LookupTable, 'build', lambda self: builds.append(1) or build(self))
+    monkeypatch.setattr(lookup_table, '_tables', {})
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(find_configuration(energy=21500, table_dir=str(tmpdir))))
+        for _ in range(4)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert 1 == len(builds)
+    assert 1 == len(lookup_table._tables)
+    assert 4 == len(results) and all(x == results[0] for x in results)
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+import os
+import subprocess
+import sys
+from array import array
+
+import numpy as np
+import pytest
+from bnlcrl import optics
+from bnlcrl.crl_simulator import CRLSimulator
+
+
+def test_lens_array():
+    c = CRLSimulator(cart_ids=['2', '4', '6', '7', '8'], energy=21500, p0=6.52, use_numpy=True)
+    for radius, n in ((5e-5, 16), (5e-4, 1), (2e-4, 8)):
+        expected = c.calc_lens_array(radius, n)
+        assert np.allclose(expected, optics.to_nested(optics.lens_array(radius, n, c.delta, c.dl_lens)), rtol=1e-13)
+
+
+def test_simulator():
+    kwargs = {'cart_ids': ['2', '4', '6', '7', '8'], 'energy': 21500, 'p0': 6.52}
+    a = CRLSimulator(**kwargs)
+    b = CRLSimulator(use_numpy=True, **kwargs)
+    assert np.allclose(a.T, b.T, rtol=1e-13)
+    assert abs(a.d - b.d) < 1e-12
+
+
+def test_mul_array():
+    rng = np.random.RandomState(0)
+    a = rng.standard_normal((10, 2, 2))
+    b = rng.standard_normal((10, 2, 2))
+    out = optics.mul_array(array('d', a.ravel()), array('d', b.ravel()))
+    assert np.allclose(np.matmul(a, b).ravel(), out)
+    a_flat = array('d', a.ravel())
+    optics.mul_array(a_flat, array('d', b.ravel()), out=a_flat)
+    assert list(out) == list(a_flat)
+    assert optics.IDENTITY == optics.power(tuple(a[0].ravel()), 0)
+    assert np.allclose(np.linalg.matrix_power(a[0], 5).ravel(), optics.power(tuple(a[0].ravel()), 5))
+    with pytest.raises(Exception):
+        optics.mul_array(array('d', [1.] * 4), array('d', [1.] * 8))
+
+
+def test_without_numpy():
+    # The command starts and falls back to the pure-Python kernel if NumPy cannot be imported:
+    code = '; '.join([
+        'import sys',
+        'sys.modules["numpy"] = None',
+        'from bnlcrl.pkcli import simulate',
+        'print(simulate.simulate_crl(["2", "4", "6", "7", "8"], 21500, p0=6.52, use_numpy=True)["d"])',
+    ])
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+    d = float(subprocess.check_output([sys.executable, '-c', code], env=env).decode())
+    assert abs(d - CRLSimulator(cart_ids=['2', '4', '6', '7', '8'], energy=21500, p0=6.52).d) < 1e-12
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+import pytest
+from bnlcrl.crl_batch import CRLBatch
+from bnlcrl.out_of_core import OutOfCoreSweep, open_sweep
+
+
+def test_resume(tmpdir):
+    energies = np.linspace(20000, 22000, 5)
+    p0 = [5.5, 6.52]
+    teta0 = [3e-5, 6e-5, 9e-5]
+    kwargs = dict(p0=p0, teta0=teta0, chunk_size=1000)
+    s = OutOfCoreSweep(str(tmpdir), energies, **kwargs)
+    assert (5, 2, 3, 255) == s.shape
+    assert 10 == s.n_chunks
+    assert 3 == s.run(max_chunks=3)
+    assert not s.is_complete()
+    # A new process resumes from the first missing chunk:
+    s = OutOfCoreSweep(str(tmpdir), energies, **kwargs)
+    assert 7 == s.run()
+    assert s.is_complete()
+    assert 0 == s.run()
+    r = open_sweep(str(tmpdir))
+    assert r['done'].all()
+    assert isinstance(r['d'], np.memmap)
+    b = CRLBatch()
+    for i, j in ((0, 0), (1, 2)):
+        expected = b.simulate(energies, p0=p0[i], teta0=teta0[j])
+        for key in ('d', 'p1', 'transmission', 'gain'):
+            assert np.allclose(expected[key], r[key][:, i, j, :], rtol=1e-12, equal_nan=True)
+    assert (expected['lens_number'] == r['lens_number']).all()
+    with pytest.raises(Exception):
+        OutOfCoreSweep(str(tmpdir), energies[:-1], **kwargs)
+
+
+def test_cart_ids_list(tmpdir):
+    cart_ids_list = [['2', '4', '6', '7', '8'], ['4', '6']]
+    s = OutOfCoreSweep(str(tmpdir), [21500.], p0=[6.52], cart_ids_list=cart_ids_list, dtype='float32')
+    s.run()
+    r = open_sweep(str(tmpdir))
+    assert np.float32 == r['d'].dtype
+    b = CRLBatch(p0=6.52)
+    expected = b.simulate([21500.], b.get_masks(cart_ids_list))
+    assert np.allclose(expected['d'], r['d'][:, 0, 0, :], rtol=1e-6)
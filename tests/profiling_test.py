@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+import inspect
+import os
+import pstats
+import subprocess
+import sys
+
+from bnlcrl.pkcli import simulate
+
+
+def test_profile(tmpdir, capsys):
+    f = str(tmpdir.join('simulate_crl.pstats'))
+    d = simulate.simulate_crl(['2', '4', '6', '7', '8'], 21500, p0=6.52, profile=f, profile_memory=True)
+    assert simulate.simulate_crl(['2', '4', '6', '7', '8'], 21500, p0=6.52) == d
+    err = capsys.readouterr().err
+    assert 'cumulative time' in err
+    assert 'Peak of the traced memory' in err
+    assert any('crl_simulator.py' in x[0] for x in pstats.Stats(f).stats)
+
+
+def test_signatures():
+    for name in ('calc_ideal_focus', 'find_delta', 'simulate_crl', 'solve_focus'):
+        p = inspect.signature(getattr(simulate, name)).parameters
+        assert '' == p['profile'].default
+        assert p['profile_memory'].default is False
+
+
+def test_lazy_imports():
+    # The core does not need the profilers, tracemalloc is missing on Python 2 and Jython:
+    code = 'import sys, bnlcrl.utils; print(sorted(set(sys.modules) & {"bnlcrl.profiling", "cProfile", "tracemalloc"}))'
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+    assert '[]' == subprocess.check_output([sys.executable, '-c', code], env=env).decode().strip()
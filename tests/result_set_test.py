@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+import csv
+import io
+import json
+
+import numpy as np
+import pytest
+from bnlcrl.crl_batch import CRLBatch
+from bnlcrl.result_set import ResultSet
+
+
+def test_sweep(tmpdir):
+    b = CRLBatch()
+    masks = b.get_masks([['2', '4', '6', '7', '8'], ['1']])
+    rs = b.sweep([20000., 21500.], masks, p0=6.52)
+    assert 4 == len(rs)
+    r = b.simulate([20000., 21500.], masks, p0=6.52)
+    assert r['d'][1, 0] == rs[2]['d']
+    assert '2 4 6 7 8' == rs[2]['cart_ids']
+    assert [20000., 20000., 21500., 21500.] == rs['energy'].tolist()
+
+    rs.to_npz(str(tmpdir.join('sweep.npz')))
+    rs2 = ResultSet.from_npz(str(tmpdir.join('sweep.npz')))
+    assert rs.names == rs2.names
+    assert (rs['cart_ids'] == rs2['cart_ids']).all()
+    assert np.array_equal(rs['p1'], rs2['p1'])
+
+
+def test_writers(tmpdir):
+    rs = ResultSet({
+        'flag': np.array([True, False, True]),
+        'name': np.array(['a', 'b,"c"', 'd']),
+        'value': np.array([1.5, np.nan, 1e-300]),
+    })
+    rs.to_jsonl(str(tmpdir.join('r.jsonl')))
+    with open(str(tmpdir.join('r.jsonl'))) as f:
+        rows = [json.loads(x) for x in f]
+    assert 'b,"c"' == rows[1]['name']
+    assert np.isnan(rows[1]['value'])
+    assert [1.5, 1e-300] == [rows[0]['value'], rows[2]['value']]
+    assert [True, False, True] == [x['flag'] for x in rows]
+    rs.to_csv(str(tmpdir.join('r.csv')))
+    with open(str(tmpdir.join('r.csv'))) as f:
+        rows = list(csv.DictReader(f))
+    assert ['a', 'b,"c"', 'd'] == [x['name'] for x in rows]
+    assert '1e-300' == rows[2]['value']
+    assert 2 == len(rs[rs['flag']])
+    # Mixed values are written as they are, the strings quoted if needed:
+    mixed = np.empty(3, dtype=object)
+    mixed[:] = [0.1, 'x, y', None]
+    out = io.StringIO()
+    ResultSet({'mixed': mixed}).write_csv(out, header=False)
+    assert '0.1\n"x, y"\n\n' == out.getvalue()
+    mixed[:] = [0.1, (1, 2), None]
+    out = io.StringIO()
+    ResultSet({'mixed': mixed, 'value': np.array([np.nan, 1., np.inf])}).write_jsonl(out)
+    rows = [json.loads(x) for x in out.getvalue().splitlines()]
+    assert [0.1, [1, 2], None] == [x['mixed'] for x in rows]
+    assert np.isnan(rows[0]['value']) and [1., np.inf] == [x['value'] for x in rows[1:]]
+    with pytest.raises(Exception):
+        ResultSet({'a': [1, 2], 'b': [1]})
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+import pytest
+from bnlcrl.crl_batch import CRLBatch
+from bnlcrl.pkcli import simulate
+from bnlcrl.scan_planner import _popcount
+
+
+def test_plan_energy_scan():
+    energies = np.linspace(15000, 16000, 40)
+    tolerance = 0.05
+    r = simulate.plan_energy_scan(list(energies), tolerance=tolerance)
+    assert len(energies) == len(r['cart_ids'])
+    assert all(abs(x) <= tolerance for x in r['d'])
+
+    # Brute-force dynamic programming with the full transition matrix:
+    states = np.arange(2 ** 8)
+    masks = (states[:, None] >> np.arange(8)) & 1 == 1
+    ok = np.abs(CRLBatch().simulate(energies, masks)['d']) <= tolerance
+    hamming = _popcount(states[:, None] ^ states[None, :])
+    cost = np.where(ok[0], 0, np.inf)
+    for t in range(1, len(energies)):
+        cost = np.where(ok[t], (cost[:, None] + hamming).min(axis=0), np.inf)
+    assert cost.min() == r['total_moves']
+
+
+def test_plan_energy_scan_initial():
+    r = simulate.plan_energy_scan([21400, 21500, 21600], cart_ids=['2', '6', '7'], tolerance=0.05)
+    assert [['2', '6', '7']] * 3 == r['cart_ids']
+    assert 0 == r['total_moves']
+    with pytest.raises(Exception):
+        simulate.plan_energy_scan([21500], tolerance=1e-9)
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+import pytest
+from bnlcrl.crl_batch import CRLBatch
+from bnlcrl.crl_simulator import CRLSimulator, simulate
+from bnlcrl.sensitivity import calc_sensitivity
+
+
+def _p1(cart_ids, energies, p0=6.52, dl_cart=0.03):
+    b = CRLBatch(dl_cart=dl_cart)
+    return b.simulate(energies, b.get_masks([cart_ids]), p0=p0)['p1'][:, 0]
+
+
+def _simulated_p1(cart_ids, energies, **kwargs):
+    return np.array([simulate(cart_ids=cart_ids, energy=x, **kwargs).p1 for x in energies])
+
+
+def test_sensitivity():
+    cart_ids = ['2', '4', '6', '7', '8']
+    energies = np.array([9000., 15000., 21500.])
+    r = calc_sensitivity(cart_ids, energies, p0=6.52)
+    assert np.allclose(r['p1'], _p1(cart_ids, energies))
+    h = 1e-4
+    fd = (_p1(cart_ids, energies, p0=6.52 + h) - _p1(cart_ids, energies, p0=6.52 - h)) / (2 * h)
+    assert np.allclose(r['dp1_dp0'], fd, rtol=1e-5)
+    h = 1e-6
+    fd = (_p1(cart_ids, energies, dl_cart=0.03 + h) - _p1(cart_ids, energies, dl_cart=0.03 - h)) / (2 * h)
+    assert np.allclose(r['dp1_ddl_cart'], fd, rtol=1e-5)
+    assert np.allclose(r['dd_dp0'], -1 - r['dp1_dp0'])
+    # p1 grows with energy as delta ~ 1/E^2:
+    assert (r['dp1_denergy'] > 0).all()
+    # The nearest lookup of delta is a step function of energy (the table step is ~10 eV), so the difference spans
+    # many table points:
+    h = 500.
+    fd = (_simulated_p1(cart_ids, energies + h, p0=6.52) - _simulated_p1(cart_ids, energies - h, p0=6.52)) / (2 * h)
+    assert np.allclose(r['dp1_denergy'], fd, rtol=1e-2)
+    teta0 = CRLBatch().teta0
+    h = 1e-5
+    fd = (_simulated_p1(cart_ids, energies, p0=6.52, teta0=teta0 + h)
+          - _simulated_p1(cart_ids, energies, p0=6.52, teta0=teta0 - h)) / (2 * h)
+    assert np.allclose(r['dp1_dteta0'], fd, rtol=1e-4)
+
+
+def test_calc_jacobian():
+    c = CRLSimulator(cart_ids=['2', '4', '6', '7', '8'], energy=21500, p0=6.52)
+    j = c.calc_jacobian()
+    r = calc_sensitivity(['2', '4', '6', '7', '8'], [21500], p0=6.52)
+    assert r['dp1_denergy'][0] == j['dp1_denergy']
+    assert 8 == len(j)
+    c.calc_delta = True
+    with pytest.raises(Exception) as e:
+        c.calc_jacobian()
+    assert 'calc_delta' in str(e.value)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import Request, urlopen
+
+import pytest
+from bnlcrl.pkcli import simulate
+from bnlcrl.server import INVALID_PARAMS, METHOD_NOT_FOUND, SimulationServer
+
+
+@pytest.fixture
+def url():
+    s = SimulationServer(port=0, workers=4)
+    t = threading.Thread(target=s.serve_forever)
+    t.start()
+    yield 'http://127.0.0.1:{}/'.format(s.server_address[1])
+    s.shutdown()
+    s.server_close()
+    t.join()
+
+
+def test_simulate_crl(url):
+    params = {'cart_ids': ['2', '4', '6', '7', '8'], 'energy': 21500, 'p0': 6.52}
+    r = _call(url, {'jsonrpc': '2.0', 'method': 'simulate_crl', 'params': params, 'id': 1})
+    assert 1 == r['id']
+    assert simulate.simulate_crl(**params) == r['result']
+    r = _call(url, {'jsonrpc': '2.0', 'method': 'find_delta', 'params': {'energy': 21500, 'data_file': 'Be_delta.dat'},
+                    'id': 2})
+    assert simulate.find_delta(energy=21500, data_file='Be_delta.dat') == r['result']
+
+
+def test_concurrent(url):
+    energies = list(range(20000, 20500, 10))
+
+    def f(energy):
+        params = {'cart_ids': ['2', '4'], 'energy': energy}
+        return _call(url, {'jsonrpc': '2.0', 'method': 'simulate_crl', 'params': params, 'id': energy})
+
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(f, energies))
+    assert energies == [r['id'] for r in results]
+    assert simulate.simulate_crl(['2', '4'], energies[-1])['p1'] == results[-1]['result']['p1']
+    metrics = json.loads(urlopen(url + 'metrics').read().decode('utf-8'))
+    assert len(energies) == metrics['methods']['simulate_crl']['count']
+    assert 0 == metrics['errors']
+
+
+def test_errors(url):
+    r = _call(url, [
+        {'jsonrpc': '2.0', 'method': 'unknown', 'id': 1},
+        {'jsonrpc': '2.0', 'method': 'simulate_crl', 'params': {'energy': 21500}, 'id': 2},
+        {'jsonrpc': '2.0', 'method': 'simulate_crl', 'params': {'cart_ids': ['99'], 'energy': 21500}, 'id': 3},
+        {'jsonrpc': '2.0', 'method': 'simulate_crl', 'params': {'cart_ids': ['1'], 'energy': 21500}},
+        {'jsonrpc': '2.0', 'method': 'simulate_crl', 'params': {'cart_ids': ['1'], 'energy': 21500, 'profile': 'x'},
+         'id': 4},
+        {'jsonrpc': '2.0', 'method': 'simulate_crl', 'params': {'cart_ids': ['1'], 'energy': 21500, 'outfile': 'x'},
+         'id': 5},
+        {'jsonrpc': '2.0', 'method': 'find_delta', 'params': {'energy': 21500, 'save_output': True}, 'id': 6},
+        {'jsonrpc': '2.0', 'method': 'simulate_crl', 'params': {'cart_ids': ['1'], 'energy': 21500, 'verbose': True},
+         'id': 7},
+        {'jsonrpc': '2.0', 'method': 'find_delta', 'params': {'energy': 21500, 'data_file': '/etc/passwd'}, 'id': 8},
+        {'jsonrpc': '2.0', 'method': 'find_delta', 'params': {'energy': 21500, 'data_file': '../json/smi_crl.json'},
+         'id': 9},
+        {'jsonrpc': '2.0', 'method': 'simulate_crl', 'params': {'cart_ids': ['1'], 'energy': 21500,
+                                                                'beamline': '../../../../tmp/x'}, 'id': 10},
+        {'jsonrpc': '2.0', 'method': 'find_energy', 'params': {'values': [1e-6], 'formula': '/tmp/x'}, 'id': 11},
+    ])
+    assert list(range(1, 12)) == [x['id'] for x in r]
+    assert METHOD_NOT_FOUND == r[0]['error']['code']
+    assert INVALID_PARAMS == r[1]['error']['code']
+    assert 'not in the list of available ids' in r[2]['error']['message']
+    assert INVALID_PARAMS == r[3]['error']['code']
+    # No files are written on the server:
+    assert INVALID_PARAMS == r[4]['error']['code']
+    assert 'outfile' in r[4]['error']['message']
+    assert INVALID_PARAMS == r[5]['error']['code']
+    # Nothing is printed on the server:
+    assert 'Parameters <verbose> are not available on the server' == r[6]['error']['message']
+    # Only the package data files are read:
+    for x, key in zip(r[7:], ('data_file', 'data_file', 'beamline', 'formula')):
+        assert INVALID_PARAMS == x['error']['code']
+        assert 'Parameters <{}> must name the package data files'.format(key) == x['error']['message']
+
+
+def _call(url, body):
+    r = urlopen(Request(url, json.dumps(body).encode('utf-8'), {'Content-Type': 'application/json'}))
+    return json.loads(r.read().decode('utf-8'))
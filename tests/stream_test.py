@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+import csv
+import io
+import json
+
+from bnlcrl import stream
+from bnlcrl.pkcli import simulate
+from bnlcrl.stream import process_lines
+
+LINES = [
+    '{"cart_ids": ["99"], "energy": 21500}\n',
+    '{"cart_ids": ["2", "4", "6", "7", "8"], "energy": 21500, "p0": 6.52}\n',
+    '\n',
+    'not json\n',
+    '{"method": "calc_ideal_focus", "radius": 5e-5, "n": 31, "delta": 7e-7, "p0": 6.2}\n',
+]
+
+
+def test_jsonl(tmpdir):
+    infile = str(tmpdir.join('in.jsonl'))
+    outfile = str(tmpdir.join('out.jsonl'))
+    with open(infile, 'w') as f:
+        f.writelines(LINES)
+    simulate.batch(infile=infile, outfile=outfile)
+    with open(outfile) as f:
+        rows = [json.loads(x) for x in f]
+    assert [1, 2, 4, 5] == [x['line'] for x in rows]
+    assert 'not in the list of available ids' in rows[0]['error']
+    assert simulate.simulate_crl(['2', '4', '6', '7', '8'], 21500, p0=6.52) == rows[1]['result']
+    assert 'error' in rows[2]
+    assert simulate.calc_ideal_focus(radius=5e-5, n=31, delta=7e-7, p0=6.2) == rows[3]['result']
+
+
+def test_csv():
+    out = io.StringIO()
+    r = process_lines(iter(LINES), out, simulate.METHODS, output_format='csv')
+    assert {'count': 4, 'errors': 3} == r
+    rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+    assert ['1', '2', '4', '5'] == [x['line'] for x in rows]
+    assert rows[0]['error'] and not rows[1]['error']
+    assert 0.0012016728926 == round(float(rows[1]['d']), 13)
+    # The result of calc_ideal_focus has columns not in the header of simulate_crl:
+    assert 'not in the CSV header' in rows[3]['error']
+
+
+def test_csv_pending(monkeypatch):
+    monkeypatch.setattr(stream, 'MAX_PENDING', 1)
+    out = io.StringIO()
+    r = process_lines(iter(LINES[3:4] + LINES[:2]), out, simulate.METHODS, output_format='csv')
+    assert {'count': 3, 'errors': 3} == r
+    rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+    assert ['line', 'error'] == list(rows[0].keys())
+    assert ['1', '2', '3'] == [x['line'] for x in rows]
+    assert all(x['error'] for x in rows)
+
+
+def test_chunks(monkeypatch):
+    expected = {}
+    for output_format in stream.OUTPUT_FORMATS:
+        expected[output_format] = io.StringIO()
+        process_lines(iter(LINES), expected[output_format], simulate.METHODS, output_format=output_format)
+    # The output does not depend on the number of rows written at once:
+    monkeypatch.setattr(stream, 'WRITE_ROWS', 1)
+    for output_format in stream.OUTPUT_FORMATS:
+        out = io.StringIO()
+        process_lines(iter(LINES), out, simulate.METHODS, output_format=output_format)
+        assert expected[output_format].getvalue() == out.getvalue()
+
+
+def test_excluded_parameters(capsys, tmpdir):
+    outfile = str(tmpdir.join('out.dat'))
+    lines = [
+        '{"cart_ids": ["2", "4", "6"], "energy": 21500, "verbose": true}\n',
+        '{"cart_ids": ["2", "4", "6"], "energy": 21500, "outfile": "' + outfile + '", "save_output": true}\n',
+        '{"method": "find_delta", "energy": 21500, "data_file": "Be_delta.dat", "profile": "' + outfile + '"}\n',
+    ]
+    out = io.StringIO()
+    assert {'count': 3, 'errors': 3} == process_lines(iter(lines), out, simulate.METHODS)
+    rows = [json.loads(x) for x in out.getvalue().splitlines()]
+    assert 'Parameters <verbose> are not available in a stream' == rows[0]['error']
+    assert 'Parameters <outfile, save_output> are not available in a stream' == rows[1]['error']
+    assert 'Parameters <profile> are not available in a stream' == rows[2]['error']
+    # Nothing printed or written besides the rows:
+    assert '' == capsys.readouterr().out
+    assert not tmpdir.join('out.dat').exists()
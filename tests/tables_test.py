@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+from bnlcrl import tables
+
+
+def test_find_energies_round_trip():
+    targets = np.geomspace(1e-7, 1e-2, 1000)
+    for data_file in ('Be_delta.dat', 'Mo_delta.dat', 'W_delta.dat'):
+        indices, energies = tables.find_energies(targets, data_file)
+        values = tables.find_characteristic_values(energies, data_file, interpolate=True)
+        assert np.allclose(values, targets[indices], rtol=1e-8, atol=0)
+        # Sorted by the target, then by the energy:
+        assert (np.diff(indices) >= 0).all()
+        assert (np.diff(energies)[np.diff(indices) == 0] > 0).all()
+
+
+def test_find_energies_segments(tmpdir):
+    # Two solutions around the maximum, the maximum itself is found once, the ones out of range have none:
+    v = [1., 3., 2., 0.5]
+    assert [(0, 1), (1, 3)] == tables.find_segments(np.array(v))
+    f = tmpdir.join('X_delta.dat')
+    f.write(' X Density=1.0\n Energy(eV), Delta, Beta\n')
+    f.write(''.join('{} {} 0\n'.format(10. * (i + 1), x) for i, x in enumerate(v)), mode='a')
+    indices, energies = tables.find_energies([2., 3., 5., 0.75], str(f))
+    assert [0, 0, 1, 3] == indices.tolist()
+    assert np.allclose([15., 30., 20., 30. + 10. * 1.25 / 1.5], energies)
+
+
+def test_find_energy():
+    from bnlcrl.pkcli import simulate
+
+    r = simulate.find_energy([1e-5, 1.], formula='Be')
+    assert 'Be_delta.dat' == r['data_file']
+    # Crossed at both sides of the K edge of Be and at the hard X-rays:
+    assert 3 == len(r['energies'][0])
+    assert [] == r['energies'][1]
+    d = simulate.find_delta(r['energies'][0][-1], data_file='Be_delta.dat')['characteristic_value']
+    assert abs(d / 1e-5 - 1) < 1e-3
+    r = simulate.find_energy([1e-3], characteristic='atten')
+    a = simulate.find_delta(r['energies'][0][0], characteristic='atten', data_file='Be_atten.dat')
+    assert abs(a['characteristic_value'] / 1e-3 - 1) < 1e-2
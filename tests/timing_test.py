@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+import threading
+
+from bnlcrl import timing
+from bnlcrl.pkcli import simulate
+
+
+def test_disabled():
+    assert not timing.enabled()
+    assert timing.NO_SPAN is timing.span('test')
+    with timing.span('test'):
+        timing.count('test')
+    assert {'counters': {}, 'spans': {}} == timing.stats()
+    assert 'stats' not in simulate.simulate_crl(['2', '4'], 21500, p0=6.52)
+
+
+def test_enable():
+    timing.enable()
+    try:
+        simulate.simulate_crl(['2', '4', '6'], 21500, p0=6.52)
+        simulate.find_delta(21500, data_file='Be_delta.dat')
+        s = timing.stats()
+    finally:
+        timing.enable(False)
+        timing.reset()
+    assert 1 == s['spans']['crl_simulator.calc_T_total']['count']
+    assert s['counters'].get('utils.json_reads', 0) == s['spans'].get('utils.read_json', {}).get('count', 0)
+    # The configs are shared once read:
+    assert s['counters']['utils.config_cache_hits']
+    assert 'delta_finder.parse' in s['spans'] or s['counters']['delta_finder.cache_hits']
+
+
+def test_record():
+    r = simulate.simulate_crl(['2', '4', '6', '7', '8'], 21500, p0=6.52, timing=True)
+    assert set(r) == set(simulate.simulate_crl(['2', '4', '6', '7', '8'], 21500, p0=6.52)) | {'stats'}
+    s = r['stats']
+    for k in ('crl_simulator.calc_T_total', 'crl_simulator.find_delta'):
+        assert s['spans'][k]['seconds'] >= s['spans'][k]['max_seconds'] > 0
+    assert 'crl_simulator.print_result' not in s['spans']
+    c = s['counters']
+    assert 1 == c.get('crl_simulator.delta_cache_hits', 0) + c.get('crl_simulator.delta_cache_misses', 0)
+    s = simulate.find_delta(21500, data_file='Be_delta.dat', timing=True)['stats']
+    assert 1 == s['counters'].get('delta_finder.cache_hits', 0) + s['counters'].get('delta_finder.file_reads', 0)
+    # Nothing is added to the totals unless enabled:
+    assert {'counters': {}, 'spans': {}} == timing.stats()
+
+
+def test_threads():
+    results = {}
+
+    def f(name, n):
+        with timing.record() as r:
+            for _ in range(n):
+                timing.count(name)
+        results[name] = r.get()
+
+    threads = [threading.Thread(target=f, args=('t{}'.format(i), i + 1)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for i in range(4):
+        assert {'t{}'.format(i): i + 1} == results['t{}'.format(i)]['counters']
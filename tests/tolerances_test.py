@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+from bnlcrl.pkcli import simulate
+from bnlcrl.tolerances import run_monte_carlo
+
+ndigits = 10
+
+
+def test_nominal():
+    d = simulate.simulate_crl(['2', '4', '6', '7', '8'], 21500, p0=6.52)
+    r = run_monte_carlo(['2', '4', '6', '7', '8'], 21500, n_trials=100, radius_error=0, dl_lens_error=0,
+                        offset_error=0, dl_cart_error=0, p0=6.52)
+    assert round(d['d'], ndigits) == round(r['d_nominal'], ndigits)
+    assert round(d['p1'], ndigits) == round(r['d_mean'] + r['p1_mean'] - r['d_nominal'], ndigits)
+    assert 0 == round(r['d_std'], ndigits)
+
+
+def test_reproducible():
+    a = run_monte_carlo(['2', '4', '6', '7', '8'], 21500, n_trials=25000, seed=3, processes=1)
+    b = run_monte_carlo(['2', '4', '6', '7', '8'], 21500, n_trials=25000, seed=3, processes=2)
+    assert (a['d'] == b['d']).all()
+    assert a['d_percentiles'] == b['d_percentiles']
+    assert 0 < a['d_std'] < 0.05
+
+
+def test_calc_tolerances():
+    r = simulate.calc_tolerances(['2', '4', '6', '7', '8'], 21500, n_trials=1000)
+    assert 1000 == r['n_trials']
+    assert r['d_percentiles']['5'] < r['d_percentiles']['50'] < r['d_percentiles']['95']
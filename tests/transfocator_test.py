@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+import pytest
+from bnlcrl.pkcli import simulate
+from bnlcrl.transfocator import Transfocator
+
+ndigits = 10
+
+
+def test_transfocator_toggle():
+    t = Transfocator(energy=21500, p0=6.52)
+    for cart_id in ['8', '2', '7', '4', '1', '6']:
+        t.insert(cart_id)
+    r = t.remove('1')
+    d = simulate.simulate_crl(['2', '4', '6', '7', '8'], 21500, p0=6.52)
+    assert ['2', '4', '6', '7', '8'] == r['cart_ids']
+    assert round(d['d'], ndigits) == round(r['d'], ndigits)
+    assert round(d['f'], ndigits) == round(r['f'], ndigits)
+    assert round(d['p1'], ndigits) == round(r['p1'], ndigits)
+
+
+def test_transfocator_empty():
+    t = Transfocator(cart_ids=['3'], energy=24000)
+    r = t.toggle('3')
+    assert [] == r['cart_ids']
+    assert 0 == r['d']
+    assert 0 == r['p1']
+    with pytest.raises(Exception):
+        t.insert('9')
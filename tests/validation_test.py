@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+import math
+
+import numpy as np
+import pytest
+from bnlcrl import delta_finder, validation
+
+
+def test_summarize():
+    e = np.array([10., 20., 30., 40., 50.])
+    r = validation.summarize(e, np.array([0.1, -0.3, 0.2, 0.4, -0.5]), (10., 30., 45., 50., 60.))
+    assert [2, 2, 0, 1] == [x['count'] for x in r]
+    assert abs(r[0]['mean'] + 0.1) < 1e-12
+    assert abs(r[0]['mean_abs'] - 0.2) < 1e-12
+    assert abs(r[1]['rms'] - math.sqrt(0.1)) < 1e-12
+    assert math.isnan(r[2]['mean'])
+    assert 0.5 == r[3]['max_abs']
+
+    # The bands do not cover the grid (the last band includes its upper edge):
+    r = validation.summarize(e, np.array([0.1, 0.1, 5., 5., 5.]), (10., 30.))
+    assert 3 == r[0]['count']
+    assert abs(r[0]['mean'] - 5.2 / 3) < 1e-12
+    r = validation.summarize(e, np.array([5., 0.1, 0.2, 0.3, 5.]), (20., 40.))
+    assert 3 == r[0]['count']
+    assert abs(r[0]['mean'] - 0.2) < 1e-12
+    assert abs(r[0]['max_abs'] - 0.3) < 1e-12
+
+
+def test_validate():
+    pytest.importorskip('periodictable')
+    report, errors = validation.validate()
+    assert 11 == len(report)
+    assert 1.848 == report['Be']['density']
+    assert 'SiO2' in report
+    for k, v in report.items():
+        assert len(validation.BANDS) - 1 == len(v['bands'])
+        assert v['overall']['count'] == sum(x['count'] for x in v['bands'])
+    # The approximation holds for the light materials far from the absorption edges:
+    for k in ('B', 'Be', 'C', 'Li'):
+        assert report[k]['bands'][-1]['max_abs'] < 0.01
+    # Same formula as find_delta --calc-delta:
+    e = [x for x in errors if x['formula'] == 'Be'][0]
+    d = delta_finder.analytic_delta(e['energy'][-1], 1.848, 4 / 9.012182)
+    assert abs(d - e['analytic'][-1]) / d < 1e-6
+
+
+def test_default_command(tmpdir, capsys):
+    pytest.importorskip('periodictable')
+    from bnlcrl.pkcli import validate
+
+    validate.default_command(outdir=str(tmpdir), bands=[1000., 10000., 30000.])
+    assert 'Be ' in capsys.readouterr().out
+    assert tmpdir.join('delta_validation.json').check()
+    lines = tmpdir.join('delta_validation.csv').readlines()
+    assert 1 + 11 * 2 == len(lines)
+    assert lines[0].startswith('formula,e_min,e_max,count')
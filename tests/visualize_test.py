@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+import os
+
+import numpy as np
+import pytest
+from bnlcrl import visualize
+from bnlcrl.delta_finder import DAT_DIR
+
+
+def _read(element):
+    with open(os.path.join(DAT_DIR, '{}_delta.dat'.format(element))) as f:
+        return f.read()
+
+
+def test_decimate_lttb():
+    x = np.linspace(0, 10, 100001)
+    y = np.sin(x) + (x == x[54321])
+    idx = visualize.decimate_lttb(x, y, 500)
+    assert 500 == len(idx)
+    assert 0 == idx[0] and len(x) - 1 == idx[-1]
+    assert (np.diff(idx) > 0).all()
+    # The spike is the largest triangle of its bucket:
+    assert 54321 in idx
+
+
+def test_decimate_minmax():
+    y = np.random.RandomState(1).normal(size=100003)
+    idx = visualize.decimate_minmax(y, 1000)
+    assert len(idx) <= 2002
+    assert (np.diff(idx) > 0).all()
+    assert np.argmin(y) in idx and np.argmax(y) in idx
+    assert 0 == idx[0] and len(y) - 1 == idx[-1]
+    assert 10 == len(visualize.decimate(np.arange(10), np.arange(10), 100))
+    with pytest.raises(Exception):
+        visualize.decimate(np.arange(10), np.arange(10), 4, decimation='unknown')
+
+
+def test_parse_data(tmpdir):
+    data, columns = visualize.parse_data([_read('Be'), _read('Al')], ['Be', 'Al'])
+    be = np.loadtxt(os.path.join(DAT_DIR, 'Be_delta.dat'), skiprows=2)
+    al = np.loadtxt(os.path.join(DAT_DIR, 'Al_delta.dat'), skiprows=2)
+    assert ['Energy(eV)', 'Delta Be', 'Delta Al'] == columns
+    assert np.array_equal(np.column_stack([be[:, :2], al[:, 1]]), data)
+    df, _ = visualize.to_dataframe([_read('Be')], ['Be'])
+    assert ['Energy(eV)', 'Delta'] == list(df.columns)
+    f = str(tmpdir.join('data'))
+    visualize.save_to_csv(data, file_name=f, columns=columns)
+    with open(f + '.csv') as f_:
+        assert 'Energy(eV),Delta Be,Delta Al' == f_.readline().strip()
+    assert np.array_equal(data, np.loadtxt(f + '.csv', delimiter=',', skiprows=1))
+    with pytest.raises(Exception):
+        visualize.parse_data([_read('Be'), '\n'.join(_read('Al').split('\n')[:-5])], ['Be', 'Al'])
+
+    # A bad value or lines cut differently are rejected even if the number of values divides by the number of columns:
+    lines = _read('Be').split('\n')
+    for bad in (['  30.  0.211671308  x'], ['  30.  0.211671308', '  30.3  0.206404448  0.026793506  1.']):
+        with pytest.raises(Exception) as e:
+            visualize.parse_data(['\n'.join(lines[:10] + bad + lines[12:])], ['Be'])
+        assert 'Malformed data of <Be>' in str(e.value)